@@ -0,0 +1,83 @@
+"""Measures memory allocated by the hot loops of the server & the client with tracemalloc: bytes allocated by a single
+call (peak) and bytes retained per call after many calls, which has to stay flat.
+
+Exits with status 1 if a loop retains memory. tests/test_allocations.py checks the same loops against allocation budgets.
+
+Usage:
+    $ python3 -m benchmarks.allocations
+"""
+import sys
+import tracemalloc
+from random import choice
+
+from jelly.server import Server
+from jelly.food import FOOD_COLORS
+from benchmarks.common import make_server
+from benchmarks.process_moved import DIRECTIONS
+
+CALLS = 10000
+# Moves change the world, e.g. players enter new cells of the spatial index and eaten food units are replaced by new
+# ones with larger IDs. So a loop may retain a few bytes per call on average, but not the objects it allocates.
+RETAINED_LIMIT = 16
+
+
+def process_moved(server: Server, nicks: list[str]):
+    player = server.players[choice(nicks)]
+    direction = choice(DIRECTIONS)
+    if not player.is_dead and server.is_player_on_map_after_move(player, direction):
+        server.players.move(player, direction)
+        server.process_moved(server.players[player.nick])
+
+
+def client_frame(server: Server, nicks: list[str]):
+    """Accesses the world like Client.game_loop() does to draw a frame."""
+    me = server.players[nicks[0]]
+    me.is_dead, me.xy
+    for x, y, size, kind in server.food.get_food_raw().values():
+        (x, y), size, FOOD_COLORS[kind]
+    for nick, (x, y, size, _, _, color, _) in server.players.get_players_raw().items():
+        (x, y), size, color, size <= 0
+    me.size
+
+
+def measure(function, *args) -> (int, int):
+    """Returns bytes allocated by a single call of `function` at peak & bytes retained per call after `CALLS`
+    calls."""
+    # Warm up caches.
+    for _ in range(1000):
+        function(*args)
+
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    for _ in range(CALLS):
+        function(*args)
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak - start, (end - start) / CALLS
+
+
+def main():
+    server = make_server(100, 1000, 5000, 5000)
+    # Tombstones of the eaten food units are bounded by `max_removed`, but it would take too long to reach the bound.
+    server.changes.max_removed = 0
+    nicks = list(server.players.nicks())
+    loops = [
+        ('Players.__getitem__', lambda: server.players[nicks[0]]),
+        ('Server.process_moved', lambda: process_moved(server, nicks)),
+        ('client frame', lambda: client_frame(server, nicks)),
+    ]
+
+    failed = False
+    print("{:>22} {:>14} {:>14}".format("loop", "per call, B", "retained, B"))
+    for name, function in loops:
+        per_call, retained = measure(function)
+        failed |= retained > RETAINED_LIMIT
+        print("{:>22} {:>14} {:>14.1f}".format(name, per_call, retained))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
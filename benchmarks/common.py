@@ -0,0 +1,20 @@
+"""Helpers shared by the benchmarks."""
+from random import seed
+
+import config as default
+from jelly.server import Server
+
+
+def make_server(players_num: int, food_num: int, width: int, height: int, random_seed: int = 0,
+                vectorized: bool = False, metrics: bool = True) -> Server:
+    """Returns a server that doesn't accept connections with `players_num` players and `food_num` food units spawned
+    at random. Only the game logic is available."""
+    seed(random_seed)
+    server = Server(host=default.HOST, port=default.PORT, food_num=food_num, width=width, height=height,
+                    game_time=default.GAME_TIME, restart_time=default.RESTART_TIME,
+                    food_min_size=default.FOOD_MIN_SIZE, food_max_size=default.FOOD_MAX_SIZE,
+                    food_probability=default.FOOD_PROBABILITY, init_player_size=default.INIT_PLAYER_SIZE,
+                    tick_rate=default.TICK_RATE, vectorized=vectorized, listen=False, metrics=metrics)
+    for i in range(players_num):
+        server.players.spawn('player{}'.format(i), server.rand_coords(), (0, 0, 0))
+    return server
@@ -0,0 +1,72 @@
+"""Compares the bytes saved by compressing the messages sent to a client (see `COMPRESS`) with the CPU time spent on
+it: a few players move every tick, and a client is sent a full snapshot, a JSON delta or a binary delta after each
+tick. One deflate stream per connection (jelly/compression.py) is compared with compressing each message on its own.
+
+Usage:
+    $ python3 -m benchmarks.compression
+"""
+import zlib
+from random import choice, sample
+from time import perf_counter
+
+from jelly.server import Server, Session
+from jelly.compression import Compressor, Decompressor, WBITS
+from benchmarks.common import make_server
+from benchmarks.process_moved import DIRECTIONS
+
+# (players, food units, players moving per tick)
+CONFIGS = [(10, 30, 2), (100, 1000, 10), (1000, 10000, 50)]
+TICKS = 100
+# (name, format, whether the client sends its version)
+STREAMS = [("full json", Server.JSON, False), ("delta json", Server.JSON, True),
+           ("delta binary", Server.BINARY, True)]
+
+
+def compress_alone(payload: bytes) -> bytes:
+    """Compresses `payload` without the previous messages, with the same settings as Compressor."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, WBITS)
+    return compressor.compress(payload) + compressor.flush()
+
+
+def main():
+    print("{:>8} {:>13} {:>10} {:>10} {:>8} {:>10} {:>10} {:>8} {:>10}".format(
+        "players", "messages", "raw, B", "stream, B", "ratio", "stream, us", "alone, B", "ratio", "alone, us"))
+    for players_num, food_num, moving_num in CONFIGS:
+        server = make_server(players_num, food_num, 20000, 20000)
+        nicks = list(server.players.nicks())
+        streams = []
+        for name, format, delta in STREAMS:
+            session = Session()
+            session.format = format
+            streams.append((name, session, delta, Compressor(Server.COMPRESS_THRESHOLD), Decompressor(),
+                            dict(raw=0, stream=0, stream_time=0, alone=0, alone_time=0)))
+        for _ in range(TICKS):
+            for nick in sample(nicks, moving_num):
+                with server.moves_mutex:
+                    server.moves[nick] = choice(DIRECTIONS)
+            server.tick()
+
+            for name, session, delta, compressor, decompressor, totals in streams:
+                payload = server.get_data(session, session.version if delta else None)
+                totals['raw'] += len(payload)
+
+                start = perf_counter()
+                compressed = compressor.compress(payload)
+                totals['stream_time'] += perf_counter() - start
+                totals['stream'] += len(compressed)
+                if compressed is not payload:
+                    assert decompressor.decompress(compressed) == payload
+
+                start = perf_counter()
+                totals['alone'] += len(compress_alone(payload))
+                totals['alone_time'] += perf_counter() - start
+
+        for name, session, delta, compressor, decompressor, totals in streams:
+            print("{:>8} {:>13} {:>10.0f} {:>10.0f} {:>8.2f} {:>10.1f} {:>10.0f} {:>8.2f} {:>10.1f}".format(
+                players_num, name, totals['raw'] / TICKS, totals['stream'] / TICKS, totals['raw'] / totals['stream'],
+                totals['stream_time'] / TICKS * 1e6, totals['alone'] / TICKS, totals['raw'] / totals['alone'],
+                totals['alone_time'] / TICKS * 1e6))
+
+
+if __name__ == '__main__':
+    main()
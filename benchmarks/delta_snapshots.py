@@ -0,0 +1,60 @@
+"""Compares full, delta and view (delta of what a client can see, see `VIEW`) `GET` responses while the world changes:
+a few players move every tick and a client polls the server after each tick, like the real client does.
+
+Usage:
+    $ python3 -m benchmarks.delta_snapshots
+"""
+from json import dumps
+from random import choice, sample
+from time import perf_counter
+
+import config as default
+from jelly.server import Session
+from benchmarks.common import make_server
+from benchmarks.process_moved import DIRECTIONS
+
+# (players, food units, players moving per tick)
+CONFIGS = [(10, 30, 2), (100, 1000, 10), (1000, 10000, 50)]
+TICKS = 100
+
+
+def main():
+    print("{:>8} {:>8} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "players", "food", "moving", "full, B", "delta, B", "view, B", "full, us", "delta, us", "view, us"))
+    for players_num, food_num, moving_num in CONFIGS:
+        server = make_server(players_num, food_num, 20000, 20000)
+        nicks = list(server.players.nicks())
+        session = Session()
+        session.nick, session.view = nicks[0], (default.SCREEN_WIDTH, default.SCREEN_HEIGHT)
+        version = view_version = server.changes.version
+        full_size = delta_size = view_size = full_time = delta_time = view_time = 0
+        for _ in range(TICKS):
+            for nick in sample(nicks, moving_num):
+                with server.moves_mutex:
+                    server.moves[nick] = choice(DIRECTIONS)
+            server.tick()
+
+            start = perf_counter()
+            full_size += len(server.json_get_data())
+            full_time += perf_counter() - start
+
+            start = perf_counter()
+            delta = server.json_get_data(version)
+            delta_time += perf_counter() - start
+            delta_size += len(delta)
+            version = server.changes.version
+
+            start = perf_counter()
+            view = server.snapshot(view_version, session)
+            view_json = dumps(view, default=server._json_date_handler)
+            view_time += perf_counter() - start
+            view_size += len(view_json)
+            view_version = view["version"]
+
+        print("{:>8} {:>8} {:>8} {:>10.0f} {:>10.0f} {:>10.0f} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+            players_num, food_num, moving_num, full_size / TICKS, delta_size / TICKS, view_size / TICKS,
+            full_time / TICKS * 1e6, delta_time / TICKS * 1e6, view_time / TICKS * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Compares the threaded and the asyncio servers: how many concurrent clients each of them serves
+and the 99th percentile of `GET` latency.
+
+Each simulated client spawns a player and sends `GET` every `--period` seconds, like the real client does. Both
+servers send with TCP_NODELAY, which asyncio sets by default, and so do the clients.
+The number of clients is doubled on each step. A step fails if any client got an error or the p99 latency
+exceeded `--limit` seconds.
+
+Usage:
+    $ python3 -m benchmarks.load_test --steps 25 50 100 200 400
+"""
+import argparse
+import asyncio
+import subprocess
+import sys
+from json import loads, dumps
+from time import perf_counter, sleep
+
+from jelly.server import Server
+from jelly.protocol import encode_frame, read_frame
+from jelly.bots import percentile
+
+GET = encode_frame(dumps(Server.GET).encode("UTF-8"))
+
+
+def start_server(port: int, use_asyncio: bool, *options: str) -> subprocess.Popen:
+    """Starts a server with command line `options`, see main.py"""
+    args = [sys.executable, 'main.py', 'server', '--port', str(port), *options]
+    if use_asyncio:
+        args.append('--asyncio')
+    process = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # Wait for the server to start accepting connections.
+    for _ in range(100):
+        try:
+            asyncio.run(asyncio.wait_for(probe(port), 1))
+        except OSError:
+            sleep(0.1)
+        else:
+            return process
+    process.kill()
+    raise RuntimeError("The server hasn't started.")
+
+
+async def probe(port: int) -> None:
+    """Connects to the server and closes the connection, so that it isn't left to the server to time out."""
+    _, writer = await asyncio.open_connection('localhost', port)
+    writer.close()
+    await writer.wait_closed()
+
+
+async def simulate_client(nick: str, port: int, period: float, stop: asyncio.Event, latencies: list, errors: list):
+    try:
+        reader, writer = await asyncio.open_connection('localhost', port)
+        writer.write(encode_frame(dumps({Server.SPAWN: nick}).encode("UTF-8")))
+        while not stop.is_set():
+            start = perf_counter()
+            writer.write(GET)
+            loads(await asyncio.wait_for(read_frame(reader), 10))
+            latencies.append(perf_counter() - start)
+            await asyncio.sleep(period)
+        writer.write(encode_frame(dumps({Server.DISCONNECT: nick}).encode("UTF-8")))
+        await writer.drain()
+        writer.close()
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+        errors.append(e)
+
+
+async def run_step(step: int, clients: int, port: int, period: float, duration: float) -> (float, int, int):
+    """Returns p99 latency, number of served requests and number of failed clients."""
+    stop = asyncio.Event()
+    latencies, errors = [], []
+    tasks = [asyncio.create_task(simulate_client('bot{}-{}'.format(step, i), port, period, stop, latencies, errors))
+             for i in range(clients)]
+    await asyncio.sleep(duration)
+    stop.set()
+    await asyncio.gather(*tasks)
+    return percentile(latencies, 99), len(latencies), len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--steps', type=int, nargs='+', default=[25, 50, 100, 200, 400],
+                        help='Numbers of concurrent clients to try.')
+    parser.add_argument('--period', type=float, default=0.02, help='Delay between two GET requests of a client.')
+    parser.add_argument('--duration', type=float, default=3, help='Duration of a step in seconds.')
+    parser.add_argument('--limit', type=float, default=0.1, help='Max acceptable p99 GET latency in seconds.')
+    parser.add_argument('--port', type=int, default=15130)
+    args = parser.parse_args()
+
+    for use_asyncio in (False, True):
+        mode = 'asyncio' if use_asyncio else 'threaded'
+        port = args.port + use_asyncio
+        server = start_server(port, use_asyncio)
+        max_clients = 0
+        try:
+            print("{} server".format(mode))
+            print("{:>10} {:>12} {:>12} {:>10}".format("clients", "p99, ms", "GET/s", "errors"))
+            for step, clients in enumerate(args.steps):
+                p99, served, failed = asyncio.run(run_step(step, clients, port, args.period, args.duration))
+                print("{:>10} {:>12.1f} {:>12.0f} {:>10}".format(clients, p99 * 1000, served / args.duration,
+                                                                failed))
+                if failed or p99 > args.limit:
+                    break
+                max_clients = clients
+        finally:
+            server.kill()
+            server.wait()
+        print("max concurrent clients: {}\n".format(max_clients))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Measures what collecting the metrics reported by `STATS` (see jelly/metrics.py) costs: the time of a tick and of
+handling `GET` & `MOVE` requests with metrics enabled and disabled.
+
+Usage:
+    $ python3 -m benchmarks.metrics_overhead
+"""
+from json import loads
+from random import Random
+from time import perf_counter
+
+from jelly.server import Server, Session
+from benchmarks.common import make_server
+from benchmarks.process_moved import DIRECTIONS
+
+PLAYERS, FOOD, SIDE = 100, 1000, 5000
+MOVING = 10
+# Number of timed batches per case.
+REPEAT = 7
+
+
+def tick(server: Server, rng: Random):
+    nicks = list(server.players.nicks())
+
+    def run():
+        for nick in rng.sample(nicks, MOVING):
+            server.handle_request({Server.MOVE: [nick, int(rng.choice(DIRECTIONS))]}, Session())
+        server.tick()
+    return run
+
+
+def get(server: Server, rng: Random):
+    session = Session()
+    request = loads('{"GET": null}')
+    return lambda: server.handle_request(request, session)
+
+
+def move(server: Server, rng: Random):
+    nicks = list(server.players.nicks())
+    session = Session()
+    return lambda: server.handle_request({Server.MOVE: [rng.choice(nicks), int(rng.choice(DIRECTIONS))]}, session)
+
+
+# name -> (setup, number of calls per batch)
+CASES = {'tick + 10 MOVE': (tick, 200), 'GET': (get, 5000), 'MOVE': (move, 5000)}
+
+
+def measure(setup, number: int) -> (float, float):
+    """Returns the best times of a call in seconds with metrics disabled & enabled. The batches of both alternate, so
+    that both are slowed down alike by whatever else the machine does."""
+    runs = []
+    for metrics in (False, True):
+        run = setup(make_server(PLAYERS, FOOD, SIDE, SIDE, metrics=metrics), Random(0))
+        run()
+        runs.append(run)
+    times = ([], [])
+    for _ in range(REPEAT):
+        for run, run_times in zip(runs, times):
+            start = perf_counter()
+            for _ in range(number):
+                run()
+            run_times.append((perf_counter() - start) / number)
+    return min(times[0]), min(times[1])
+
+
+def main():
+    print("{} players, {} food units".format(PLAYERS, FOOD))
+    print("{:>16} {:>14} {:>14} {:>10} {:>10}".format("case", "disabled, us", "enabled, us", "added, us", "overhead"))
+    # GET & MOVE are timed without the network, which takes much longer, so their relative overhead is an upper
+    # bound.
+    for name, (setup, number) in CASES.items():
+        disabled, enabled = measure(setup, number)
+        print("{:>16} {:>14.2f} {:>14.2f} {:>10.2f} {:>9.1f}%".format(
+            name, disabled * 1e6, enabled * 1e6, (enabled - disabled) * 1e6, (enabled / disabled - 1) * 100))
+
+
+if __name__ == '__main__':
+    main()
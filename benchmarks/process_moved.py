@@ -0,0 +1,60 @@
+"""Measures how many `MOVE` commands per second the server handles at 100, 1k and 10k entities,
+with and without the spatial index.
+
+Usage:
+    $ python3 -m benchmarks.process_moved
+"""
+from random import choice
+from time import perf_counter
+
+from jelly.server import Server
+from jelly.utils import Direction
+from benchmarks.common import make_server
+
+# A tenth of all the entities are players, the rest is food.
+PLAYERS_SHARE = 0.1
+# Average area of the map per entity, in square pixels.
+AREA_PER_ENTITY = 200 * 200
+# How long to measure each configuration, in seconds.
+DURATION = 1.0
+
+DIRECTIONS = [Direction.LEFT, Direction.UP, Direction.RIGHT, Direction.DOWN,
+              Direction.LEFT | Direction.UP, Direction.RIGHT | Direction.DOWN]
+
+
+def make_indexed_server(entities: int, indexed: bool) -> Server:
+    side = int((entities * AREA_PER_ENTITY) ** 0.5)
+    players_num = max(1, int(entities * PLAYERS_SHARE))
+    server = make_server(players_num, entities - players_num, side, side, random_seed=entities)
+    if not indexed:
+        server.players.grid = None
+        server.food.grid = None
+    return server
+
+
+def moves_per_second(server: Server) -> float:
+    nicks = list(server.players.nicks())
+    moves = 0
+    start = perf_counter()
+    while perf_counter() - start < DURATION:
+        player = server.players[choice(nicks)]
+        direction = choice(DIRECTIONS)
+        if not player.is_dead and server.is_player_on_map_after_move(player, direction):
+            server.players.move(player, direction)
+            # The collisions are checked at the new coordinates, like Server.tick() does.
+            server.process_moved(server.players[player.nick])
+            moves += 1
+    return moves / (perf_counter() - start)
+
+
+def main():
+    print("{:>10} {:>18} {:>18}".format("entities", "full scan, mv/s", "grid, mv/s"))
+    for entities in (100, 1000, 10000):
+        results = []
+        for indexed in (False, True):
+            results.append(moves_per_second(make_indexed_server(entities, indexed)))
+        print("{:>10} {:>18.0f} {:>18.0f}".format(entities, *results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Measures the time the client spends on drawing a frame with & without the render caches (see jelly/render.py),
+depending on the number of players on the screen. Runs headless, with the dummy SDL video driver.
+
+Usage:
+    $ python3 -m benchmarks.rendering
+"""
+import os
+from time import perf_counter
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+import pygame
+
+from jelly import render
+from jelly.client import Client
+from jelly.food import FOOD_COLORS
+from jelly.utils import world2screen, is_circle_on_screen, offset
+from benchmarks.common import make_server
+
+SCREEN_WH = (1280, 720)
+FOOD = 500
+PLAYERS = [10, 100, 1000]
+FRAMES = 50
+
+
+class Uncached:
+    """Draws like the client did before the caches were added."""
+    draw_text = staticmethod(render.draw_text)
+    draw_circle = staticmethod(render.draw_circle)
+
+
+def draw_frame(surface: pygame.Surface, renderer, fonts, players: dict, food: dict, top: list[str]):
+    """Draws what Client.game_loop() draws while the round is on: food, players, their nicks, the HUD and the leader
+    board."""
+    small_font, large_font = fonts
+    surface.fill((0, 0, 0))
+    offset_xy = offset((SCREEN_WH[0] // 2, SCREEN_WH[1] // 2), SCREEN_WH)
+    for x, y, size, kind in food.values():
+        screen_xy = world2screen((x, y), offset_xy)
+        if is_circle_on_screen(screen_xy, size, SCREEN_WH):
+            renderer.draw_circle(surface, screen_xy, size, FOOD_COLORS[kind])
+    for nick, (x, y, size, _, _, color, _) in players.items():
+        screen_xy = world2screen((x, y), offset_xy)
+        if is_circle_on_screen(screen_xy, size, SCREEN_WH):
+            renderer.draw_circle(surface, screen_xy, size, color)
+            renderer.draw_text(surface, large_font, nick, (0, 0, 0), center=screen_xy)
+    renderer.draw_text(surface, small_font, "Time left: 42", topleft=(2, 0), color=(127, 127, 127))
+    renderer.draw_text(surface, small_font, "Size: 42", bottomleft=(2, SCREEN_WH[1] - 1), color=(127, 127, 127))
+    for rank, nick in enumerate(top):
+        renderer.draw_text(surface, small_font, "#{} {}".format(rank + 1, nick),
+                           topleft=(SCREEN_WH[0] - 200, 20 * rank), color=(127, 127, 127))
+
+
+def frame_time(players_num: int, renderer) -> float:
+    """Returns the mean time of a frame in seconds. The whole world fits into the screen."""
+    server = make_server(players_num, FOOD, *SCREEN_WH)
+    players, food = server.players.get_players_raw(), server.food.get_food_raw()
+    top = server.players.top_k(10)
+    surface = pygame.Surface(SCREEN_WH)
+    fonts = Client.render_fonts()
+    # Warm up the caches.
+    draw_frame(surface, renderer, fonts, players, food, top)
+
+    start = perf_counter()
+    for _ in range(FRAMES):
+        draw_frame(surface, renderer, fonts, players, food, top)
+    return (perf_counter() - start) / FRAMES
+
+
+def main():
+    pygame.init()
+    print("{} food units, {}x{} screen".format(FOOD, *SCREEN_WH))
+    print("{:>8} {:>14} {:>14}".format("players", "uncached, ms", "cached, ms"))
+    for players_num in PLAYERS:
+        uncached = frame_time(players_num, Uncached)
+        cached = frame_time(players_num, render.Renderer())
+        print("{:>8} {:>14.2f} {:>14.2f}".format(players_num, uncached * 1000, cached * 1000))
+
+
+if __name__ == '__main__':
+    main()
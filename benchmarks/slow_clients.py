@@ -0,0 +1,87 @@
+"""Checks that stalled clients don't slow down the others: some clients subscribe to the state and request full
+snapshots, but never read anything, while bots subscribe and play normally (see jelly/bots.py). The bots should keep
+receiving a push per tick, and the stalled clients should be disconnected once Server.SEND_QUEUE_SIZE responses are
+queued for them or they haven't received a push for Server.MAX_PUSH_LAG seconds.
+
+Usage:
+    $ python3 -m benchmarks.slow_clients [--bots 20] [--stalled 0 5] [--duration 10] [--asyncio]
+"""
+import argparse
+import socket
+from json import dumps
+
+import config as default
+from jelly.bots import run_bots
+from jelly.connection import Connection
+from jelly.protocol import send_frame
+from jelly.server import Server
+from benchmarks.load_test import start_server
+
+# Lots of food on a large map, so that full snapshots fill the socket buffers quickly, but the bots see little of it.
+SIDE, FOOD = 10000, 20000
+# Full snapshots requested by a stalled client.
+GETS = 100
+
+
+def stall(port: int) -> socket.socket:
+    """Returns a connection of a client that subscribes to the state, requests full snapshots and never reads."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.connect(('localhost', port))
+    send_frame(sock, dumps(Server.SUBSCRIBE).encode("UTF-8"))
+    for _ in range(GETS):
+        send_frame(sock, dumps(Server.GET).encode("UTF-8"))
+    return sock
+
+
+def is_closed(sock: socket.socket) -> bool:
+    """Reads what the server has sent. Returns True if it has closed the connection."""
+    sock.settimeout(1)
+    try:
+        while sock.recv(1 << 20):
+            pass
+    except socket.timeout:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bots', type=int, default=20)
+    parser.add_argument('--stalled', type=int, nargs='+', default=[0, 5])
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--asyncio', action='store_true')
+    args = parser.parse_args()
+
+    print("{:>8} {:>12} {:>14} {:>12} {:>14} {:>14}".format(
+        "stalled", "pushes/s", "pushes/s/bot", "superseded", "queue full", "lagging"))
+    for port, stalled in enumerate(args.stalled, default.PORT + 100):
+        server = start_server(port, args.asyncio, '--food-num', str(FOOD), '--width', str(SIDE),
+                              '--height', str(SIDE))
+        try:
+            socks = [stall(port) for _ in range(stalled)]
+            stats = run_bots(['bot{}'.format(i) for i in range(args.bots)], args.duration, host='localhost',
+                             port=port, get_rate=0, move_rate=10)
+            connection = Connection('localhost', port)
+            connection.send(dumps(Server.STATS).encode("UTF-8"))
+            counters = connection.receive()["counters"]
+            connection.close()
+            closed = sum(is_closed(sock) for sock in socks)
+            for sock in socks:
+                sock.close()
+        finally:
+            server.kill()
+        print("{:>8} {:>12.0f} {:>14.1f} {:>12} {:>14} {:>14}".format(
+            stalled, stats.pushes / args.duration, stats.pushes / args.duration / args.bots,
+            counters.get('pushes_superseded', 0), counters.get('disconnects.send_queue', 0),
+            counters.get('disconnects.push_lag', 0)))
+        if closed != stalled:
+            print("{} of {} stalled clients are still connected".format(stalled - closed, stalled))
+        if stats.errors:
+            print("bot errors: {}".format(dict(stats.errors)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Measures the time the server spends on pushing the state to the subscribed clients (see `SUBSCRIBE`) after a tick
+with & without the shared snapshot cache (see Server.snapshot_cache), depending on the number of clients.
+
+Usage:
+    $ python3 -m benchmarks.snapshot_cache
+"""
+from random import choice, sample
+from time import perf_counter
+
+from jelly.server import Server, Session
+from benchmarks.common import make_server
+from benchmarks.process_moved import DIRECTIONS
+
+PLAYERS, FOOD, MOVING = 100, 1000, 10
+CLIENTS = [1, 10, 100, 1000]
+TICKS = 20
+
+
+def uncached_get_data(server: Server, session: Session, since: int = None) -> bytes:
+    """Encodes the snapshot for a single client like Server.get_data() did before the cache was added."""
+    if session.format == Server.BINARY:
+        data = server.binary_get_data(session, since)
+    else:
+        data = server.json_get_data(since, session).encode("UTF-8")
+    session.version = server.changes.version
+    return data
+
+
+def push_time(clients: int, data_format: str, cached: bool) -> (float, int, int):
+    """Returns the mean time of a push in seconds, numbers of cache hits & misses."""
+    server = make_server(PLAYERS, FOOD, 5000, 5000)
+    nicks = list(server.players.nicks())
+    sessions = []
+    for _ in range(clients):
+        session = Session()
+        session.format = data_format
+        # Initial full snapshot.
+        server.get_data(session)
+        sessions.append(session)
+
+    get_data = server.get_data if cached else lambda session, since: uncached_get_data(server, session, since)
+    total = 0
+    for _ in range(TICKS):
+        for nick in sample(nicks, MOVING):
+            with server.moves_mutex:
+                server.moves[nick] = choice(DIRECTIONS)
+        server.tick()
+
+        start = perf_counter()
+        for session in sessions:
+            get_data(session, session.version)
+        total += perf_counter() - start
+    return total / TICKS, server.snapshot_cache.hits, server.snapshot_cache.misses
+
+
+def main():
+    print("{} players, {} food units, {} moving per tick".format(PLAYERS, FOOD, MOVING))
+    print("{:>8} {:>8} {:>14} {:>14} {:>10} {:>10}".format(
+        "clients", "format", "uncached, ms", "cached, ms", "hits", "misses"))
+    for data_format in (Server.JSON, Server.BINARY):
+        for clients in CLIENTS:
+            uncached, _, _ = push_time(clients, data_format, False)
+            cached, hits, misses = push_time(clients, data_format, True)
+            print("{:>8} {:>8} {:>14.2f} {:>14.2f} {:>10} {:>10}".format(
+                clients, data_format, uncached * 1000, cached * 1000, hits, misses))
+
+
+if __name__ == '__main__':
+    main()
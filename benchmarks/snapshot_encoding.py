@@ -0,0 +1,63 @@
+"""Compares JSON and binary `GET` responses: size and time to encode at the server side & to decode at the client side.
+
+Usage:
+    $ python3 -m benchmarks.snapshot_encoding
+"""
+from datetime import datetime
+from json import loads
+from timeit import Timer
+
+from jelly.server import Session
+from jelly.snapshot import encode_snapshot, decode_snapshot
+from jelly.player import Players
+from jelly.food import Food
+from benchmarks.common import make_server
+
+# (players, food units)
+CONFIGS = [(10, 30), (100, 1000), (1000, 10000)]
+
+
+def best_time(function) -> float:
+    """Returns the best time of a single call of `function` in seconds."""
+    timer = Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=5, number=number)) / number
+
+
+def main():
+    print("{:>8} {:>8} {:>8} {:>12} {:>12} {:>12} {:>12}".format(
+        "players", "food", "format", "size, B", "encode, us", "decode, us", "total, us"))
+    for players_num, food_num in CONFIGS:
+        server = make_server(players_num, food_num, 20000, 20000)
+
+        json_data = server.json_get_data().encode("UTF-8")
+
+        def decode_json():
+            response = loads(json_data.decode("UTF-8"))
+            Players(init=response["players"])
+            Food(init=response["food"])
+            datetime.fromisoformat(response["round_end"])
+
+        # A client receives the nick/color table once, so measure the following snapshots.
+        session = Session()
+        server.binary_get_data(session)
+        binary_data = server.binary_get_data(session)
+        table = dict()
+        decode_snapshot(server.binary_get_data(Session()), table)
+
+        def decode_binary():
+            response = decode_snapshot(binary_data, table)
+            Players(init=response["players"])
+            Food(init=response["food"])
+
+        results = [
+            ('json', len(json_data), best_time(server.json_get_data), best_time(decode_json)),
+            ('binary', len(binary_data), best_time(lambda: server.binary_get_data(session)), best_time(decode_binary)),
+        ]
+        for name, size, encode, decode in results:
+            print("{:>8} {:>8} {:>8} {:>12} {:>12.1f} {:>12.1f} {:>12.1f}".format(
+                players_num, food_num, name, size, encode * 1e6, decode * 1e6, (encode + decode) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
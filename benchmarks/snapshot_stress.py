@@ -0,0 +1,226 @@
+"""Stress test of frozen world versions (see jelly/world.py): a writer thread ticks the world as fast as it can, moving,
+spawning & removing players, while reader threads encode snapshots of it, like `GET` and `STATS` do.
+
+The readers must never fail, e.g. with "dictionary changed size during iteration". Another reader keeps a replica of the
+world built from delta `GET` responses. Once the writer stops, the replica must be equal to the world.
+
+A subscribed client of the binary format sends `GET` and `FORMAT` too, all on one connection: its requests are served
+by one thread, like the reader of a connection does, while another one takes the messages like its writer does (see
+Server.next_message()) and decodes them in that order. The responses & the pushes share the nick/color table of the
+client, so a message must never refer to an entry that is sent by another one after it. This client keeps a replica
+as well.
+
+Exits with status 1 if anything has failed or a replica differs from the world.
+
+To compare, `--live` readers encode the dicts the writer changes, like the server did before the world was frozen.
+The contention is reported as the time the threads waited for the locks of the world, see `STATS`.
+
+Usage:
+    $ python3 -m benchmarks.snapshot_stress [--readers 8] [--rate 30] [--duration 5] [--live]
+"""
+import argparse
+import sys
+from json import dumps, loads
+from random import Random
+from threading import Thread, Event
+from time import perf_counter
+
+from jelly.server import Server, Session
+from jelly.player import Players
+from jelly.food import Food
+from jelly.snapshot import decode_snapshot
+from benchmarks.common import make_server
+from benchmarks.process_moved import DIRECTIONS
+
+PLAYERS, FOOD, SIDE = 200, 5000, 5000
+# Players moved per tick.
+MOVING = 50
+
+
+def write(server: Server, stop: Event, stats: dict) -> None:
+    rng = Random(1)
+    session = Session()
+    spawned = 0
+    while not stop.is_set():
+        nicks = list(server.players.nicks())
+        with server.moves_mutex:
+            for nick in rng.sample(nicks, min(MOVING, len(nicks))):
+                server.moves[nick] = rng.choice(DIRECTIONS)
+        # Resize the dicts.
+        if rng.random() < 0.5:
+            server.handle_request({Server.SPAWN: 'spawned{}'.format(spawned)}, session)
+            spawned += 1
+        else:
+            server.handle_request({Server.DISCONNECT: rng.choice(nicks)}, session)
+        server.tick()
+        server.push()
+        stats['ticks'] += 1
+
+
+def read(server: Server, stop: Event, stats: dict, live: bool, rate: float) -> None:
+    """Encodes the whole world `rate` times per second or as fast as it can if `rate` is 0."""
+    try:
+        while not stop.wait(1 / rate if rate else 0):
+            if live:
+                players, food = server.players.get_players_raw(), server.food.get_food_raw()
+            else:
+                world = server.world
+                players, food = world.players, world.food
+            dumps([players, food], default=server._json_date_handler)
+            dumps(server.stats())
+            stats['reads'] += 1
+    except Exception as e:
+        stats['errors'][type(e).__name__] = stats['errors'].get(type(e).__name__, 0) + 1
+
+
+def replicate(server: Server, stop: Event, stats: dict, replica: (Session, Players, Food), rate: float) -> None:
+    """Keeps `replica` of the world up to date with delta `GET` responses, sent at `rate` like in read()."""
+    try:
+        while not stop.wait(1 / rate if rate else 0):
+            update(server, replica)
+            stats['updates'] += 1
+    except Exception as e:
+        stats['errors'][type(e).__name__] = stats['errors'].get(type(e).__name__, 0) + 1
+
+
+def request(server: Server, session: Session, stop: Event, stats: dict, rate: float) -> None:
+    """Serves the requests of the subscribed client at `rate`: `GET` and, now and then, `FORMAT`, which makes the
+    server send the table entries again."""
+    rng = Random(2)
+    try:
+        while not stop.wait(1 / rate if rate else 0) and not session.closed:
+            # The client waits for its responses, and for a push that has waited for a tick, since the responses go
+            # first: a push held back for too long disconnects the client. See Server.push().
+            if session.outbox or session.behind:
+                stop.wait(0.001)
+                continue
+            if rng.random() < 0.1:
+                server.serve_request(session, dumps({Server.FORMAT: Server.BINARY}).encode("UTF-8"))
+            server.serve_request(session, dumps(Server.GET).encode("UTF-8"))
+            stats['requests'] += 1
+    except Exception as e:
+        stats['errors'][type(e).__name__] = stats['errors'].get(type(e).__name__, 0) + 1
+
+
+def deliver(server: Server, session: Session, wakeup: Event, stop: Event, stats: dict,
+            client: (dict, Players, Food)) -> None:
+    """Takes the messages of the subscribed client like the writer of its connection does and applies them to its
+    replica, until the client is stopped."""
+    try:
+        while not stop.is_set() and not session.closed:
+            wakeup.wait(0.1)
+            wakeup.clear()
+            stats['messages'] += receive(server, session, client)
+    except Exception as e:
+        stats['errors'][type(e).__name__] = stats['errors'].get(type(e).__name__, 0) + 1
+
+
+def receive(server: Server, session: Session, client: (dict, Players, Food)) -> int:
+    """Decodes & applies all the messages there are for the subscribed client. Returns the number of them."""
+    table, players, food = client
+    received = 0
+    payload = server.next_message(session)
+    while payload is not None:
+        snapshot = decode_snapshot(payload, table)
+        if snapshot["full"]:
+            players.clear()
+            food.clear()
+        players.apply(snapshot["players"], snapshot["removed_players"])
+        food.apply(snapshot["food"], snapshot["removed_food"])
+        received += 1
+        payload = server.next_message(session)
+    return received
+
+
+def update(server: Server, replica: (Session, Players, Food)) -> None:
+    session, players, food = replica
+    snapshot = loads(server.get_data(session, session.version))
+    if snapshot["full"]:
+        players.clear()
+        food.clear()
+    players.apply(snapshot["players"], snapshot["removed_players"])
+    food.apply(snapshot["food"], snapshot["removed_food"])
+
+
+def run(readers: int, rate: float, duration: float, live: bool) -> (Server, dict, float):
+    """Runs the writer, `readers` readers, the replicas & the subscribed client for `duration` seconds. Returns the
+    server, the stats, where `errors` counts what has failed by name, and the time the threads ran."""
+    server = make_server(PLAYERS, FOOD, SIDE, SIDE)
+    stop = Event()
+    stats = {'ticks': 0, 'reads': 0, 'updates': 0, 'requests': 0, 'messages': 0, 'errors': dict()}
+    threads = [Thread(target=write, args=(server, stop, stats))]
+    threads += [Thread(target=read, args=(server, stop, stats, live, rate)) for _ in range(readers)]
+    replica = (Session(), Players(), Food())
+    if not live:
+        threads.append(Thread(target=replicate, args=(server, stop, stats, replica, rate)))
+
+        wakeup = Event()
+        subscriber = server.open_session(wakeup.set, lambda: None)
+        server.serve_request(subscriber, dumps({Server.FORMAT: Server.BINARY}).encode("UTF-8"))
+        server.serve_request(subscriber, dumps(Server.SUBSCRIBE).encode("UTF-8"))
+        client = (dict(), Players(), Food())
+        threads.append(Thread(target=request, args=(server, subscriber, stop, stats, rate)))
+        threads.append(Thread(target=deliver, args=(server, subscriber, wakeup, stop, stats, client)))
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    stop.wait(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    duration = perf_counter() - start
+
+    if not live:
+        # Catch up with the final version of the world.
+        update(server, replica)
+        world = loads(server.json_get_data())
+        _, players, food = replica
+        if players.data != world["players"] or \
+                {str(food_id): params for food_id, params in food.data.items()} != world["food"]:
+            stats['errors']['replica differs'] = 1
+
+        # The same for the subscribed client: push the final version and compare with a full binary snapshot.
+        if subscriber.closed:
+            stats['errors']['subscriber dropped'] = 1
+        server.push()
+        try:
+            receive(server, subscriber, client)
+        except Exception as e:
+            stats['errors'][type(e).__name__] = stats['errors'].get(type(e).__name__, 0) + 1
+        session = Session()
+        session.format = Server.BINARY
+        world = decode_snapshot(server.get_data(session), dict())
+        _, players, food = client
+        if players.data != world["players"] or food.data != world["food"]:
+            stats['errors']['subscriber replica differs'] = 1
+    return server, stats, duration
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=30, help='Reads per second of a reader, 0 for no limit.')
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--live', action='store_true', help='Encode the dicts the writer changes.')
+    args = parser.parse_args()
+
+    server, stats, duration = run(args.readers, args.rate, args.duration, args.live)
+
+    histograms = server.metrics.snapshot()["histograms"]
+    print("{} readers, {}: {:.0f} ticks/s, {:.0f} reads/s, {:.0f} replica updates/s".format(
+        args.readers, "live dicts" if args.live else "frozen worlds", stats['ticks'] / duration,
+        stats['reads'] / duration, stats['updates'] / duration))
+    if not args.live:
+        print("subscribed client: {:.0f} requests/s, {:.0f} messages/s".format(
+            stats['requests'] / duration, stats['messages'] / duration))
+    for name in ('tick_us', 'publish_us', 'lock_wait_us.players', 'lock_wait_us.food'):
+        histogram = histograms.get(name, {"count": 0, "p50": 0, "p99": 0, "max": 0})
+        print("{:>22}: count {:>7}, p50 {:>7} us, p99 {:>7} us, max {:>7} us".format(
+            name, histogram["count"], histogram["p50"], histogram["p99"], histogram["max"]))
+    print("errors: {}".format(", ".join("{} x{}".format(name, count) for name, count in stats['errors'].items())
+                              or "none"))
+    sys.exit(1 if stats['errors'] else 0)
+
+
+if __name__ == '__main__':
+    main()
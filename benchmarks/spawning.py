@@ -0,0 +1,80 @@
+"""Times regenerating all the food at a new round (see Server.regenerate_food()): removing & spawning the units one by
+one, in bulk with the points drawn at once (see jelly/spawning.py), and replacing them all with units built outside
+the lock (see Food.replace_all()). Reports how long the lock of the food is held at most, which is how long the
+handlers that use the food may wait. Also counts the food units spawned under the players, which should be none.
+
+Usage:
+    $ python3 -m benchmarks.spawning [--numpy]
+"""
+import argparse
+from threading import Lock
+from time import perf_counter
+
+from jelly.food import FoodUnit
+from benchmarks.common import make_server
+
+PLAYERS, SIDE = 1000, 20000
+FOOD = [1000, 10000, 100000]
+
+
+def one_by_one(server, food_num: int) -> None:
+    """Regenerates the food like Server.new_round() did before the bulk operations."""
+    for food_id, params in list(server.food.get_food_raw().items()):
+        server.food.pop(FoodUnit(food_id, *params))
+    for _ in range(food_num):
+        server.food.spawn(server.rand_coords())
+
+
+def bulk(server, food_num: int) -> None:
+    server.food.clear()
+    server.spawn_food(food_num)
+
+
+def replace(server, food_num: int) -> None:
+    server.food.replace_all(server.spawner.points(food_num))
+
+
+class HoldTimer:
+    """A Lock that remembers for how long it has been held at most, in seconds."""
+    def __init__(self):
+        self.lock = Lock()
+        self.longest = 0
+
+    def __enter__(self):
+        self.lock.acquire()
+        self.acquired = perf_counter()
+
+    def __exit__(self, *args):
+        self.longest = max(self.longest, perf_counter() - self.acquired)
+        self.lock.release()
+
+
+def covered(server) -> int:
+    """Returns the number of food units within the circle of a player."""
+    return sum(not server.players.is_free((x, y), 0) for x, y, *_ in server.food.get_food_raw().values())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--numpy', action='store_true', help='Keep the world in NumPy arrays too.')
+    args = parser.parse_args()
+
+    print("{} players on a {}x{} map{}".format(PLAYERS, SIDE, SIDE, ", numpy" if args.numpy else ""))
+    print("{:>8} {:>16} {:>10} {:>12} {:>10}".format("food", "one by one, ms", "bulk, ms", "replace, ms",
+                                                       "covered"))
+    print("{:>8} {:>16} {:>10} {:>12}".format("", "held, ms", "held, ms", "held, ms"))
+    for food_num in FOOD:
+        server = make_server(PLAYERS, food_num, SIDE, SIDE, vectorized=args.numpy)
+        times, held = [], []
+        for regenerate in (one_by_one, bulk, replace):
+            server.food.mutex = HoldTimer()
+            start = perf_counter()
+            regenerate(server, food_num)
+            times.append((perf_counter() - start) * 1000)
+            held.append(server.food.mutex.longest * 1000)
+        print("{:>8} {:>16.1f} {:>10.1f} {:>12.1f} {:>10}".format(food_num, *times, covered(server)))
+        print("{:>8} {:>16.1f} {:>10.1f} {:>12.1f}".format("", *held))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""Microbenchmarks of the hot paths of the simulation & the protocol, parameterized by the number of players, the number
+of food units and the size of the map. Runs without sockets or a display.
+
+Results are saved as JSON, so that runs can be compared across commits:
+    $ python3 -m benchmarks.suite --output before.json
+    $ git checkout other-commit
+    $ python3 -m benchmarks.suite --output after.json --compare before.json
+
+Usage:
+    $ python3 -m benchmarks.suite [--players 10 100 1000] [--food 1000 10000] [--side 5000 20000] [--cases ...]
+"""
+import argparse
+import json
+import platform
+import subprocess
+from datetime import datetime
+from itertools import cycle, product
+from json import loads
+from random import Random
+from statistics import median
+from time import perf_counter
+
+from jelly.server import Server
+from jelly.player import player_was_eaten
+from jelly.food import food_was_eaten
+from jelly.prediction import Interpolation
+from benchmarks.common import make_server
+from benchmarks.process_moved import DIRECTIONS
+
+# Number of entities the pairwise checks are run on.
+PAIRS = 1000
+
+
+def process_moved(server: Server, rng: Random):
+    nicks = list(server.players.nicks())
+
+    def run():
+        player = server.players[rng.choice(nicks)]
+        direction = rng.choice(DIRECTIONS)
+        if not player.is_dead and server.is_player_on_map_after_move(player, direction):
+            server.players.move(player, direction)
+            server.process_moved(server.players[player.nick])
+    return run
+
+
+def player_was_eaten_case(server: Server, rng: Random):
+    players = server.players.get_players()
+    pairs = cycle([(rng.choice(players), rng.choice(players)) for _ in range(PAIRS)])
+    return lambda: player_was_eaten(*next(pairs))
+
+
+def food_was_eaten_case(server: Server, rng: Random):
+    players, food = server.players.get_players(), server.food.get_food()
+    pairs = cycle([(rng.choice(players), rng.choice(food)) for _ in range(PAIRS)])
+    return lambda: food_was_eaten(*next(pairs))
+
+
+def grow(server: Server, rng: Random):
+    players = server.players.get_players()
+    players = cycle(rng.sample(players, min(PAIRS, len(players))))
+    # Grow & shrink by turns, so that the sizes stay the same.
+    increments = cycle((1, -1))
+    return lambda: server.players.grow(next(players), next(increments))
+
+
+def food_pop_spawn(server: Server, rng: Random):
+    """Eats a random food unit & spawns a new one, like Server.process_moved() does."""
+    ids = list(server.food.get_food_raw())
+
+    def run():
+        index = rng.randrange(len(ids))
+        server.food.pop(server.food[ids[index]])
+        ids[index] = server.food.spawn(server.rand_coords())
+    return run
+
+
+def json_get_data_full(server: Server, rng: Random):
+    return lambda: server.json_get_data()
+
+
+def json_get_data_delta(server: Server, rng: Random):
+    """Encodes the changes made by 10 moves."""
+    since = server.changes.version
+    move = process_moved(server, rng)
+    for _ in range(10):
+        move()
+    server.publish()
+    return lambda: server.json_get_data(since)
+
+
+def client_decode_full(server: Server, rng: Random):
+    """Decodes a full `GET` response & applies it like Client.receive_get() does."""
+    # Imported here, so that the other cases don't need pygame.
+    from jelly.client import Client
+    from jelly.player import Players
+    from jelly.food import Food
+
+    # A client that isn't connected anywhere.
+    client = Client.__new__(Client)
+    client.nick = next(iter(server.players.nicks()))
+    client.connection = client.prediction = client.leader_board = client.rank = client.version = None
+    client.players, client.food = Players(), Food()
+    client.interpolation = Interpolation()
+    data = server.json_get_data().encode("UTF-8")
+    return lambda: client.apply_state(loads(str(data, "UTF-8")))
+
+
+# name -> (setup, number of calls per batch). A setup takes the server and returns the function to time.
+# Some cases change the world, e.g. players grow as they eat, so the numbers of calls are fixed: the same calls are
+# timed on any machine.
+CASES = {
+    'process_moved': (process_moved, 200),
+    'player_was_eaten': (player_was_eaten_case, 10000),
+    'food_was_eaten': (food_was_eaten_case, 10000),
+    'Players.grow': (grow, 10000),
+    'Food.pop+spawn': (food_pop_spawn, 1000),
+    'json_get_data full': (json_get_data_full, 5),
+    'json_get_data delta': (json_get_data_delta, 100),
+    'client decode full': (client_decode_full, 5),
+}
+
+
+def measure(run, number: int, repeat: int) -> list[float]:
+    """Returns the mean time of a call of `run` in seconds for each of `repeat` batches of `number` calls."""
+    # Warm up.
+    run()
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        for _ in range(number):
+            run()
+        times.append((perf_counter() - start) / number)
+    return times
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def key(result: dict) -> tuple:
+    return result['case'], result['players'], result['food'], result['side']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--players', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--food', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--side', type=int, nargs='+', default=[5000, 20000], help='Width & height of the map.')
+    parser.add_argument('--cases', type=str, nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timed batches per case.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, help='Save the results to this JSON file.')
+    parser.add_argument('--compare', type=str, help='Compare the results with the ones saved to this JSON file.')
+    args = parser.parse_args()
+
+    previous = dict()
+    if args.compare:
+        with open(args.compare) as f:
+            previous = {key(result): result for result in json.load(f)['results']}
+
+    results = []
+    print("{:>20} {:>8} {:>8} {:>8} {:>12} {:>12} {:>10}".format(
+        "case", "players", "food", "side", "median, us", "min, us", "speedup"))
+    for players, food, side, case in product(args.players, args.food, args.side, args.cases):
+        server = make_server(players, food, side, side, random_seed=args.seed)
+        setup, number = CASES[case]
+        times = measure(setup(server, Random(args.seed)), number, args.repeat)
+        result = {'case': case, 'players': players, 'food': food, 'side': side,
+                  'median_us': median(times) * 1e6, 'min_us': min(times) * 1e6}
+        results.append(result)
+
+        old = previous.get(key(result))
+        speedup = "{:.2f}x".format(old['median_us'] / result['median_us']) if old else "-"
+        print("{:>20} {:>8} {:>8} {:>8} {:>12.2f} {:>12.2f} {:>10}".format(
+            case, players, food, side, result['median_us'], result['min_us'], speedup))
+
+    if args.output:
+        meta = {'commit': git_commit(), 'time': datetime.now().isoformat(), 'python': platform.python_version(),
+                'platform': platform.platform(), 'repeat': args.repeat, 'seed': args.seed}
+        with open(args.output, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Compares the pure-Python world with the NumPy one (see `--numpy`) at 1k players and 50k food units: the time of
+a tick in which every player moves, and the time to encode a full binary snapshot.
+
+Usage:
+    $ python3 -m benchmarks.vectorized
+"""
+from random import choice, seed
+from time import perf_counter
+
+from jelly.server import Server, Session
+from benchmarks.common import make_server
+from benchmarks.process_moved import DIRECTIONS, AREA_PER_ENTITY
+
+PLAYERS, FOOD = 1000, 50000
+TICKS = 20
+
+
+def make_world(vectorized: bool) -> Server:
+    side = int(((PLAYERS + FOOD) * AREA_PER_ENTITY) ** 0.5)
+    return make_server(PLAYERS, FOOD, side, side, vectorized=vectorized)
+
+
+def main():
+    print("{} players, {} food units, all the players move every tick".format(PLAYERS, FOOD))
+    print("{:>8} {:>10} {:>18}".format("world", "tick, ms", "full snapshot, ms"))
+    for vectorized in (False, True):
+        server = make_world(vectorized)
+        nicks = list(server.players.nicks())
+        seed(1)
+        tick_time = 0
+        for _ in range(TICKS):
+            with server.moves_mutex:
+                server.moves = {nick: choice(DIRECTIONS) for nick in nicks}
+            start = perf_counter()
+            server.tick()
+            tick_time += perf_counter() - start
+
+        session = Session()
+        session.format = Server.BINARY
+        start = perf_counter()
+        server.binary_get_data(session)
+        snapshot_time = perf_counter() - start
+
+        print("{:>8} {:>10.1f} {:>18.1f}".format(
+            "numpy" if vectorized else "python", tick_time / TICKS * 1000, snapshot_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -22,4 +22,14 @@ SCREEN_HEIGHT = 500
 
 # In seconds.
 GAME_TIME = 120
-RESTART_TIME = 5
\ No newline at end of file
+RESTART_TIME = 5
+
+# How many times per second the server updates the world.
+TICK_RATE = 30
+
+# If set, the server appends its metrics to this file every STATS_INTERVAL seconds. See `STATS` in docs/protocol.md
+STATS_LOG = None
+STATS_INTERVAL = 10
+
+# If set, `PROFILE` command & SIGUSR1 capture profiles of the server to this directory. See jelly/profiling.py
+PROFILE_DIR = None
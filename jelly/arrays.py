@@ -0,0 +1,315 @@
+"""NumPy-backed storage of the world, used by the server if it's started with `--numpy`.
+
+Players & food keep their dicts, which JSON snapshots and the client use, but their params are mirrored into
+contiguous arrays (a struct of arrays). That lets the server check the collisions of all the players moved during
+a tick at once and pack binary snapshots without a Python loop per entity.
+
+The arrays are copied along with the dicts when the world is published (see jelly/world.py), and full snapshots of
+the published world are packed from the copies, so that they don't depend on the changes made since."""
+import numpy as np
+
+from jelly.utils import Direction
+from jelly.player import Players
+from jelly.food import Food
+from jelly.snapshot import PLAYER, FOOD, pack_players, pack_food
+
+# Layouts of snapshot.PLAYER & snapshot.FOOD records. `index` of a food unit is its ID.
+PLAYER_RECORD = np.dtype([('index', '>u4'), ('x', '>i4'), ('y', '>i4'), ('size', '>u4'), ('factor', '>f4'),
+                          ('effect_ticks', '>u4'), ('seq', '>u4')])
+FOOD_RECORD = np.dtype([('index', '>u8'), ('x', '>i4'), ('y', '>i4'), ('size', '>u2'), ('kind', 'u1')])
+assert PLAYER_RECORD.itemsize == PLAYER.size and FOOD_RECORD.itemsize == FOOD.size
+
+
+class Arrays:
+    """Params of entities in contiguous arrays, a slot per entity, and a key <-> slot map.
+    Slots of removed entities are reused. The size of a free slot is -1, so it never collides with anything."""
+
+    # name -> type of an array. `index` identifies an entity in binary snapshots.
+    FIELDS = {'x': np.int64, 'y': np.int64, 'size': np.int64, 'factor': np.float64, 'kind': np.int64,
+              'index': np.int64, 'seq': np.int64}
+
+    def __init__(self, capacity: int = 1024):
+        for name, dtype in self.FIELDS.items():
+            setattr(self, name, np.zeros(capacity, dtype))
+        self.size.fill(-1)
+        # key -> slot
+        self.slots = dict()
+        # slot -> key
+        self.keys = [None] * capacity
+        self.free = []
+        # Slots from `end` on have never been used.
+        self.end = 0
+
+    def _grow(self) -> None:
+        """Doubles the capacity."""
+        capacity = len(self.keys)
+        for name in self.FIELDS:
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate((array, np.zeros_like(array))))
+        self.size[capacity:] = -1
+        self.keys.extend([None] * capacity)
+
+    def _new_slot(self) -> int:
+        if self.end == len(self.keys):
+            self._grow()
+        self.end += 1
+        return self.end - 1
+
+    def set(self, key, x: int, y: int, size: int, factor: float = 1, kind: int = 0, index: int = 0,
+            seq: int = 0) -> None:
+        """Sets params of `key`, which is added if it's new."""
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.free.pop() if self.free else self._new_slot()
+            self.slots[key] = slot
+            self.keys[slot] = key
+        self.x[slot], self.y[slot], self.size[slot] = x, y, size
+        self.factor[slot], self.kind[slot], self.index[slot] = factor, kind, index
+        self.seq[slot] = seq
+
+    def add_all(self, keys: list, **columns) -> None:
+        """Adds new `keys` at once. `columns` are lists of the params of the keys named after the arrays, e.g.
+        x=[...]. The params that aren't given are zeros."""
+        free = min(len(keys), len(self.free))
+        slots = [self.free.pop() for _ in range(free)]
+        while self.end + len(keys) - free > len(self.keys):
+            self._grow()
+        slots.extend(range(self.end, self.end + len(keys) - free))
+        self.end += len(keys) - free
+        for name in self.FIELDS:
+            getattr(self, name)[slots] = columns.get(name, 0)
+        for key, slot in zip(keys, slots):
+            self.slots[key] = slot
+            self.keys[slot] = key
+
+    def clear(self) -> None:
+        """Removes all the keys."""
+        self.size.fill(-1)
+        self.slots.clear()
+        self.keys = [None] * len(self.keys)
+        self.free = []
+        self.end = 0
+
+    def copy(self) -> 'Arrays':
+        """Returns a copy of the arrays that isn't changed afterwards. The key -> slot map isn't copied, so the copy
+        only supports Arrays.live() and Arrays.records()."""
+        copy = Arrays.__new__(Arrays)
+        for name in self.FIELDS:
+            setattr(copy, name, getattr(self, name)[:self.end].copy())
+        copy.keys = self.keys[:self.end]
+        copy.slots, copy.free, copy.end = None, None, self.end
+        return copy
+
+    def remove(self, key) -> None:
+        """Removes `key`. Does nothing if there's no such key."""
+        slot = self.slots.pop(key, None)
+        if slot is None:
+            return
+        self.size[slot] = -1
+        self.keys[slot] = None
+        self.free.append(slot)
+
+    def slots_of(self, keys) -> np.ndarray:
+        """Returns slots of `keys`, skipping the keys that aren't there."""
+        slots = self.slots
+        return np.array([slots[key] for key in keys if key in slots], np.int64)
+
+    def live(self) -> np.ndarray:
+        """Returns slots of all the entities."""
+        return np.flatnonzero(self.size[:self.end] >= 0)
+
+    def records(self, slots: np.ndarray, dtype: np.dtype) -> np.ndarray:
+        """Packs params of `slots` into records of `dtype`. The fields named after the arrays are filled, the others
+        are zeros."""
+        records = np.zeros(len(slots), dtype)
+        for name in dtype.names:
+            if name in self.FIELDS:
+                records[name] = getattr(self, name)[slots]
+        return records
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+
+def sweep(xs: np.ndarray, ys: np.ndarray, movers_x: np.ndarray, movers_y: np.ndarray,
+          radius) -> (np.ndarray, np.ndarray):
+    """Broad phase of collision checks. Returns pairs (mover, slot) of all the movers & entities which coordinates
+    differ by no more than `radius` along both axes, as two arrays of the same length.
+
+    The map is split into columns `radius` wide, and the entities are sorted by the column, then by y. So the entities
+    near a mover take three ranges of the sorted entities: one in its column and one in each neighbouring column.
+
+    :param xs: x coordinates of the entities by slot, the same for `ys`
+    :param movers_x: x coordinates of the movers, the same for `movers_y`
+    :param radius: a number or an array of a number per mover
+    """
+    width = int(np.max(radius, initial=0)) + 1
+    # Coordinates fit into 32 bits, so a key is the column in the high bits & y in the low ones.
+    keys = ((xs // width) << 32) + ys
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+
+    queries = (((movers_x // width)[:, np.newaxis] + (-1, 0, 1)) << 32) + movers_y[:, np.newaxis]
+    radius = np.asarray(radius)[..., np.newaxis] if np.ndim(radius) else radius
+    first = np.searchsorted(sorted_keys, (queries - radius).ravel(), 'left')
+    last = np.searchsorted(sorted_keys, (queries + radius).ravel(), 'right')
+    counts = last - first
+    movers = np.repeat(np.arange(len(counts)) // 3, counts)
+    # The pairs of a query take positions first[query]..last[query] in `order`.
+    offsets = np.arange(len(movers)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return movers, order[np.repeat(first, counts) + offsets]
+
+
+class Movers:
+    """Nicks & params of the players moved during a tick, in arrays. See ArrayPlayers.movers()."""
+    def __init__(self, nicks: list[str], x: np.ndarray, y: np.ndarray, size: np.ndarray, factor: np.ndarray):
+        self.nicks = nicks
+        self.x, self.y, self.size, self.factor = x, y, size, factor
+
+    def hits(self, movers: np.ndarray, keys: list) -> dict:
+        """Groups colliding pairs (mover, key) by the nick of the mover: nick -> [key, ...]."""
+        result = dict()
+        for mover, key in zip(movers.tolist(), keys):
+            result.setdefault(self.nicks[mover], []).append(key)
+        return result
+
+
+class ArrayPlayers(Players):
+    """Players mirrored into Arrays. Is used by the server only."""
+    def __init__(self, *args, **kwargs):
+        self.arrays = Arrays()
+        super().__init__(*args, **kwargs)
+        # The frozen copy of `data` returned by Players.freeze() last and a copy of the arrays made along with it.
+        self.frozen_arrays = (None, None)
+
+    def _changed(self, nick: str) -> None:
+        x, y, size, factor, _, _, seq = self.data[nick]
+        self.arrays.set(nick, x, y, size, factor=factor, index=self.indices.get(nick, 0), seq=seq)
+        super()._changed(nick)
+
+    def _remove(self, nick: str) -> None:
+        super()._remove(nick)
+        self.arrays.remove(nick)
+
+    def movers(self, nicks) -> Movers:
+        """Returns the alive players of `nicks`."""
+        with self.mutex:
+            slots = self.arrays.slots_of(nicks)
+            slots = slots[self.arrays.size[slots] > 0]
+            return Movers([self.arrays.keys[slot] for slot in slots.tolist()], self.arrays.x[slots],
+                          self.arrays.y[slots], self.arrays.size[slots], self.arrays.factor[slots])
+
+    def coords_after_moves(self, moves: dict) -> list[(str, (int, int))]:
+        """Does what Player.coords_after_move() does for all the alive players of `moves` (nick -> direction) at once.
+        Returns pairs (nick, coordinates after the move)."""
+        movers = self.movers(list(moves))
+        directions = np.array([int(moves[nick]) for nick in movers.nicks], np.int64)
+        # The same operations as in Player.move_step(), so that the results are exactly the same.
+        g = movers.size / self.initial_size
+        step = np.round(self.initial_size / (4 * g) * movers.factor).astype(np.int64)
+        dx = ((directions & Direction.RIGHT) != 0).astype(np.int64) - ((directions & Direction.LEFT) != 0)
+        dy = ((directions & Direction.DOWN) != 0).astype(np.int64) - ((directions & Direction.UP) != 0)
+        return list(zip(movers.nicks, zip((movers.x + dx * step).tolist(), (movers.y + dy * step).tolist())))
+
+    def collisions(self, movers: Movers) -> dict:
+        """Returns the players each of the movers may have eaten or been eaten by: nick -> [nick, ...].
+        Does the same checks as player_was_eaten(), so the result is exact for the current state."""
+        with self.mutex:
+            end = self.arrays.end
+            xs, ys, sizes = self.arrays.x[:end], self.arrays.y[:end], self.arrays.size[:end]
+            radius = max(int(sizes.max(initial=0)), 0)
+            movers_i, slots = sweep(xs, ys, movers.x, movers.y, radius)
+            a, b = movers.size[movers_i], sizes[slots]
+            dx, dy = movers.x[movers_i] - xs[slots], movers.y[movers_i] - ys[slots]
+            hit = (b > 0) & (a != b) & (dx * dx + dy * dy <= (a - b) * (a - b))
+            keys = [self.arrays.keys[slot] for slot in slots[hit].tolist()]
+        return movers.hits(movers_i[hit], keys)
+
+    def freeze(self) -> dict:
+        """Does what Players.freeze() does and copies the arrays along. Must be called under the mutex."""
+        frozen = super().freeze()
+        if self.frozen_arrays[0] is not frozen:
+            self.frozen_arrays = (frozen, self.arrays.copy())
+        return frozen
+
+    def pack(self, players: dict, indices: dict) -> (list, bytes):
+        """Does what snapshot.pack_players() does. All the players of the latest frozen version are packed from the
+        copy of the arrays, and the others, e.g. those of a delta, from their params."""
+        frozen, arrays = self.frozen_arrays
+        # A snapshot of players with a speed effect has its own copy of them, see Server.effects_left(). The ticks
+        # left of the others are zeros.
+        if players is not frozen:
+            return pack_players(players, indices)
+        slots = arrays.live()
+        records = arrays.records(slots, PLAYER_RECORD)
+        table = [(index, nick, players[nick][5])
+                 for index, nick in zip(records['index'].tolist(), [arrays.keys[slot] for slot in slots.tolist()])]
+        return table, records.tobytes()
+
+
+class ArrayFood(Food):
+    """Food mirrored into Arrays. Is used by the server only."""
+    def __init__(self, *args, **kwargs):
+        self.arrays = Arrays()
+        super().__init__(*args, **kwargs)
+        # The frozen copy of `data` returned by Food.freeze() last and a copy of the arrays made along with it.
+        self.frozen_arrays = (None, None)
+
+    def _changed(self, food_id: int) -> None:
+        x, y, size, kind = self.data[food_id]
+        self.arrays.set(food_id, x, y, size, kind=kind, index=food_id)
+        super()._changed(food_id)
+
+    def _changed_all(self, food_ids: list[int]) -> None:
+        data = self.data
+        columns = list(zip(*(data[food_id] for food_id in food_ids)))
+        if columns:
+            xs, ys, sizes, kinds = columns
+            self.arrays.add_all(food_ids, x=xs, y=ys, size=sizes, kind=kinds, index=food_ids)
+        super()._changed_all(food_ids)
+
+    def _replacement(self, ids: range, points: list[(int, int)], data: dict) -> dict:
+        replacement = super()._replacement(ids, points, data)
+        arrays = Arrays()
+        if data:
+            xs, ys, sizes, kinds = zip(*data.values())
+            arrays.add_all(ids, x=xs, y=ys, size=sizes, kind=kinds, index=ids)
+        replacement['arrays'] = arrays
+        return replacement
+
+    def _remove(self, food_id: int) -> bool:
+        self.arrays.remove(food_id)
+        return super()._remove(food_id)
+
+    def _clear(self) -> None:
+        self.arrays.clear()
+        super()._clear()
+
+    def collisions(self, movers: Movers) -> dict:
+        """Returns IDs of the food units each of the movers may have eaten: nick -> [id, ...].
+        Does the same checks as food_was_eaten(), so the result is exact for the current state."""
+        with self.mutex:
+            end = self.arrays.end
+            xs, ys, sizes = self.arrays.x[:end], self.arrays.y[:end], self.arrays.size[:end]
+            movers_i, slots = sweep(xs, ys, movers.x, movers.y, movers.size)
+            a, b = movers.size[movers_i], sizes[slots]
+            dx, dy = movers.x[movers_i] - xs[slots], movers.y[movers_i] - ys[slots]
+            hit = (a > b) & (b > 0) & (dx * dx + dy * dy < a * a)
+            keys = [self.arrays.keys[slot] for slot in slots[hit].tolist()]
+        return movers.hits(movers_i[hit], keys)
+
+    def freeze(self) -> dict:
+        """Does what Food.freeze() does and copies the arrays along. Must be called under the mutex."""
+        frozen = super().freeze()
+        if self.frozen_arrays[0] is not frozen:
+            self.frozen_arrays = (frozen, self.arrays.copy())
+        return frozen
+
+    def pack(self, food: dict) -> (int, bytes):
+        """Does what snapshot.pack_food() does. All the food units of the latest frozen version are packed from the
+        copy of the arrays, and the others, e.g. those of a delta, from their params."""
+        frozen, arrays = self.frozen_arrays
+        if food is not frozen:
+            return pack_food(food)
+        slots = arrays.live()
+        return len(slots), arrays.records(slots, FOOD_RECORD).tobytes()
@@ -0,0 +1,87 @@
+import asyncio
+
+from jelly.server import Server
+from jelly.protocol import read_frame, encode_frame
+
+
+class AsyncServer(Server):
+    """Server side of Jelly app that talks to all the clients on a single asyncio event loop
+    instead of starting a thread per client. Supports the same commands as `Server`."""
+
+    # Disconnect a client if it has sent no data in a minute.
+    CLIENT_TIMEOUT = 60
+
+    def listen(self):
+        """Accepts connections and serves them until the process is stopped."""
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        asyncio.create_task(self.run_ticks_async())
+        self.start_stats_log()
+        self.install_profile_signal()
+        server = await asyncio.start_server(self.listen_to_client_async, self.HOST, self.PORT, backlog=1024)
+        async with server:
+            await server.serve_forever()
+
+    async def run_ticks_async(self):
+        """Calls Server.tick() `TICK_RATE` times per second on the event loop. See Server.run_ticks()."""
+        loop = asyncio.get_running_loop()
+        period = 1 / self.TICK_RATE
+        next_tick = loop.time()
+        while True:
+            self.tick()
+            self.push()
+            next_tick += period
+            delay = next_tick - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                next_tick = loop.time()
+                # Let the clients be served anyway.
+                await asyncio.sleep(0)
+
+    async def listen_to_client_async(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Handle client commands. Is run as a separate task for each connected client."""
+        wakeup = asyncio.Event()
+        session = self.open_session(wakeup.set, writer.transport.abort)
+        writer_task = asyncio.create_task(self.write_to_client_async(writer, session, wakeup))
+        try:
+            while True:
+                # Receive client data.
+                try:
+                    frame = await asyncio.wait_for(read_frame(reader), self.CLIENT_TIMEOUT)
+                except asyncio.IncompleteReadError:
+                    break
+                except asyncio.TimeoutError:
+                    # A subscribed client doesn't have to send anything.
+                    if session.subscribed:
+                        continue
+                    raise
+
+                self.serve_request(session, frame)
+        except asyncio.TimeoutError:
+            self.metrics.count('disconnects.timeout')
+        except OSError:
+            self.closed_by_error(session)
+        finally:
+            self.close_session(session)
+            # Let the writer send what's queued.
+            await writer_task
+            writer.close()
+
+    async def write_to_client_async(self, writer: asyncio.StreamWriter, session, wakeup: asyncio.Event):
+        """The writer of a connection, see Server.write_to_client(). Is run as a separate task for each connected
+        client, so only it waits if the client is slow."""
+        try:
+            while not session.closed or session.outbox:
+                await wakeup.wait()
+                wakeup.clear()
+                payload = self.next_message(session)
+                while payload is not None:
+                    writer.write(encode_frame(payload))
+                    self.sent(session, payload)
+                    await writer.drain()
+                    payload = self.next_message(session)
+        except OSError:
+            # Stop reading from the client as well.
+            session.close()
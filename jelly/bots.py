@@ -0,0 +1,202 @@
+"""Headless clients that play at random, to load-test a server without opening a pygame window per player.
+
+Each bot is a thread with its own connection (see jelly/connection.py). It spawns a player, moves it and either polls
+the state with `GET` at a given rate, measuring the round trip time of each request, or subscribes to the states
+pushed by the server. Bots can be split across processes, since a single process is limited by the GIL."""
+from collections import Counter
+from json import dumps
+from multiprocessing import Pool
+from random import choice, random, uniform
+from threading import Thread
+from time import perf_counter, sleep
+
+from jelly.connection import Connection
+from jelly.server import Server
+from jelly.utils import Direction
+
+# All the directions a player can move to.
+DIRECTIONS = [Direction.LEFT, Direction.UP, Direction.RIGHT, Direction.DOWN, Direction.LEFT | Direction.UP,
+              Direction.UP | Direction.RIGHT, Direction.RIGHT | Direction.DOWN, Direction.DOWN | Direction.LEFT]
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class Stats:
+    """What a bot or a swarm of bots has measured."""
+    def __init__(self):
+        # Round trip times of `GET` requests in seconds. A `MOVE` sent just before doesn't delay the `GET`, since
+        # Connection sends with TCP_NODELAY: otherwise the round trip would include a delayed ACK of the `MOVE`.
+        self.rtts = []
+        # Numbers of `GET` responses, states pushed by the server & `MOVE` commands.
+        self.gets = 0
+        self.pushes = 0
+        self.moves = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        # Name of the exception -> how many bots have failed with it.
+        self.errors = Counter()
+
+    def merge(self, other: 'Stats') -> None:
+        self.rtts.extend(other.rtts)
+        self.gets += other.gets
+        self.pushes += other.pushes
+        self.moves += other.moves
+        self.bytes_sent += other.bytes_sent
+        self.bytes_received += other.bytes_received
+        self.errors.update(other.errors)
+
+    def report(self, bots: int, duration: float) -> str:
+        lines = [
+            "bots: {}, duration: {:.1f} s".format(bots, duration),
+            "GET/s: {:.0f}, pushes/s: {:.0f}, MOVE/s: {:.0f}".format(
+                self.gets / duration, self.pushes / duration, self.moves / duration),
+            "received: {:.1f} KB/s, sent: {:.1f} KB/s".format(
+                self.bytes_received / duration / 1024, self.bytes_sent / duration / 1024),
+            "errors: {}".format(", ".join("{} x{}".format(name, count) for name, count in self.errors.most_common())
+                                or "none"),
+        ]
+        if self.rtts:
+            lines.insert(2, "GET round trip, ms: p50 {:.1f}, p90 {:.1f}, p99 {:.1f}, max {:.1f}".format(
+                *(percentile(self.rtts, p) * 1000 for p in (50, 90, 99, 100))))
+        return "\n".join(lines)
+
+
+class Bot:
+    """A headless client.
+
+    :param behavior: how the bot moves, one of Bot.BEHAVIORS
+    :param get_rate: `GET` requests per second. If it's 0, the bot subscribes to the states instead
+    :param move_rate: `MOVE` commands per second
+    """
+
+    # `idle` doesn't move, `random` moves to a random direction each time, `wander` keeps a direction for a while.
+    BEHAVIORS = ('idle', 'random', 'wander')
+    # Probability of a wandering bot to change the direction at a move.
+    TURN_PROBABILITY = 0.05
+
+    def __init__(self, nick: str, host: str, port: int, behavior: str = 'wander', get_rate: float = 20,
+                 move_rate: float = 30, binary: bool = False, view: (int, int) = (800, 600), compress: bool = False):
+        assert behavior in self.BEHAVIORS
+        self.nick = nick
+        self.host, self.port = host, port
+        self.behavior = behavior
+        self.get_rate = get_rate
+        self.move_rate = move_rate
+        self.binary = binary
+        self.compress = compress
+        self.view = view
+        self.direction = choice(DIRECTIONS)
+        # Version of the world the bot has, see `GET` in docs/protocol.md
+        self.version = None
+        self.stats = Stats()
+
+    def next_direction(self) -> Direction:
+        if self.behavior == 'idle':
+            return Direction.NONE
+        if self.behavior == 'random' or random() < self.TURN_PROBABILITY:
+            self.direction = choice(DIRECTIONS)
+        return self.direction
+
+    def run(self, duration: float) -> None:
+        """Plays for `duration` seconds. Exceptions are counted in Bot.stats."""
+        connection = None
+        try:
+            connection = Connection(self.host, self.port)
+            connection.send(dumps({Server.SPAWN: self.nick}).encode("UTF-8"))
+            if self.binary:
+                connection.send(dumps({Server.FORMAT: Server.BINARY}).encode("UTF-8"))
+            if self.compress:
+                connection.send(dumps({Server.COMPRESS: Server.ZLIB}).encode("UTF-8"))
+            connection.send(dumps({Server.VIEW: list(self.view)}).encode("UTF-8"))
+            if self.get_rate:
+                self.poll(connection, duration)
+            else:
+                connection.send(dumps(Server.SUBSCRIBE).encode("UTF-8"))
+                connection.start()
+                self.listen(connection, duration)
+            connection.send(dumps({Server.DISCONNECT: self.nick}).encode("UTF-8"))
+        except Exception as e:
+            self.stats.errors[type(e).__name__] += 1
+        finally:
+            if connection is not None:
+                connection.close()
+                self.stats.bytes_sent += connection.bytes_sent
+                self.stats.bytes_received += connection.bytes_received
+
+    def send_move(self, connection: Connection) -> None:
+        direction = self.next_direction()
+        if direction != Direction.NONE:
+            connection.send_latest(dumps({Server.MOVE: [self.nick, int(direction)]}).encode("UTF-8"))
+            self.stats.moves += 1
+
+    def poll(self, connection: Connection, duration: float) -> None:
+        """Sends `GET` requests & moves at their rates, waiting for each response."""
+        start = perf_counter()
+        end = start + duration
+        # Spread the requests of the bots started at once.
+        next_get = start + uniform(0, 1 / self.get_rate)
+        next_move = start if self.move_rate else float('inf')
+        while True:
+            now = perf_counter()
+            if now >= end:
+                break
+            if now >= next_move:
+                self.send_move(connection)
+                next_move = max(next_move + 1 / self.move_rate, now)
+            if now >= next_get:
+                sent = perf_counter()
+                connection.send(dumps({Server.GET: self.version}).encode("UTF-8"))
+                self.version = connection.receive()["version"]
+                self.stats.rtts.append(perf_counter() - sent)
+                self.stats.gets += 1
+                next_get = max(next_get + 1 / self.get_rate, now)
+            sleep(max(0.0, min(next_get, next_move, end) - perf_counter()))
+
+    def listen(self, connection: Connection, duration: float) -> None:
+        """Moves at its rate and counts the states pushed by the server."""
+        end = perf_counter() + duration
+        period = 1 / self.move_rate if self.move_rate else duration
+        while perf_counter() < end and not connection.closed:
+            if self.move_rate:
+                self.send_move(connection)
+            sleep(min(period, max(0.0, end - perf_counter())))
+            self.stats.pushes += len(connection.received())
+        if connection.closed:
+            raise ConnectionResetError("The server has closed the connection.")
+
+
+def run_bots(nicks: list[str], duration: float, **kwargs) -> Stats:
+    """Runs a bot per nick in threads for `duration` seconds. `kwargs` are passed to Bot. Returns their total stats."""
+    bots = [Bot(nick, **kwargs) for nick in nicks]
+    threads = [Thread(target=bot.run, args=(duration,), daemon=True) for bot in bots]
+    for thread in threads:
+        thread.start()
+    stats = Stats()
+    for bot, thread in zip(bots, threads):
+        thread.join()
+        stats.merge(bot.stats)
+    return stats
+
+
+def _run_bots(args) -> Stats:
+    nicks, duration, kwargs = args
+    return run_bots(nicks, duration, **kwargs)
+
+
+def run_swarm(bots: int, duration: float, processes: int = 1, prefix: str = 'bot', **kwargs) -> Stats:
+    """Runs `bots` bots named `prefix`0, `prefix`1 and so on split across `processes` processes for `duration`
+    seconds. `kwargs` are passed to Bot. Returns the total stats."""
+    nicks = ['{}{}'.format(prefix, i) for i in range(bots)]
+    if processes <= 1:
+        return run_bots(nicks, duration, **kwargs)
+    with Pool(processes) as pool:
+        results = pool.map(_run_bots, [(nicks[i::processes], duration, kwargs) for i in range(processes)])
+    stats = Stats()
+    for result in results:
+        stats.merge(result)
+    return stats
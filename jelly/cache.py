@@ -0,0 +1,38 @@
+from threading import Lock
+
+
+class SnapshotCache:
+    """Encoded snapshots of the latest version of the world, so that the clients asking for the same snapshot share
+    one buffer instead of encoding it for each of them. All the entries are dropped once the world changes.
+
+    Keys are arbitrary hashable values describing a snapshot, e.g. (format, since). `hits` and `misses` count
+    lookups."""
+    def __init__(self):
+        self.mutex = Lock()
+        # Version of the world the entries are of. Any values that can be compared, e.g. (version, tick).
+        self.version = None
+        # key -> cached value
+        self.entries = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, version: int, key):
+        """Returns the value cached for `key` at `version` or `None`."""
+        with self.mutex:
+            value = self.entries.get(key) if version == self.version else None
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def put(self, version: int, key, value) -> None:
+        """Caches `value` for `key` at `version`. Values of older versions are ignored."""
+        with self.mutex:
+            if self.version is not None and version < self.version:
+                return
+            if version != self.version:
+                self.version = version
+                self.entries.clear()
+            self.entries[key] = value
+
@@ -0,0 +1,108 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+class ChangeLog:
+    """Versions the world state, so that a client can ask only for the changes since the version it has seen.
+
+    Each change of an entity increments the version. The log remembers the last version in which each entity was
+    changed, so its size is bounded by the number of entities rather than by the number of changes. Removed entities
+    are remembered too, but only the last `max_removed` of them. Changes since a version older than that can't be
+    tracked (see ChangeLog.since()), and a client has to get a full snapshot.
+
+    Keys are arbitrary hashable values, e.g. ("players", nick) or ("food", id)."""
+    def __init__(self, max_removed: int = 4096):
+        self.max_removed = max_removed
+        self.mutex = Lock()
+        self.version = 0
+        # key -> version of the last change. The most recently changed key is the last one.
+        self.changed = OrderedDict()
+        # key -> version of the removal for removed keys only, in the same order.
+        self.removed = OrderedDict()
+        # Changes made in this version and before can't be tracked anymore.
+        self.horizon = 0
+
+    def touch(self, key) -> None:
+        """Records that `key` was added or changed. Must be called after the entity is changed."""
+        with self.mutex:
+            self.version += 1
+            self.changed[key] = self.version
+            self.changed.move_to_end(key)
+            self.removed.pop(key, None)
+
+    def touch_all(self, keys: list) -> None:
+        """Does what ChangeLog.touch() does for each of `keys`, in order, under a single lock."""
+        with self.mutex:
+            changed, removed = self.changed, self.removed
+            versions = range(self.version + 1, self.version + len(keys) + 1)
+            self.version += len(keys)
+            if changed.keys().isdisjoint(keys):
+                # New keys, e.g. spawned food units, are added to the end, where they belong.
+                changed.update(zip(keys, versions))
+                return
+            for key, version in zip(keys, versions):
+                changed[key] = version
+                changed.move_to_end(key)
+                removed.pop(key, None)
+
+    def remove_all(self, keys: list) -> None:
+        """Does what ChangeLog.remove() does for each of `keys`, in order, under a single lock."""
+        with self.mutex:
+            changed, removed = self.changed, self.removed
+            # Only the last `max_removed` removals are remembered, so the others are forgotten right away.
+            forgotten = len(keys) - self.max_removed
+            for i, key in enumerate(keys):
+                self.version += 1
+                if i < forgotten:
+                    changed.pop(key, None)
+                    removed.pop(key, None)
+                    self.horizon = self.version
+                    continue
+                changed[key] = self.version
+                changed.move_to_end(key)
+                removed[key] = self.version
+                removed.move_to_end(key)
+
+            while len(removed) > self.max_removed:
+                key, version = removed.popitem(last=False)
+                del changed[key]
+                self.horizon = max(self.horizon, version)
+
+    def forget_all(self) -> None:
+        """Records that any key may have been added, changed or removed, e.g. when all the food is replaced: none of
+        the changes made so far can be tracked anymore, and ChangeLog.since() returns `None` for any older version.
+        Unlike ChangeLog.remove_all() & ChangeLog.touch_all(), the lock is held for the same time however many keys
+        have changed: the old records are freed after it's released."""
+        with self.mutex:
+            self.version += 1
+            self.horizon = self.version
+            forgotten = (self.changed, self.removed)
+            self.changed, self.removed = OrderedDict(), OrderedDict()
+        del forgotten
+
+    def remove(self, key) -> None:
+        """Records that `key` was removed. Must be called after the entity is removed."""
+        with self.mutex:
+            self.version += 1
+            self.changed[key] = self.version
+            self.changed.move_to_end(key)
+            self.removed[key] = self.version
+            self.removed.move_to_end(key)
+
+            while len(self.removed) > self.max_removed:
+                forgotten, version = self.removed.popitem(last=False)
+                del self.changed[forgotten]
+                self.horizon = max(self.horizon, version)
+
+    def since(self, version: int) -> (int, list):
+        """Returns the current version and keys changed or removed after `version`.
+        Returns `None` if the changes can't be tracked because `version` is too old or is from the future."""
+        with self.mutex:
+            if version < self.horizon or version > self.version:
+                return None
+            keys = []
+            for key in reversed(self.changed):
+                if self.changed[key] <= version:
+                    break
+                keys.append(key)
+            return self.version, keys
@@ -1,24 +1,33 @@
 from jelly.server import Server
 
-import socket
-from json import loads, dumps
-from threading import Thread, Lock
+from json import dumps
 import pygame
 from datetime import datetime, timedelta
+from time import monotonic
 
-from jelly.utils import Direction, assert_nick, draw_text, draw_circle, is_circle_on_screen, world2screen, offset, PropagatingThread
-from jelly.food import Food
+from jelly.connection import Connection
+from jelly.utils import Direction, assert_nick, is_circle_on_screen, world2screen, offset
+from jelly.render import Renderer
+from jelly.food import Food, FOOD_COLORS
 from jelly.player import Players
+from jelly.prediction import Prediction, Interpolation
 
 
 class Client:
     BACKGROUND = pygame.color.Color(255, 255, 255)
     LARGE_FONT_SIZE = 30
     SMALL_FONT_SIZE = 20
+    # Frames per second at most.
+    FPS = 60
 
-    def __init__(self, nick: str, host: str, port: int, width: int, height: int):
+    def __init__(self, nick: str, host: str, port: int, width: int, height: int, binary: bool = False,
+                 compress: bool = False):
         assert_nick(nick)
         self.nick = nick
+        # Ask the server for binary snapshots instead of JSON. See docs/protocol.md
+        self.binary = binary
+        # Ask the server to compress what it sends. See `COMPRESS` in docs/protocol.md
+        self.compress = compress
 
         self.HOST = host
         self.PORT = port
@@ -32,12 +41,36 @@ class Client:
 
         # Precompute some commands. Those are just JSON binary string. See docs/protocol.md
         self.SPAWN = dumps({Server.SPAWN: self.nick}).encode("UTF-8")
-        self.GET = dumps(Server.GET).encode("UTF-8")
         self.GET_MAP_BOUNDS = dumps(Server.GET_MAP_BOUNDS).encode("UTF-8")
         self.DISCONNECT = dumps({Server.DISCONNECT: self.nick}).encode("UTF-8")
-
-        self.sock_mutex = Lock()
-        self.sock = None
+        self.FORMAT_BINARY = dumps({Server.FORMAT: Server.BINARY}).encode("UTF-8")
+        self.COMPRESS = dumps({Server.COMPRESS: Server.ZLIB}).encode("UTF-8")
+        self.SUBSCRIBE = dumps(Server.SUBSCRIBE).encode("UTF-8")
+
+        # Size of the screen the server is told about. See `VIEW` in docs/protocol.md
+        self.view = (width, height)
+        # Nicks of the top players & the rank of the client's player as sent by the server. The client only has
+        # the players it can see, so it can't compute those itself.
+        self.leader_board = None
+        self.rank = None
+
+        # The state is only changed & drawn by the thread running the game loop. The connection's worker receives
+        # the states pushed by the server, and the game loop applies them before drawing a frame.
+        # See jelly/connection.py
+        self.connection = None
+        # Is reset once the connection is lost.
+        self.connected = False
+        # Version of the world self.players & self.food are at. See `GET` in docs/protocol.md
+        self.version = None
+
+        # Sent by the server in response to `GET_MAP_BOUNDS`. Are `None` if the server doesn't send them.
+        self.tick_rate = None
+        self.initial_size = None
+        # Predicts the moves of the client's player. Is created once the map bounds are known. See jelly/prediction.py
+        self.prediction = None
+        self.interpolation = Interpolation()
+        # When to send the next `MOVE` command. The server applies one move per tick, so there's no use sending more.
+        self.next_move = 0
         self.connect()
 
         self.round_end = None
@@ -45,23 +78,33 @@ class Client:
 
         self.small_font = None
         self.large_font = None
+        # Caches rendered texts & circles. See jelly/render.py
+        self.renderer = Renderer()
 
         # Draw GUI
         self.game_loop()
 
     def __del__(self):
         """Sends `DISCONNECT` command and closes the socket."""
-        self.send_disconnect()
-        self.sock.close()
+        if self.connection is not None:
+            self.send_disconnect()
+            self.connection.close()
 
     def connect(self):
         """Connects to server & sends `SPAWN` command."""
-        with self.sock_mutex:
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.sock.connect((self.HOST, self.PORT))
+        if self.connection is not None:
+            self.connection.close()
+        self.connection = Connection(self.HOST, self.PORT)
+        self.version = None
+        self.connected = True
 
         # Create a player with the same nick at the server side.
         self.send_spawn()
+        if self.binary:
+            self.send_command(self.FORMAT_BINARY)
+        if self.compress:
+            self.send_command(self.COMPRESS)
+        self.send_view(self.view)
 
     def time_left(self) -> timedelta:
         """Returns how much there there's before the end of the round."""
@@ -69,82 +112,140 @@ class Client:
 
     def send_command(self, command: bytes):
         """Send `command` binary string to the server. See docs/protocol.md"""
-        with self.sock_mutex:
-            self.sock.sendall(command + Server.DELIMITER.encode("UTF-8"))
+        self.connection.send(command)
 
     def receive(self):
-        """Receive and return server response."""
-        with self.sock_mutex:
-            response = self.sock.recv(4096)
-        return response
+        """Receive server response and return it decoded. See Connection.receive()."""
+        return self.connection.receive()
 
     def send_disconnect(self):
         """After the corresponding binary string is sent to the server, the last removes data about the player."""
         self.send_command(self.DISCONNECT)
 
     def receive_get(self):
-        """Sends `GET` command to the server. Parses server JSON response and saves it."""
-        self.send_command(self.GET)
-
-        # TODO: check if response is longer than 4048 bytes.
-        raw_response = self.receive()
-
-        # Parse the received JSON and save it into self.players
-        response = loads(raw_response.decode("UTF-8"))
-
-        # TODO here, too.
-        self.players = Players(init=response["players"])
-
-        # TODO here, too
-        self.food = Food(init=response["food"])
-        self.round_end = datetime.fromisoformat(response["round_end"])
-
-    def send_move(self, direction: Direction):
-        """Tells the server to move the player to `direction`."""
-        command = dumps({Server.MOVE: [self.nick, int(direction)]}).encode("UTF-8")
-        self.send_command(command)
+        """Sends `GET` command with the version of the world the client has to the server. Parses server response
+        and applies it to self.players & self.food."""
+        self.send_command(dumps({Server.GET: self.version}).encode("UTF-8"))
+        self.apply_state(self.receive())
+
+    def apply_state(self, response: dict):
+        """Applies a response to `GET` command or a pushed state to self.players & self.food."""
+        # Positions of the changed players before the changes, to draw them moving from there.
+        data = self.players.get_players_raw()
+        previous = {nick: (data[nick][0], data[nick][1]) for nick in response["players"] if nick in data}
+
+        round_end = response["round_end"]
+        self.round_end = round_end if isinstance(round_end, datetime) else datetime.fromisoformat(round_end)
+
+        if response.get("leader_board") is not None:
+            self.leader_board = [nick for nick, _ in response["leader_board"]]
+            self.rank = response["rank"]
+
+        if response["full"]:
+            self.players = Players(init=response["players"])
+            self.food = Food(init=response["food"])
+        else:
+            self.players.apply(response["players"], response["removed_players"])
+            self.food.apply(response["food"], response["removed_food"])
+        self.version = response["version"]
+
+        self.interpolation.update(previous)
+        if self.prediction is not None and self.nick in self.players:
+            self.prediction.reconcile(self.players[self.nick])
+
+    def subscribe(self):
+        """Sends `SUBSCRIBE` command and starts the worker of the connection, which receives the states pushed by the
+        server. See Client.apply_pushed()."""
+        self.send_command(self.SUBSCRIBE)
+        self.connection.start()
+
+    def apply_pushed(self):
+        """Applies the states the server has pushed since the last call. Resets Client.connected if the connection
+        is lost."""
+        states = self.connection.received()
+        # A full state replaces everything before it.
+        full = [i for i, state in enumerate(states) if state["full"]]
+        for state in states[full[-1] if full else 0:]:
+            self.apply_state(state)
+        if self.connection.closed:
+            self.connected = False
+
+    def send_move(self, direction: Direction, seq: int = None):
+        """Tells the server to move the player to `direction`. `seq` is the number of the move, if it's predicted.
+        Replaces the previous move if it hasn't been sent yet. See Connection.send_latest()."""
+        args = [self.nick, int(direction)] if seq is None else [self.nick, int(direction), seq]
+        self.connection.send_latest(dumps({Server.MOVE: args}).encode("UTF-8"))
+
+    def send_view(self, width_height: (int, int)):
+        """Tells the server the size of the screen, so that it only sends what can be seen on it."""
+        self.view = tuple(width_height)
+        self.send_command(dumps({Server.VIEW: list(self.view)}).encode("UTF-8"))
 
     def send_spawn(self):
         """Sends `SPAWN` command to the server."""
         self.send_command(self.SPAWN)
 
     def get_map_bounds(self):
-        """Asks server to return width and height of the map."""
+        """Asks server to return width and height of the map. Also stores the tick rate & the initial size of a player
+        if the server has sent them."""
         self.send_command(self.GET_MAP_BOUNDS)
-        raw_response = self.receive()
-        response = loads(raw_response.decode("UTF-8"))
+        response = self.receive()
+        self.tick_rate = response.get("tick_rate")
+        self.initial_size = response.get("init_player_size")
         return response["width"], response["height"]
 
+    def start_prediction(self, map_wh: (int, int)):
+        """Starts predicting the moves of the client's player if the server has sent everything it takes."""
+        self.prediction = None
+        if self.tick_rate is not None and self.initial_size is not None:
+            self.prediction = Prediction(self.initial_size, map_wh)
+
+    def top_k(self, k: int) -> list[str]:
+        """Returns nicks of `k` largest players, the largest goes first."""
+        if self.leader_board is not None:
+            return self.leader_board[:k]
+        return self.players.top_k(k)
+
+    def my_rank(self) -> int:
+        """Returns the place of the client's player in the leader board counting from 0, None if it is not known."""
+        if self.rank is not None:
+            return self.rank
+        return self.players.rank(self.nick)
+
     @staticmethod
     def render_fonts():
         return pygame.font.Font(None, Client.SMALL_FONT_SIZE), pygame.font.Font(None, Client.LARGE_FONT_SIZE)
 
     def died(self, surface: pygame.Surface):
-        draw_text(surface, self.large_font, "Game Over",
-                  center=(surface.get_width() // 2, surface.get_height() // 2))
+        self.renderer.draw_text(surface, self.large_font, "Game Over",
+                                center=(surface.get_width() // 2, surface.get_height() // 2))
 
     def timeout(self, surface: pygame.Surface, time_left: int):
         if self.winner is None:
-            # TODO: do NOT rely on implementation-dependent behaviour.
-            #  Items of the dictionary aren't required to be sorted.
-            self.winner = list(self.players.nicks())[0]
+            # The board is empty if the round ended before the first update, try again on the next frame.
+            top = self.top_k(1)
+            if top:
+                self.winner = top[0]
 
-        draw_text(surface, self.large_font, "{} is the winner!".format(self.winner),
-                  center=(surface.get_width() // 2, surface.get_height() // 2))
-        draw_text(surface, self.large_font, "Reconnecting {}".format(abs(time_left)),
-                  midbottom=(surface.get_width() // 2, surface.get_height()-1))
+        text = "{} is the winner!".format(self.winner) if self.winner is not None else "Round over"
+        self.renderer.draw_text(surface, self.large_font, text,
+                                center=(surface.get_width() // 2, surface.get_height() // 2))
+        self.renderer.draw_text(surface, self.large_font, "Reconnecting {}".format(abs(time_left)),
+                                midbottom=(surface.get_width() // 2, surface.get_height()-1))
 
     def draw_leader_board(self, surface: pygame.Surface, lb_offset_x, lb_text_height, color=(0, 0, 0)):
         myself_in_top_ten = False
-        for iter_count, nick in enumerate(list(self.players.nicks())[:10]):
+        for iter_count, nick in enumerate(self.top_k(10)):
             if nick == self.nick:
                 myself_in_top_ten = True
-            draw_text(surface, self.small_font, "#{} {}".format(iter_count + 1, nick),
-                      topleft=(lb_offset_x, lb_text_height * iter_count), color=color)
+            self.renderer.draw_text(surface, self.small_font, "#{} {}".format(iter_count + 1, nick),
+                                    topleft=(lb_offset_x, lb_text_height * iter_count), color=color)
         if not myself_in_top_ten:
-            rank = list(self.players.nicks()).index(self.nick)
-            draw_text(surface, self.small_font, "#{} {}".format(rank + 1, self.nick),
-                      topleft=(lb_offset_x, lb_text_height * 10), color=color)
+            rank = self.my_rank()
+            if rank is None:
+                return
+            self.renderer.draw_text(surface, self.small_font, "#{} {}".format(rank + 1, self.nick),
+                                    topleft=(lb_offset_x, lb_text_height * 10), color=color)
 
     def game_loop(self):
         pygame.init()
@@ -158,27 +259,32 @@ class Client:
         lb_offset_x = self.DEFAULT_SCREEN_WIDTH - self.DEFAULT_LEADER_BOARD_WIDTH
         lb_text_height = self.large_font.render('#0 TEST', True, (0, 0, 0)).get_height()
 
-        # Init all data.
+        # Init all data. After that the server pushes the changes.
+        map_wh = self.get_map_bounds()
+        self.start_prediction(map_wh)
         self.receive_get()
-        connected = True
+        self.subscribe()
 
-        map_wh = self.get_map_bounds()
+        clock = pygame.time.Clock()
         run = True
         while run:
-            pygame.time.delay(20)
-
-            get_thread = PropagatingThread(target=self.receive_get, daemon=True)
-            get_thread.start()
-
             for e in pygame.event.get():
                 if e.type == pygame.QUIT:
                     run = False
                 if e.type == pygame.VIDEORESIZE:
                     surface = pygame.display.set_mode((e.w, e.h), pygame.RESIZABLE)
                     lb_offset_x = e.w - self.DEFAULT_LEADER_BOARD_WIDTH
+                    self.send_view((e.w, e.h))
 
-            if connected:
-                if self.players[self.nick].is_dead:
+            if self.connected:
+                self.apply_pushed()
+
+            if self.connected:
+                me = self.players[self.nick]
+                # Draw the client's player where it will be once the server has applied the moves sent so far.
+                if self.prediction is not None and self.prediction.player is not None:
+                    me = self.prediction.player
+                if me.is_dead:
                     surface.fill((255, 255, 255))
                     self.draw_leader_board(surface, lb_offset_x, lb_text_height)
                     self.died(surface)
@@ -199,17 +305,17 @@ class Client:
                     if keys[pygame.K_DOWN]:
                         direction |= Direction.DOWN
 
-                    if direction != Direction.NONE:
-                        post_thread = Thread(target=self.send_move, args=(direction,), daemon=True)
-                        post_thread.start()
-
-                    try:
-                        get_thread.join()
-                    except (BrokenPipeError, ConnectionResetError):
-                        connected = False
-                        continue
+                    now = monotonic()
+                    if direction != Direction.NONE and now >= self.next_move:
+                        seq = None
+                        if self.prediction is not None:
+                            seq = self.prediction.move(direction)
+                            me = self.prediction.player or me
+                            self.next_move = max(self.next_move + 1 / self.tick_rate, now - 1 / self.tick_rate)
+                        self.send_move(direction, seq)
 
-                    offset_xy = offset(self.players[self.nick].xy, surface.get_size())
+                    screen_wh = surface.get_size()
+                    offset_xy = offset(me.xy, screen_wh)
 
                     # Draw map bounds
                     top_left_world = (0, 0)
@@ -217,25 +323,27 @@ class Client:
                     rectangle = pygame.Rect(top_left_screen, map_wh)
                     pygame.draw.rect(surface, self.BACKGROUND, rectangle)
 
-                    for food in self.food.get_food():
-                        screen_xy = world2screen(food.xy, offset_xy)
-
-                        if is_circle_on_screen(screen_xy, food.size, surface.get_size()):
-                            draw_circle(surface, screen_xy, food.size, food.color)
-
-                    for player in self.players.get_players():
-                        screen_xy = world2screen(player.xy, offset_xy)
-                        if is_circle_on_screen(screen_xy, player.size, surface.get_size()) or player.nick == self.nick:
-                            draw_circle(surface, screen_xy, player.size, player.color)
-                            nick_color = (192, 192, 192) if player.is_dead else (0, 0, 0)
-                            draw_text(surface, self.large_font, player.nick, nick_color, center=screen_xy)
-
-                    draw_text(surface, self.small_font, "Time left: {}".format(int(self.time_left().total_seconds())),
-                              topleft=(2, 0), color=(127, 127, 127))
-                    draw_text(surface, self.small_font, "Size: {}".format(self.players[self.nick].size),
-                              bottomleft=(2, surface.get_height()-1), color=(127, 127, 127))
-                    self.draw_leader_board(surface, lb_offset_x, lb_text_height)
-
+                    # Iterate over the raw data rather than Food.get_food() & Players.get_players(), so that
+                    # no object is created per entity per frame.
+                    for x, y, size, kind in self.food.get_food_raw().values():
+                        screen_xy = world2screen((x, y), offset_xy)
+
+                        if is_circle_on_screen(screen_xy, size, screen_wh):
+                            self.renderer.draw_circle(surface, screen_xy, size, FOOD_COLORS[kind])
+
+                    for nick, (x, y, size, _, _, color, _) in self.players.get_players_raw().items():
+                        xy = me.xy if nick == self.nick else self.interpolation.xy(nick, (x, y))
+                        screen_xy = world2screen(xy, offset_xy)
+                        if is_circle_on_screen(screen_xy, size, screen_wh) or nick == self.nick:
+                            self.renderer.draw_circle(surface, screen_xy, size, color)
+                            nick_color = (192, 192, 192) if size <= 0 else (0, 0, 0)
+                            self.renderer.draw_text(surface, self.large_font, nick, nick_color, center=screen_xy)
+
+                    time_left = int(self.time_left().total_seconds())
+                    self.renderer.draw_text(surface, self.small_font, "Time left: {}".format(time_left),
+                                            topleft=(2, 0), color=(127, 127, 127))
+                    self.renderer.draw_text(surface, self.small_font, "Size: {}".format(me.size),
+                                            bottomleft=(2, surface.get_height()-1), color=(127, 127, 127))
                     self.draw_leader_board(surface, lb_offset_x, lb_text_height, color=(127, 127, 127))
                 else:
                     surface.fill((255, 255, 255))
@@ -243,19 +351,22 @@ class Client:
                     self.timeout(surface, int(-self.time_left().total_seconds()) + 1)
             else:
                 surface.fill((255, 255, 255))
-                draw_text(surface, self.large_font, "DISCONNECTED", color=(255, 0, 0),
-                          center=(surface.get_width()//2, surface.get_height()//2))
-                draw_text(surface, self.large_font, "Press R to reconnect ...", color=(255, 0, 0),
-                          midbottom=(surface.get_width() // 2, surface.get_height() - 1))
-                keys = pygame.key.get_pressed()
-                if keys[pygame.K_r]:
-                    try:
-                        self.connect()
-                    except ConnectionRefusedError:
-                        continue
-                    else:
-                        connected = True
+                self.renderer.draw_text(surface, self.large_font, "DISCONNECTED", color=(255, 0, 0),
+                                        center=(surface.get_width()//2, surface.get_height()//2))
+                self.renderer.draw_text(surface, self.large_font, "Press R to reconnect ...", color=(255, 0, 0),
+                                        midbottom=(surface.get_width() // 2, surface.get_height() - 1))
+
+            if not self.connected and pygame.key.get_pressed()[pygame.K_r]:
+                try:
+                    self.connect()
+                    self.start_prediction(map_wh)
+                    self.receive_get()
+                    self.subscribe()
+                except OSError:
+                    self.connected = False
 
             pygame.display.update()
+            # Sleeps for the rest of the frame.
+            clock.tick(self.FPS)
         pygame.quit()
 
@@ -0,0 +1,41 @@
+"""Compression of the messages the server sends to a client. See `COMPRESS` in docs/protocol.md
+
+The compressed messages sent to a connection are parts of one deflate stream: the compressor keeps its window between
+messages, so the nicks & keys repeated in every snapshot are encoded as short references to the previous ones. Each
+message is flushed on its own, so the client can decompress it as soon as it's received."""
+import zlib
+
+# The first byte of a compressed message. Neither a JSON text nor a binary snapshot starts with it.
+MAGIC = 1
+# Raw deflate without a header & a checksum: the frames have a length and TCP has a checksum already.
+WBITS = -15
+
+
+class Compressor:
+    """Compresses the messages sent to one client. Messages shorter than `threshold` bytes are returned as they are,
+    since compressing them saves next to nothing."""
+    def __init__(self, threshold: int, level: int = 6):
+        self.threshold = threshold
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, WBITS)
+
+    def compress(self, payload: bytes) -> bytes:
+        """Returns `payload` compressed, prefixed with MAGIC. The messages must be sent in the order they are
+        compressed in."""
+        if len(payload) < self.threshold:
+            return payload
+        data = self.compressor.compress(payload)
+        return bytes((MAGIC,)) + data + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def is_compressed(frame) -> bool:
+    """Returns True if `frame` has been compressed by Compressor.compress()."""
+    return len(frame) > 0 and frame[0] == MAGIC
+
+
+class Decompressor:
+    """Decompresses the messages received from the server, in the order they are received in."""
+    def __init__(self):
+        self.decompressor = zlib.decompressobj(WBITS)
+
+    def decompress(self, frame) -> bytes:
+        return self.decompressor.decompress(memoryview(frame)[1:])
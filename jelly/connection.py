@@ -0,0 +1,158 @@
+"""Client side of a connection to the server. Doesn't depend on pygame."""
+import selectors
+import socket
+from collections import deque
+from json import loads
+from threading import Thread
+
+from jelly.protocol import HEADER, FrameDecoder, recv_frames, send_frame
+from jelly.snapshot import is_snapshot, decode_snapshot
+from jelly.compression import Decompressor, is_compressed
+
+
+class Connection:
+    """A connection to the server.
+
+    Until Connection.start() is called, the calling thread sends commands and receives responses itself. Afterwards
+    a single worker thread does all the I/O: it sends the queued commands and receives the states pushed by the
+    server (see `SUBSCRIBE` in docs/protocol.md). The worker and the other threads only share deques, which appends &
+    pops are atomic, so neither of them ever waits for the other."""
+    def __init__(self, host: str, port: int):
+        self.sock = socket.create_connection((host, port))
+        # Commands are small frames sent back to back, e.g. `MOVE` and then `GET`: Nagle's algorithm would hold the
+        # second one until the server has acknowledged the first, which it delays.
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.decoder = FrameDecoder()
+        # Player index -> (nick, color). Is filled by binary snapshots.
+        self.table = dict()
+        # Decompresses the messages the server has compressed after `COMPRESS`. See jelly/compression.py
+        self.decompressor = Decompressor()
+        # Responses received but not returned by Connection.receive() yet.
+        self.responses = deque()
+
+        # Commands queued for the worker, the oldest goes first.
+        self.outbox = deque()
+        # The latest command queued with Connection.send_latest(). The worker sends it unless it's `last_sent`.
+        self.latest = None
+        self.last_sent = None
+        # Responses received by the worker but not taken by Connection.received() yet.
+        self.inbox = deque()
+        # Writing to `wakeup` wakes the worker up to send the queued commands.
+        self.wakeup, self.wakeup_reader = socket.socketpair()
+        self.worker = None
+        # Is set once the connection is lost or closed.
+        self.closed = False
+        # Traffic, including the frame headers.
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def decode_response(self, frame):
+        """Decodes a binary snapshot or a JSON text, compressed or not."""
+        if is_compressed(frame):
+            frame = self.decompressor.decompress(frame)
+        if is_snapshot(frame):
+            return decode_snapshot(frame, self.table)
+        return loads(str(frame, "UTF-8"))
+
+    def send(self, command: bytes) -> None:
+        """Sends `command` binary string to the server or queues it if the worker is running. See docs/protocol.md"""
+        if self.worker is None:
+            self._send(command)
+        else:
+            self.outbox.append(command)
+            self._wake()
+
+    def send_latest(self, command: bytes) -> None:
+        """Sends `command` like Connection.send(), but if the previous command sent this way is still queued, it's
+        replaced. The server applies only the latest `MOVE` of a player per tick, so there's no use sending the
+        older ones if the client is ahead of the network."""
+        if self.worker is None:
+            self._send(command)
+        else:
+            self.latest = command
+            self._wake()
+
+    def _send(self, command: bytes) -> None:
+        send_frame(self.sock, command)
+        self.bytes_sent += HEADER.size + len(command)
+
+    def _wake(self) -> None:
+        try:
+            self.wakeup.send(b'\0')
+        except BlockingIOError:
+            # The worker has a lot of wake-ups to read already.
+            pass
+
+    def receive(self):
+        """Blocks until a response is received & returns it decoded. May only be called before Connection.start()."""
+        if not self.responses:
+            frames = recv_frames(self.sock, self.decoder)
+            if frames is None:
+                raise ConnectionResetError("The server has closed the connection.")
+            self.bytes_received += sum(HEADER.size + len(frame) for frame in frames)
+            # Frames are only valid until the next receive, so decode them right away.
+            self.responses.extend(self.decode_response(frame) for frame in frames)
+        return self.responses.popleft()
+
+    def start(self) -> None:
+        """Starts the worker."""
+        self.wakeup.setblocking(False)
+        self.worker = Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def received(self) -> list:
+        """Returns the responses received by the worker since the last call, the oldest goes first."""
+        result = []
+        while self.inbox:
+            result.append(self.inbox.popleft())
+        return result
+
+    def run(self) -> None:
+        """The loop of the worker."""
+        self.inbox.extend(self.responses)
+        self.responses.clear()
+        try:
+            with selectors.DefaultSelector() as selector:
+                selector.register(self.sock, selectors.EVENT_READ)
+                selector.register(self.wakeup_reader, selectors.EVENT_READ)
+                while True:
+                    for key, _ in selector.select():
+                        if key.fileobj is self.sock:
+                            self._receive_some()
+                        else:
+                            self.wakeup_reader.recv(4096)
+                    self._flush()
+                    if self.closed:
+                        break
+        except OSError:
+            pass
+        finally:
+            self.closed = True
+
+    def _receive_some(self) -> None:
+        """Receives what's available without blocking and puts complete responses into the inbox."""
+        size = self.sock.recv_into(self.decoder.writable())
+        if size == 0:
+            raise ConnectionResetError("The server has closed the connection.")
+        self.bytes_received += size
+        self.decoder.advance(size)
+        self.inbox.extend(self.decode_response(frame) for frame in self.decoder.frames())
+
+    def _flush(self) -> None:
+        """Sends the queued commands."""
+        while self.outbox:
+            self._send(self.outbox.popleft())
+        latest = self.latest
+        if latest is not None and latest is not self.last_sent:
+            self._send(latest)
+            self.last_sent = latest
+
+    def close(self) -> None:
+        """Sends the queued commands and closes the connection."""
+        if self.worker is not None and self.worker.is_alive():
+            self.closed = True
+            self._wake()
+            self.worker.join(1)
+        self.closed = True
+        for sock in (self.sock, self.wakeup, self.wakeup_reader):
+            sock.close()
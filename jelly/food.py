@@ -1,8 +1,11 @@
 from threading import Lock
+from itertools import count
 from enum import IntEnum
 from random import randint, choices
 from jelly.player import Player
 from jelly.utils import distance
+from jelly.grid import SpatialGrid
+from jelly.changes import ChangeLog
 
 
 class FoodKind(IntEnum):
@@ -12,12 +15,32 @@ class FoodKind(IntEnum):
     FREEZING = 4
 
 
+# Looking a member up is much cheaper than calling FoodKind(), which matters when food units are created each frame.
+FOOD_KINDS = {kind.value: kind for kind in FoodKind}
+
+FOOD_COLORS = {
+    # Red
+    FoodKind.ORDINARY: (225, 24, 69),
+    # Green
+    FoodKind.SPEEDING_UP: (135, 233, 17),
+    # Blue
+    FoodKind.SLOWING_DOWN: (0, 87, 233),
+    # Purple
+    FoodKind.FREEZING: (137, 49, 239),
+}
+assert len(FOOD_COLORS) == len(FoodKind)
+
+
 class FoodUnit:
-    def __init__(self, x: int, y: int, size: int, kind: FoodKind):
+    """Provides read-only access to a food unit."""
+    __slots__ = ('id', 'x', 'y', 'size', 'kind')
+
+    def __init__(self, food_id: int, x: int, y: int, size: int, kind: FoodKind):
+        self.id = food_id
         self.x = x
         self.y = y
         self.size = size
-        self.kind = FoodKind(kind)
+        self.kind = FOOD_KINDS[kind]
 
     @property
     def xy(self):
@@ -25,20 +48,7 @@ class FoodUnit:
 
     @property
     def color(self):
-        if self.kind == FoodKind.ORDINARY:
-            # Red
-            return 225, 24, 69
-        elif self.kind == FoodKind.SPEEDING_UP:
-            # Green
-            return 135, 233, 17
-        elif self.kind == FoodKind.SLOWING_DOWN:
-            # Blue
-            return 0, 87, 233
-        elif self.kind == FoodKind.FREEZING:
-            # Purple
-            return 137, 49, 239
-        else:
-            raise RuntimeError("Behaviour for `{}` is not implemented.".format(str(self.kind)))
+        return FOOD_COLORS[self.kind]
 
 
 def food_was_eaten(eater: Player, target: FoodUnit) -> bool:
@@ -46,18 +56,41 @@ def food_was_eaten(eater: Player, target: FoodUnit) -> bool:
 
 
 class Food:
+    """A store of food units keyed by stable integer IDs.
+
+    An ID is assigned at spawn() and is never reused, so snapshots can refer to food units by their IDs.
+    Both spawn() and pop() take O(1)."""
+
+    # Food units are recorded in a ChangeLog under keys (KEY, id).
+    KEY = 'food'
+
     def __init__(self, probability_weights: list[int] = None, min_size: int = None, max_size: int = None,
-                 init: list = None):
+                 init: dict = None, cell_size: int = None, changes: ChangeLog = None):
         self.probability_weights = probability_weights
         self.min_size = min_size
         self.max_size = max_size
 
-        self.data = []
+        # id -> [x, y, size, kind]. The params of a food unit never change.
+        self.data = dict()
         self.mutex = Lock()
-        if init is not None and isinstance(init, list):
-            self.data = init
+        # A copy of `data` returned by Food.freeze(). Is reset once `data` changes.
+        self.frozen = None
+        if init is not None and isinstance(init, dict):
+            # JSON object keys are always strings.
+            self.data = {int(food_id): food for food_id, food in init.items()}
+        self.ids = count(max(self.data, default=-1) + 1)
+        # Records changes of food if not `None`, e.g. at server side.
+        self.changes = changes
 
-    def spawn(self, xy: (int, int), size=None, kind=None) -> None:
+        # Food units indexed by their coordinates. Is `None` if `cell_size` isn't given (e.g. at client side).
+        self.grid = None
+        if cell_size is not None:
+            self.grid = SpatialGrid(cell_size)
+            for food_id, food in self.data.items():
+                self.grid.insert(food_id, food[:2])
+
+    def spawn(self, xy: (int, int), size=None, kind=None) -> int:
+        """Spawns a food unit at `xy` and returns its ID."""
         assert self.probability_weights is not None
         assert self.min_size is not None
         assert self.max_size is not None
@@ -67,19 +100,167 @@ class Food:
         if kind is None:
             kind = choices(range(1, len(FoodKind) + 1), weights=self.probability_weights)[0]
         with self.mutex:
-            self.data.append([xy[0], xy[1], size, int(kind)])
+            food_id = next(self.ids)
+            self.data[food_id] = [xy[0], xy[1], size, int(kind)]
+            if self.grid is not None:
+                self.grid.insert(food_id, xy)
+            self._changed(food_id)
+        return food_id
+
+    def spawn_all(self, points: list[(int, int)]) -> list[int]:
+        """Spawns a food unit at each of `points` under a single lock, drawing all the sizes & kinds at once.
+        Returns their IDs."""
+        assert self.probability_weights is not None
+        assert self.min_size is not None
+        assert self.max_size is not None
+
+        sizes = choices(range(self.min_size, self.max_size + 1), k=len(points))
+        kinds = choices(range(1, len(FoodKind) + 1), weights=self.probability_weights, k=len(points))
+        with self.mutex:
+            first = next(self.ids)
+            ids = range(first, first + len(points))
+            self.ids = count(first + len(points))
+            self.data.update(zip(ids, [[x, y, size, kind] for (x, y), size, kind in zip(points, sizes, kinds)]))
+            if self.grid is not None:
+                self.grid.insert_all(ids, points)
+            self._changed_all(ids)
+        return ids
+
+    def replace_all(self, points: list[(int, int)]) -> range:
+        """Replaces all the food units with new ones at `points`, e.g. at a new round. Returns their IDs.
+
+        The new dict & grid are built before the lock is taken and the old ones are freed after it's released, so the
+        threads that use the food only wait for them to be swapped. The change log forgets all the changes instead of
+        recording each unit: no delta can be made across the replacement anyway, see ChangeLog.forget_all()."""
+        assert self.probability_weights is not None
+        assert self.min_size is not None
+        assert self.max_size is not None
+
+        with self.mutex:
+            first = next(self.ids)
+            self.ids = count(first + len(points))
+        ids = range(first, first + len(points))
+        sizes = choices(range(self.min_size, self.max_size + 1), k=len(points))
+        kinds = choices(range(1, len(FoodKind) + 1), weights=self.probability_weights, k=len(points))
+        data = dict(zip(ids, [[x, y, size, kind] for (x, y), size, kind in zip(points, sizes, kinds)]))
+        replacement = self._replacement(ids, points, data)
+        with self.mutex:
+            replaced = {name: getattr(self, name) for name in replacement}
+            for name, value in replacement.items():
+                setattr(self, name, value)
+            self.frozen = None
+            if self.changes is not None:
+                self.changes.forget_all()
+        del replaced
+        return ids
+
+    def _replacement(self, ids: range, points: list[(int, int)], data: dict) -> dict:
+        """Returns the attributes Food.replace_all() swaps in for new food units `data` with `ids` at `points`:
+        name -> value. Is called without the mutex."""
+        replacement = {'data': data}
+        if self.grid is not None:
+            grid = SpatialGrid(self.grid.cell_size)
+            grid.insert_all(ids, points)
+            replacement['grid'] = grid
+        return replacement
+
+    def _changed(self, food_id: int) -> None:
+        """Must be called under the mutex."""
+        self.frozen = None
+        if self.changes is not None:
+            self.changes.touch((Food.KEY, food_id))
+
+    def _changed_all(self, food_ids: list[int]) -> None:
+        """Does what Food._changed() does for each of `food_ids`. Must be called under the mutex."""
+        self.frozen = None
+        if self.changes is not None:
+            self.changes.touch_all([(Food.KEY, food_id) for food_id in food_ids])
+
+    def pop(self, food: FoodUnit) -> bool:
+        """Removes `food`. Returns `False` if it has already been removed (e.g. eaten by someone else)."""
+        with self.mutex:
+            return self._remove(food.id)
 
-    def pop(self, food: FoodUnit) -> None:
+    def _remove(self, food_id: int) -> bool:
+        """Must be called under the mutex."""
+        if self.data.pop(food_id, None) is None:
+            return False
+        self.frozen = None
+        if self.grid is not None:
+            self.grid.remove(food_id)
+        if self.changes is not None:
+            self.changes.remove((Food.KEY, food_id))
+        return True
+
+    def apply(self, changed: dict, removed: list) -> None:
+        """Applies a delta snapshot: sets params of `changed` food units (id -> params) and removes `removed` ones."""
         with self.mutex:
-            self.data = [f for f in self.data if f[0] != food.x and f[1] != food.y]
+            for food_id in removed:
+                self._remove(int(food_id))
+            for food_id, food in changed.items():
+                food_id = int(food_id)
+                self.data[food_id] = food
+                if self.grid is not None:
+                    self.grid.insert(food_id, food[:2])
+            self.frozen = None
+
+    def __getitem__(self, food_id: int) -> FoodUnit:
+        """Returns a read-only copy."""
+        return FoodUnit(food_id, *self.data[food_id])
+
+    def __contains__(self, food_id: int) -> bool:
+        return food_id in self.data
 
-    def get_food_raw(self) -> list[list]:
+    def get_food_raw(self) -> dict:
         return self.data
 
+    def freeze(self) -> dict:
+        """Returns a copy of `data` that is never changed. The same copy is returned until `data` changes.
+        Must be called under the mutex."""
+        if self.frozen is None:
+            self.frozen = self.data.copy()
+        return self.frozen
+
     def get_food(self) -> list[FoodUnit]:
-        return [FoodUnit(*food) for food in self.data]
+        return [FoodUnit(food_id, *food) for food_id, food in self.data.items()]
+
+    def nearby(self, xy: (int, int), radius: int) -> list[FoodUnit]:
+        """Returns food units which centres may be within `radius` from `xy`. The caller still has to check the
+        distance, e.g. using food_was_eaten()."""
+        if self.grid is None:
+            return self.get_food()
+        with self.mutex:
+            return [FoodUnit(food_id, *self.data[food_id]) for food_id in self.grid.query(xy, radius)]
+
+    def in_rect(self, rect: (int, int, int, int)) -> list[int]:
+        """Returns IDs of the food units which circles overlap the rectangle (left, top, right, bottom)."""
+        left, top, right, bottom = rect
+        with self.mutex:
+            if self.grid is None:
+                candidates = list(self.data)
+            else:
+                margin = self.max_size or 0
+                candidates = self.grid.query_rect((left - margin, top - margin, right + margin, bottom + margin))
+            result = []
+            for food_id in candidates:
+                x, y, size = self.data[food_id][:3]
+                if left - size <= x <= right + size and top - size <= y <= bottom + size:
+                    result.append(food_id)
+            return result
 
     def clear(self) -> None:
         with self.mutex:
-            self.data.clear()
+            self._clear()
+
+    def _clear(self) -> None:
+        """Removes all the food units at once. Must be called under the mutex."""
+        food_ids = list(self.data)
+        self.data.clear()
+        self.frozen = None
+        if self.grid is not None:
+            self.grid.clear()
+        if self.changes is not None:
+            self.changes.remove_all([(Food.KEY, food_id) for food_id in food_ids])
 
+    def __len__(self) -> int:
+        return len(self.data)
@@ -0,0 +1,99 @@
+from math import floor
+
+
+class SpatialGrid:
+    """A uniform grid that maps world coordinates to the entities located nearby.
+
+    The map is split into square cells of `cell_size` pixels. Each entity is stored in the cell that contains its
+    centre, so looking for entities in a circle only visits the cells the circle overlaps."""
+    def __init__(self, cell_size: int):
+        assert cell_size > 0
+        self.cell_size = cell_size
+        # (i, j) -> {key: value}
+        self.cells = dict()
+        # key -> (i, j)
+        self.positions = dict()
+
+    def cell(self, xy: (int, int)) -> (int, int):
+        """Returns indices of the cell that contains `xy` point."""
+        return floor(xy[0] / self.cell_size), floor(xy[1] / self.cell_size)
+
+    def insert(self, key, xy: (int, int), value=None) -> None:
+        """Puts `key` at `xy`. If `key` is already in the grid, it is moved to `xy`.
+        `value` is what query() returns for `key`; `key` itself is returned if `value` is `None`."""
+        self.remove(key)
+        cell = self.cell(xy)
+        self.cells.setdefault(cell, dict())[key] = key if value is None else value
+        self.positions[key] = cell
+
+    def insert_all(self, keys: list, xys: list) -> None:
+        """Puts each of `keys`, which must be new, at the integer point of `xys` at the same position."""
+        cell_size = self.cell_size
+        # The same as SpatialGrid.cell() for integers, but faster.
+        key_cells = [(x // cell_size, y // cell_size) for x, y in xys]
+        self.positions.update(zip(keys, key_cells))
+        cells = self.cells
+        for key, cell in zip(keys, key_cells):
+            bucket = cells.get(cell)
+            if bucket is None:
+                bucket = cells[cell] = dict()
+            bucket[key] = key
+
+    def move(self, key, xy: (int, int)) -> None:
+        """Moves `key` to `xy`. Does nothing if the cell hasn't changed."""
+        old_cell = self.positions[key]
+        new_cell = self.cell(xy)
+        if old_cell == new_cell:
+            return
+        bucket = self.cells[old_cell]
+        value = bucket.pop(key)
+        if not bucket:
+            del self.cells[old_cell]
+        self.cells.setdefault(new_cell, dict())[key] = value
+        self.positions[key] = new_cell
+
+    def remove(self, key) -> None:
+        """Removes `key` from the grid. Does nothing if there's no such key."""
+        cell = self.positions.pop(key, None)
+        if cell is None:
+            return
+        bucket = self.cells[cell]
+        bucket.pop(key, None)
+        if not bucket:
+            del self.cells[cell]
+
+    def clear(self) -> None:
+        self.cells.clear()
+        self.positions.clear()
+
+    def query(self, xy: (int, int), radius: int) -> list:
+        """Returns values of all the entities in the cells overlapped by the square circumscribed about the circle with
+        the centre at `xy` and radius `radius`. The caller has to do an exact distance check."""
+        return self.query_rect((xy[0] - radius, xy[1] - radius, xy[0] + radius, xy[1] + radius))
+
+    def query_rect(self, rect: (int, int, int, int)) -> list:
+        """Returns values of all the entities in the cells overlapped by the rectangle `rect` given as
+        (left, top, right, bottom). The caller has to check if an entity is actually in the rectangle."""
+        i_min, j_min = self.cell(rect[:2])
+        i_max, j_max = self.cell(rect[2:])
+
+        result = []
+        # If the area is larger than the number of non-empty cells, it's cheaper to walk the cells we've got.
+        if (i_max - i_min + 1) * (j_max - j_min + 1) > len(self.cells):
+            for (i, j), bucket in self.cells.items():
+                if i_min <= i <= i_max and j_min <= j <= j_max:
+                    result.extend(bucket.values())
+            return result
+
+        for i in range(i_min, i_max + 1):
+            for j in range(j_min, j_max + 1):
+                bucket = self.cells.get((i, j))
+                if bucket:
+                    result.extend(bucket.values())
+        return result
+
+    def __contains__(self, key) -> bool:
+        return key in self.positions
+
+    def __len__(self) -> int:
+        return len(self.positions)
@@ -0,0 +1,50 @@
+from sortedcontainers import SortedList
+
+
+class LeaderBoard:
+    """Keeps players ordered by size. Both updates and queries take O(log n).
+
+    Players of the same size are ordered by nick, so the order doesn't depend on the order of updates."""
+    def __init__(self):
+        # nick -> size
+        self.sizes = dict()
+        # (-size, nick) pairs, so that the largest player goes first.
+        self.ranking = SortedList()
+
+    def update(self, nick: str, size: int) -> None:
+        """Sets size of player `nick` to `size`. Adds the player if there's no such one."""
+        old_size = self.sizes.get(nick)
+        if old_size == size:
+            return
+        if old_size is not None:
+            self.ranking.remove((-old_size, nick))
+        self.sizes[nick] = size
+        self.ranking.add((-size, nick))
+
+    def remove(self, nick: str) -> None:
+        """Removes player `nick`. Does nothing if there's no such player."""
+        size = self.sizes.pop(nick, None)
+        if size is not None:
+            self.ranking.remove((-size, nick))
+
+    def clear(self) -> None:
+        self.sizes.clear()
+        self.ranking.clear()
+
+    def top_k(self, k: int) -> list[str]:
+        """Returns nicks of `k` largest players, the largest goes first."""
+        return [nick for _, nick in self.ranking.islice(0, k)]
+
+    def max_size(self) -> int:
+        """Returns the size of the largest player, 0 if there are no players."""
+        return -self.ranking[0][0] if self.ranking else 0
+
+    def rank(self, nick: str) -> int:
+        """Returns the place of player `nick` counting from 0. Raises `KeyError` if there's no such player."""
+        return self.ranking.index((-self.sizes[nick], nick))
+
+    def __contains__(self, nick: str) -> bool:
+        return nick in self.sizes
+
+    def __len__(self) -> int:
+        return len(self.sizes)
@@ -0,0 +1,192 @@
+"""Runtime metrics of the server: counters and histograms of latencies & sizes. See `STATS` in docs/protocol.md"""
+from operator import add
+from threading import Lock, local, current_thread
+from time import monotonic, perf_counter
+
+
+class Histogram:
+    """Distribution of non-negative integer values, e.g. microseconds or bytes.
+
+    Values below SUB are counted exactly. Larger ones fall into log-linear buckets: each power of two is split into
+    SUB // 2 buckets, so a percentile is off by at most 25%. Adding a value takes O(1) and no memory."""
+
+    SUB_BITS = 3
+    SUB = 1 << SUB_BITS
+    HALF = SUB // 2
+    # Enough for values up to 2^64.
+    SIZE = SUB + (64 - SUB_BITS) * SUB // 2
+
+    def __init__(self):
+        self.buckets = [0] * self.SIZE
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    @classmethod
+    def index(cls, value: int) -> int:
+        if value < cls.SUB:
+            return value
+        shift = value.bit_length() - cls.SUB_BITS
+        # The top SUB_BITS bits of `value` are in [SUB // 2, SUB).
+        return cls.SUB + (shift - 1) * cls.SUB // 2 + (value >> shift) - cls.SUB // 2
+
+    @classmethod
+    def upper_bound(cls, index: int) -> int:
+        """Returns the largest value that falls into bucket `index`."""
+        if index < cls.SUB:
+            return index
+        shift, top = divmod(index - cls.SUB, cls.SUB // 2)
+        return ((top + cls.SUB // 2 + 1) << (shift + 1)) - 1
+
+    def add(self, value: int) -> None:
+        value = int(value)
+        if value < self.SUB:
+            if value < 0:
+                value = 0
+            self.buckets[value] += 1
+        else:
+            # Histogram.index(), inlined: values are added a lot.
+            shift = value.bit_length() - self.SUB_BITS
+            self.buckets[self.SUB + (shift - 2) * self.HALF + (value >> shift)] += 1
+        if value > self.max:
+            self.max = value
+        self.count += 1
+        self.total += value
+
+    def merge(self, other: 'Histogram') -> None:
+        """Adds the values of `other`."""
+        self.buckets = list(map(add, self.buckets, other.buckets))
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p: float) -> int:
+        if not self.count:
+            return 0
+        rank = max(1, round(self.count * p / 100))
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(self.upper_bound(index), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return {"count": self.count, "mean": self.total / self.count if self.count else 0,
+                "p50": self.percentile(50), "p90": self.percentile(90), "p99": self.percentile(99), "max": self.max}
+
+
+class Shard:
+    """The counters & histograms updated by a single thread. See Metrics."""
+    def __init__(self, thread=None):
+        self.thread = thread
+        # name -> int
+        self.counters = dict()
+        # name -> Histogram
+        self.histograms = dict()
+
+    def merge(self, other: 'Shard') -> None:
+        """Adds the metrics of `other`, which its thread may be updating meanwhile."""
+        for name, value in list(other.counters.items()):
+            self.counters[name] = self.counters.get(name, 0) + value
+        for name, histogram in list(other.histograms.items()):
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].merge(histogram)
+
+
+class Metrics:
+    """Named counters & histograms. Can be updated from any thread. If it isn't `enabled`, updates do nothing.
+
+    Each thread updates a Shard of its own, so updates take no lock. Metrics.snapshot() adds the shards up, and the
+    shards of the threads that have finished, e.g. those of closed connections, are merged into one."""
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        # Guards `shards` & `finished`.
+        self.mutex = Lock()
+        self.start = monotonic()
+        # The counters & histograms of the current thread, see Metrics._register().
+        self.local = local()
+        # Shards of the threads that have updated the metrics and may still be running.
+        self.shards = []
+        # The metrics of the threads that have finished.
+        self.finished = Shard()
+
+    def _register(self) -> None:
+        """Makes a shard for the current thread."""
+        shard = Shard(current_thread())
+        with self.mutex:
+            for old in [old for old in self.shards if not old.thread.is_alive()]:
+                self.finished.merge(old)
+                self.shards.remove(old)
+            self.shards.append(shard)
+        self.local.counters, self.local.histograms = shard.counters, shard.histograms
+
+    def count(self, name: str, increment: int = 1) -> None:
+        if not self.enabled:
+            return
+        try:
+            counters = self.local.counters
+        except AttributeError:
+            self._register()
+            counters = self.local.counters
+        counters[name] = counters.get(name, 0) + increment
+
+    def observe(self, name: str, value: int) -> None:
+        """Adds `value` to histogram `name`."""
+        if not self.enabled:
+            return
+        try:
+            histogram = self.local.histograms[name]
+        except AttributeError:
+            self._register()
+            histogram = self.local.histograms[name] = Histogram()
+        except KeyError:
+            histogram = self.local.histograms[name] = Histogram()
+        histogram.add(value)
+
+    def observe_time(self, name: str, start: float) -> None:
+        """Adds the microseconds passed since `start`, a value of perf_counter(), to histogram `name`."""
+        if self.enabled:
+            self.observe(name, (perf_counter() - start) * 1e6)
+
+    def snapshot(self) -> dict:
+        total = Shard()
+        with self.mutex:
+            total.merge(self.finished)
+            for shard in self.shards:
+                total.merge(shard)
+        return {"uptime": monotonic() - self.start, "counters": total.counters,
+                "histograms": {name: histogram.summary() for name, histogram in total.histograms.items()}}
+
+
+class TimedLock:
+    """A Lock that records how long threads wait for it, in microseconds, to histogram `name` of `metrics`.
+    An acquisition that doesn't wait isn't recorded, so the count of the histogram is the number of contended ones."""
+    def __init__(self, metrics: Metrics, name: str):
+        self.lock = Lock()
+        self.metrics = metrics
+        self.name = name
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if self.lock.acquire(False):
+            return True
+        if not blocking:
+            return False
+        start = perf_counter()
+        acquired = self.lock.acquire(True, timeout)
+        self.metrics.observe_time(self.name, start)
+        return acquired
+
+    def release(self) -> None:
+        self.lock.release()
+
+    def locked(self) -> bool:
+        return self.lock.locked()
+
+    def __enter__(self) -> bool:
+        # The fast path of acquire(), inlined: the world's locks are taken a lot.
+        return self.lock.acquire(False) or self.acquire()
+
+    def __exit__(self, *args) -> None:
+        self.lock.release()
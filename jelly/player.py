@@ -1,20 +1,30 @@
 from threading import Lock
-from datetime import datetime, timedelta
+from itertools import count
 from jelly.utils import Direction, distance
+from jelly.grid import SpatialGrid
+from jelly.leaderboard import LeaderBoard
+from jelly.changes import ChangeLog
 
 # TODO: document.
 
 
 class Player:
     """Provides read-only access to a player."""
-    def __init__(self, nick: str, x: int, y: int, size: int, factor: float, effect_end: datetime, color: (int, int, int)):
+    __slots__ = ('nick', 'x', 'y', 'size', 'speed_factor', 'effect_end', 'color', 'seq')
+
+    def __init__(self, nick: str, x: int, y: int, size: int, factor: float, effect_end: int, color: (int, int, int),
+                 seq: int = 0):
         self.nick = nick
         self.x = x
         self.y = y
         self.size = size
         self.speed_factor = factor
+        # At server side, the tick the speed effect ends at, 0 if there's none. In snapshots & at client side, the
+        # number of ticks left. See Server.tick()
         self.effect_end = effect_end
         self.color = color
+        # Number of the last `MOVE` command applied to the player. See jelly/prediction.py
+        self.seq = seq
 
     @property
     def xy(self):
@@ -26,7 +36,7 @@ class Player:
 
     def list(self) -> list:
         """Returns all params as a list."""
-        return [self.nick, self.x, self.y, self.size, self.speed_factor, self.effect_end, self.color]
+        return [self.nick, self.x, self.y, self.size, self.speed_factor, self.effect_end, self.color, self.seq]
 
     def move_step(self, initial_player_size: int):
         """The bigger you're, the slower you're."""
@@ -68,60 +78,162 @@ def player_was_eaten(a: Player, b: Player) -> (Player, Player):
 
 class Players:
     """A high-level wrapper for players."""
-    def __init__(self, initial_size: int = None, init=None):
+    # Players are recorded in a ChangeLog under keys (KEY, nick).
+    KEY = 'players'
+    # Name of a param -> its position in the params of a player.
+    PARAMS = {'x': 0, 'y': 1, 'size': 2, 'speed_factor': 3, 'effect_end': 4, 'color': 5, 'seq': 6}
+
+    def __init__(self, initial_size: int = None, init=None, cell_size: int = None, changes: ChangeLog = None):
         self.initial_size = initial_size
+        # nick -> [x, y, size, speed factor, effect end, color, seq]. The params of a player are never changed in
+        # place, a changed player gets a new list, since frozen copies of `data` share them. See jelly/world.py
         self.data = dict()
         self.mutex = Lock()
+        # A copy of `data` returned by Players.freeze(). Is reset once `data` changes.
+        self.frozen = None
+
+        # Players indexed by their coordinates. Is `None` if `cell_size` isn't given (e.g. at client side).
+        self.grid = SpatialGrid(cell_size) if cell_size is not None else None
+        # Keeps the players ordered by size. Its largest size is the search radius in nearby(), see Players.max_size.
+        self.leaderboard = LeaderBoard()
+        # nick -> a small integer that identifies the player in binary snapshots. Isn't reused while the server runs.
+        self.indices = dict()
+        self.next_index = count()
+        # Records changes of players if not `None`, e.g. at server side.
+        self.changes = changes
+        # Nicks of the players with a speed effect. Their ticks left change every tick. See Server.snapshot().
+        self.effects = set()
 
         if init is not None and isinstance(init, dict):
             self.data = init
+            for nick, params in self.data.items():
+                self._index(nick, params)
+
+    def _index(self, nick: str, params: list) -> None:
+        """Updates the spatial index & the leader board after player `nick` has changed.
+        Must be called under the mutex."""
+        self.leaderboard.update(nick, params[2])
+        if self.grid is not None:
+            self.grid.insert(nick, (params[0], params[1]))
+
+    @property
+    def max_size(self) -> int:
+        """The size of the largest player now, so it shrinks once the largest one is eaten, leaves or is respawned at
+        a new round. Must be read under the mutex."""
+        return self.leaderboard.max_size()
+
+    def _changed(self, nick: str) -> None:
+        self.frozen = None
+        if self.changes is not None:
+            self.changes.touch((Players.KEY, nick))
+
+    def _update(self, nick: str, **params) -> None:
+        """Replaces the params of player `nick` with a copy with `params` changed, e.g. _update(nick, size=1).
+        Must be called under the mutex."""
+        new = self.data[nick].copy()
+        for name, value in params.items():
+            new[self.PARAMS[name]] = value
+        self.data[nick] = new
+        self._changed(nick)
+
+    def _remove(self, nick: str) -> None:
+        """Must be called under the mutex."""
+        self.frozen = None
+        self.data.pop(nick, None)
+        self.effects.discard(nick)
+        self.indices.pop(nick, None)
+        self.leaderboard.remove(nick)
+        if self.grid is not None:
+            self.grid.remove(nick)
+        if self.changes is not None:
+            self.changes.remove((Players.KEY, nick))
 
     def spawn(self, nick: str, xy: (int, int), color: (int, int, int)) -> None:
         assert self.initial_size is not None
         with self.mutex:
-            self.data[nick] = [xy[0], xy[1], self.initial_size, 1, datetime.now(), color]
+            # A player respawned at a new round keeps counting its moves.
+            seq = self.data[nick][6] if nick in self.data else 0
+            self.data[nick] = [xy[0], xy[1], self.initial_size, 1, 0, color, seq]
+            self.effects.discard(nick)
+            if nick not in self.indices:
+                self.indices[nick] = next(self.next_index)
+            self._index(nick, self.data[nick])
+            self._changed(nick)
 
     def clear(self) -> None:
         with self.mutex:
-            self.data.clear()
+            for nick in list(self.data):
+                self._remove(nick)
 
-    def move(self, player: Player, direction: Direction) -> None:
-        if datetime.now() > player.effect_end:
-            self.clear_speed_factor(player)
-        coords_after_move = player.coords_after_move(direction, self.initial_size)
+    def apply(self, changed: dict, removed: list) -> None:
+        """Applies a delta snapshot: sets params of `changed` players (nick -> params) and removes `removed` ones."""
         with self.mutex:
-            self.data[player.nick][0] = coords_after_move[0]
-            self.data[player.nick][1] = coords_after_move[1]
+            for nick in removed:
+                self._remove(nick)
+            for nick, params in changed.items():
+                self.data[nick] = params
+                self._index(nick, params)
+            self.frozen = None
 
-    def grow(self, player: Player, increment: int) -> None:
+    def move(self, player: Player, direction: Direction, seq: int = None) -> None:
+        self.move_to(player, player.coords_after_move(direction, self.initial_size), seq)
+
+    def move_to(self, player: Player, xy: (int, int), seq: int = None) -> None:
+        """Moves `player` to `xy` computed by Player.coords_after_move().
+        `seq` is the number of the `MOVE` command, if the client has numbered it."""
         with self.mutex:
-            self.data[player.nick][2] += increment
+            if seq is not None:
+                self._update(player.nick, x=xy[0], y=xy[1], seq=seq)
+            else:
+                self._update(player.nick, x=xy[0], y=xy[1])
+            if self.grid is not None:
+                self.grid.move(player.nick, xy)
 
-            # FIXME: don't rely on implementation-defined behaviour.
-            # Python dictionaries have the following property: they preserve the order in which the keys were added.
-            # So, we sort players by `size` param to print the leader board at client side later.
-            self.data = dict(sorted(self.data.items(), key=lambda item: item[1][2], reverse=True))
+    def skip_move(self, player: Player, seq: int) -> None:
+        """Records that the `MOVE` command number `seq` has been handled, but the player couldn't move."""
+        with self.mutex:
+            self._update(player.nick, seq=seq)
 
-    def set_speed_effect_end_time(self, player: Player, increment: timedelta):
-        new_end = datetime.now() + increment
+    def grow(self, player: Player, increment: int) -> None:
         with self.mutex:
-            self.data[player.nick][4] = new_end
+            # The player may have disconnected during the tick.
+            if player.nick not in self.data:
+                return
+            size = self.data[player.nick][2] + increment
+            self._update(player.nick, size=size)
+            self.leaderboard.update(player.nick, size)
 
-    def mul_speed_factor(self, player: Player, m: float):
+    def add_speed_effect(self, player: Player, m: float, end: int) -> bool:
+        """Multiplies the speed factor of `player` by `m` until tick `end`, which replaces the end of its current
+        effect. Returns False if the player has disconnected. The caller has to call Players.end_speed_effect() at
+        tick `end`."""
         with self.mutex:
-            self.data[player.nick][3] *= m
+            if player.nick not in self.data:
+                return False
+            self._update(player.nick, speed_factor=self.data[player.nick][3] * m, effect_end=end)
+            self.effects.add(player.nick)
+            return True
 
-    def clear_speed_factor(self, player: Player):
+    def end_speed_effect(self, nick: str, end: int) -> None:
+        """Resets the speed factor of player `nick` if its effect ends at tick `end`. Otherwise, the player has
+        eaten another food unit since, respawned or disconnected, and nothing is done."""
         with self.mutex:
-            self.data[player.nick][3] = 1
+            params = self.data.get(nick)
+            if params is not None and params[4] == end:
+                self._update(nick, speed_factor=1, effect_end=0)
+                self.effects.discard(nick)
 
     def kill(self, player: Player):
         with self.mutex:
-            self.data[player.nick][2] = 0
+            if player.nick not in self.data:
+                return
+            self._update(player.nick, size=0)
+            self.leaderboard.update(player.nick, 0)
 
     def pop(self, nick: str) -> None:
         with self.mutex:
-            self.data.pop(nick, None)
+            if nick in self.data:
+                self._remove(nick)
 
     def __getitem__(self, nick: str) -> Player:
         """Returns a read-only copy."""
@@ -136,8 +248,71 @@ class Players:
     def get_players(self) -> list[Player]:
         return [Player(nick, *self.data[nick]) for nick in self.data]
 
+    def nearby(self, player: Player) -> list[Player]:
+        """Returns alive players that `player` may eat or be eaten by. That is a superset of such players: the caller
+        still has to call player_was_eaten()."""
+        if self.grid is None:
+            return self.get_players()
+        with self.mutex:
+            nicks = self.grid.query(player.xy, max(player.size, self.max_size))
+            return [Player(nick, *self.data[nick]) for nick in nicks if self.data[nick][2] > 0]
+
+    def in_rect(self, rect: (int, int, int, int)) -> list[str]:
+        """Returns nicks of the players which circles overlap the rectangle (left, top, right, bottom)."""
+        left, top, right, bottom = rect
+        with self.mutex:
+            if self.grid is None:
+                candidates = list(self.data)
+            else:
+                margin = self.max_size
+                candidates = self.grid.query_rect((left - margin, top - margin, right + margin, bottom + margin))
+            result = []
+            for nick in candidates:
+                x, y, size = self.data[nick][:3]
+                if left - size <= x <= right + size and top - size <= y <= bottom + size:
+                    result.append(nick)
+            return result
+
+    def is_free(self, xy: (int, int), vicinity: int) -> bool:
+        """Returns True if `xy` is farther than `vicinity` from the circle of each alive player."""
+        with self.mutex:
+            if self.grid is None:
+                candidates = list(self.data)
+            else:
+                candidates = self.grid.query(xy, self.max_size + vicinity)
+            for nick in candidates:
+                x, y, size = self.data[nick][:3]
+                if size > 0 and (x - xy[0]) ** 2 + (y - xy[1]) ** 2 <= (size + vicinity) ** 2:
+                    return False
+            return True
+
+    def circles(self) -> list[(int, int, int)]:
+        """Returns (x, y, size) of all the alive players."""
+        with self.mutex:
+            return [(x, y, size) for x, y, size, *_ in self.data.values() if size > 0]
+
     def get_players_raw(self) -> dict:
         return self.data
 
+    def freeze(self) -> dict:
+        """Returns a copy of `data` that is never changed. The same copy is returned until `data` changes.
+        Must be called under the mutex."""
+        if self.frozen is None:
+            self.frozen = self.data.copy()
+        return self.frozen
+
     def nicks(self):
         return self.data.keys()
+
+    def top_k(self, k: int) -> list[str]:
+        """Returns nicks of `k` largest players, the largest goes first."""
+        with self.mutex:
+            return self.leaderboard.top_k(k)
+
+    def rank(self, nick: str) -> int:
+        """Returns the place of player `nick` in the leader board counting from 0, or `None` if there's no such player,
+        e.g. if it has disconnected since the world a snapshot is made of was published."""
+        with self.mutex:
+            if nick not in self.leaderboard:
+                return None
+            return self.leaderboard.rank(nick)
@@ -0,0 +1,89 @@
+"""Client-side prediction of the client's own player & interpolation of the other players.
+
+The client draws its own player where it will be once the server has applied the moves sent so far, so the player
+moves as soon as a key is pressed rather than a round trip later. The other players are drawn between their
+positions in the two most recent states, so they move smoothly however rarely the states arrive."""
+from collections import deque
+from time import monotonic
+
+from jelly.player import Player
+from jelly.utils import Direction, distance
+
+
+class Prediction:
+    """Predicts the position of the client's own player.
+
+    Each `MOVE` command is numbered, and the server reports the number of the last one it has applied to the player
+    (see Player.seq). When a state arrives, the moves the server hasn't applied yet are replayed on top of it, so the
+    prediction converges to the server state instead of drifting away."""
+    def __init__(self, initial_size: int, map_wh: (int, int)):
+        self.initial_size = initial_size
+        self.map_wh = map_wh
+        # Number of the last move sent.
+        self.seq = 0
+        # (number, direction) of the moves sent but not applied by the server yet, the oldest goes first.
+        self.pending = deque()
+        # The predicted player. Is `None` until the first state arrives.
+        self.player = None
+
+    def move(self, direction: Direction) -> int:
+        """Moves the predicted player. Returns the number to send with the `MOVE` command."""
+        self.seq += 1
+        self.pending.append((self.seq, direction))
+        if self.player is not None:
+            self.player = self.moved(self.player, direction)
+        return self.seq
+
+    def reconcile(self, player: Player) -> None:
+        """Takes the state of the player sent by the server and replays the moves it hasn't applied yet."""
+        while self.pending and self.pending[0][0] <= player.seq:
+            self.pending.popleft()
+        for _, direction in self.pending:
+            player = self.moved(player, direction)
+        self.player = player
+
+    def moved(self, player: Player, direction: Direction) -> Player:
+        """Returns `player` after the server has applied a move to `direction`. See Server.move_and_collide()."""
+        if player.is_dead:
+            return player
+        x, y = player.coords_after_move(direction, self.initial_size)
+        if not (0 <= x < self.map_wh[0] and 0 <= y < self.map_wh[1]):
+            return player
+        # The server ends the speed effect itself, and the next state brings the factor reset.
+        return Player(player.nick, x, y, player.size, player.speed_factor, player.effect_end, player.color, player.seq)
+
+
+class Interpolation:
+    """Smooths the movement of the players: a player is drawn between its positions in the previous and the latest
+    states, reaching the latest one by the time the next state is expected. That delays the other players by one
+    state interval."""
+
+    # A player that has moved farther between two states (e.g. respawned) jumps.
+    MAX_DISTANCE = 200
+
+    def __init__(self):
+        # nick -> (x, y) in the previous state of the players changed by the latest state.
+        self.previous = dict()
+        # When the latest state arrived.
+        self.time = None
+        # Expected time between two states, in seconds.
+        self.interval = 0
+
+    def update(self, previous: dict) -> None:
+        """Is called when a state has arrived. `previous` are the positions of the changed players (nick -> (x, y))
+        before it has been applied."""
+        now = monotonic()
+        if self.time is not None:
+            # Smooth the interval, so that a single late state doesn't slow everyone down.
+            self.interval = 0.8 * self.interval + 0.2 * (now - self.time) if self.interval else now - self.time
+        self.time = now
+        self.previous = previous
+
+    def xy(self, nick: str, xy: (int, int)) -> (int, int):
+        """Returns where to draw player `nick` which is at `xy` in the latest state."""
+        previous = self.previous.get(nick)
+        if previous is None or self.interval <= 0 or distance(previous, xy) > self.MAX_DISTANCE:
+            return xy
+        alpha = min(1.0, (monotonic() - self.time) / self.interval)
+        return (round(previous[0] + (xy[0] - previous[0]) * alpha),
+                round(previous[1] + (xy[1] - previous[1]) * alpha))
@@ -0,0 +1,136 @@
+"""Profiling of a running server for a window of time, started by `PROFILE` command. See docs/protocol.md
+
+Two modes are supported:
+- `sample` samples the stacks of all the threads every Profiler.INTERVAL seconds and writes them in the collapsed
+  format, one stack per line with the number of its samples, which flamegraph.pl, speedscope & co. read. It measures
+  wall-clock time, so the threads waiting for their clients show up too, in recv.
+- `pstats` profiles every call made by the command handlers and the collision pass with cProfile and writes pstats,
+  which `python3 -m pstats` and snakeviz read. It slows them down several times while it runs. Each thread has a
+  profile of its own, which Python 3.12+ doesn't allow: cProfile is built on sys.monitoring there, which lets only
+  one profiler be active in the process at a time. So on 3.12+ a `pstats` capture is done in `sample` mode instead.
+
+The files are named after the time of the capture and the numbers of players & food units at the start of it."""
+import cProfile
+import os
+import pstats
+import sys
+from collections import Counter
+from datetime import datetime
+from threading import Thread, Lock, Condition, get_ident, local
+from time import monotonic, sleep
+
+
+def collapse(frame) -> str:
+    """Returns the stack of `frame` in the collapsed format: `function (file:line)` from the root down, joined
+    with `;`."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append("{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), frame.f_lineno))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Profiler:
+    """Runs one capture at a time and writes the results to `directory`."""
+
+    MODES = ('sample', 'pstats')
+    # Seconds between samples in `sample` mode.
+    INTERVAL = 0.005
+    # A capture may run for at most that many seconds.
+    MAX_SECONDS = 600
+    # Whether each thread can enable a cProfile.Profile of its own at the same time. See the module docstring.
+    PER_THREAD_PROFILES = sys.version_info < (3, 12)
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.mutex = Lock()
+        # Mode of the running capture, None if there's none.
+        self.mode = None
+        # cProfile.Profile of each thread that has called Profiler.call() during a `pstats` capture.
+        self.local = local()
+        self.profiles = []
+        # Number of the calls being profiled. Profiler.idle is notified once it's 0.
+        self.calls = 0
+        self.idle = Condition(self.mutex)
+
+    def start(self, seconds: float, mode: str, tags: dict) -> str:
+        """Starts a capture of `seconds` in `mode`. Returns the path of the file it will be written to once it's
+        done. `tags`, e.g. {"players": 10}, are added to the name of the file. Raises ValueError if a capture is
+        running already or the arguments are invalid."""
+        if mode not in self.MODES:
+            raise ValueError("Unknown profiling mode '{}'.".format(mode))
+        if not (isinstance(seconds, (int, float)) and 0 < seconds <= self.MAX_SECONDS):
+            raise ValueError("Profiling time '{}' isn't in (0, {}] seconds.".format(seconds, self.MAX_SECONDS))
+        if mode == 'pstats' and not self.PER_THREAD_PROFILES:
+            mode = 'sample'
+        name = "profile-{}-{}.{}".format(
+            datetime.now().strftime("%Y%m%d-%H%M%S"), "-".join("{}{}".format(k, v) for k, v in tags.items()),
+            "folded" if mode == 'sample' else "pstats")
+        path = os.path.join(self.directory, name)
+        with self.mutex:
+            if self.mode is not None:
+                raise ValueError("A capture is running already.")
+            self.mode = mode
+            self.profiles = []
+        os.makedirs(self.directory, exist_ok=True)
+        target = self.sample if mode == 'sample' else self.wait
+        Thread(target=target, args=(seconds, path), daemon=True).start()
+        return path
+
+    def call(self, func, *args):
+        """Returns func(*args). Profiles the call if a `pstats` capture is running."""
+        if self.mode != 'pstats':
+            return func(*args)
+        with self.mutex:
+            if self.mode != 'pstats':
+                profile = None
+            elif getattr(self.local, 'capture', None) is self.profiles:
+                profile = self.local.profile
+            else:
+                profile = self.local.profile = cProfile.Profile()
+                self.local.capture = self.profiles
+                self.profiles.append(profile)
+            if profile is not None:
+                self.calls += 1
+        if profile is None:
+            return func(*args)
+        try:
+            return profile.runcall(func, *args)
+        finally:
+            with self.mutex:
+                self.calls -= 1
+                if not self.calls:
+                    self.idle.notify_all()
+
+    def sample(self, seconds: float, path: str) -> None:
+        stacks = Counter()
+        me = get_ident()
+        end = monotonic() + seconds
+        try:
+            while monotonic() < end:
+                sleep(self.INTERVAL)
+                for thread, frame in sys._current_frames().items():
+                    if thread != me:
+                        stacks[collapse(frame)] += 1
+            with open(path, 'w') as f:
+                for stack, count in stacks.items():
+                    f.write("{} {}\n".format(stack, count))
+        finally:
+            self.mode = None
+
+    def wait(self, seconds: float, path: str) -> None:
+        sleep(seconds)
+        with self.mutex:
+            self.mode = None
+            # A profile can only be read once its call is done.
+            self.idle.wait_for(lambda: not self.calls)
+            profiles, self.profiles = self.profiles, []
+        if profiles:
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(path)
+        else:
+            # Nothing has been called.
+            cProfile.Profile().dump_stats(path)
@@ -0,0 +1,116 @@
+import asyncio
+import socket
+from struct import Struct
+
+from jelly.utils import InvalidData
+
+# Each message is prefixed with its length: an unsigned 32-bit integer in network byte order. See docs/protocol.md
+HEADER = Struct('!I')
+
+# Refuse messages larger than this, so that a broken peer can't make us allocate all the memory.
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+
+def encode_frame(payload: bytes) -> bytes:
+    """Prefixes `payload` with its length."""
+    return HEADER.pack(len(payload)) + payload
+
+
+def send_frame(sock: socket.socket, payload: bytes) -> None:
+    sock.sendall(encode_frame(payload))
+
+
+def _check_length(length: int) -> None:
+    if length > MAX_FRAME_SIZE:
+        raise InvalidData("A message of {} bytes exceeds the limit of {} bytes.".format(length, MAX_FRAME_SIZE))
+
+
+class FrameDecoder:
+    """Splits a stream of bytes into length-prefixed messages (frames).
+
+    Bytes are received straight into a reusable buffer (see FrameDecoder.writable()), and complete frames are returned
+    as `memoryview` slices of it, so nothing is copied. A frame is only valid until the next call of
+    FrameDecoder.writable(). The buffer grows if a frame doesn't fit into it."""
+
+    # Read at least this many bytes at once.
+    MIN_READ_SIZE = 4096
+
+    def __init__(self, size: int = 65536):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        # Received bytes that haven't been returned yet are `buffer[start:end]`.
+        self.start = 0
+        self.end = 0
+
+    def _next_length(self) -> int:
+        """Returns the length of the next frame including its header or `None` if the header hasn't been received."""
+        if self.end - self.start < HEADER.size:
+            return None
+        (length,) = HEADER.unpack_from(self.buffer, self.start)
+        _check_length(length)
+        return HEADER.size + length
+
+    def writable(self) -> memoryview:
+        """Returns free space of the buffer to receive bytes into, e.g. using socket.recv_into().
+        Call FrameDecoder.advance() with the number of received bytes afterwards."""
+        pending = self.end - self.start
+        # How many bytes the buffer must hold starting from `start`.
+        needed = max(self._next_length() or 0, pending + self.MIN_READ_SIZE)
+        if len(self.buffer) < needed:
+            # The frame doesn't fit into the buffer at all.
+            buffer = bytearray(max(2 * len(self.buffer), needed))
+            buffer[:pending] = self.view[self.start:self.end]
+            self.buffer, self.view = buffer, memoryview(buffer)
+            self.start, self.end = 0, pending
+        elif len(self.buffer) - self.start < needed:
+            # Move the incomplete frame to the start of the buffer. The regions may overlap, hence the copy.
+            self.view[:pending] = bytes(self.view[self.start:self.end])
+            self.start, self.end = 0, pending
+        return self.view[self.end:]
+
+    def advance(self, size: int) -> None:
+        """Tells the decoder that `size` bytes were written to the memory returned by FrameDecoder.writable()."""
+        self.end += size
+
+    def feed(self, data: bytes) -> None:
+        """Appends `data` to the buffer. Use it if the bytes have already been received somewhere else."""
+        offset = 0
+        while offset < len(data):
+            free = self.writable()
+            size = min(len(free), len(data) - offset)
+            free[:size] = data[offset:offset + size]
+            self.advance(size)
+            offset += size
+
+    def frames(self) -> list[memoryview]:
+        """Returns all complete frames received so far without their headers."""
+        result = []
+        while True:
+            length = self._next_length()
+            if length is None or self.end - self.start < length:
+                break
+            result.append(self.view[self.start + HEADER.size:self.start + length])
+            self.start += length
+        if self.start == self.end:
+            self.start = self.end = 0
+        return result
+
+
+def recv_frames(sock: socket.socket, decoder: FrameDecoder) -> list[memoryview]:
+    """Blocks until at least one complete frame is received from `sock`, then returns all complete frames.
+    Returns `None` if the connection was closed."""
+    while True:
+        size = sock.recv_into(decoder.writable())
+        if size == 0:
+            return None
+        decoder.advance(size)
+        frames = decoder.frames()
+        if frames:
+            return frames
+
+
+async def read_frame(reader: asyncio.StreamReader) -> bytes:
+    """Reads one frame from `reader`. Raises `asyncio.IncompleteReadError` if the connection was closed."""
+    (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    _check_length(length)
+    return await reader.readexactly(length)
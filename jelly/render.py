@@ -0,0 +1,111 @@
+"""Drawing helpers of the pygame client.
+
+Rendering text and antialiased circles is much slower than blitting a ready surface, and most of what the client
+draws is the same from frame to frame: nicks, the leader board, circles of the same sizes & colors. So Renderer
+keeps pre-rendered surfaces in LRU caches and blits them.
+
+The cached surfaces are run-length encoded: blitting a surface with per-pixel alpha checks every pixel, but most
+pixels of a sprite are either transparent or opaque, and RLE skips or copies such runs at once. That makes blitting
+a large circle several times faster than drawing it."""
+from collections import OrderedDict
+
+from pygame import Surface, Color, SRCALPHA, RLEACCEL, font, gfxdraw
+
+
+# https://stackoverflow.com/a/62480486
+def draw_circle(window: Surface, xy: (int, int), radius: int, color: Color):
+    """Draws a circle at `xy` point with radius `radius` and color `color` on `window` using antialiasing."""
+    gfxdraw.aacircle(window, xy[0], xy[1], radius, color)
+    gfxdraw.filled_circle(window, xy[0], xy[1], radius, color)
+
+
+def draw_text(surface: Surface, f: font.Font, text: str, color=(0, 0, 0), **kwargs):
+    image = f.render(text, True, color)
+    rect = image.get_rect(**kwargs)
+    surface.blit(image, rect)
+
+
+def rle(surface: Surface) -> Surface:
+    """Makes SDL run-length encode `surface` when it's blitted the first time. Returns `surface`."""
+    surface.set_alpha(255, RLEACCEL)
+    return surface
+
+
+class LRUCache:
+    """A dict of entries that weigh at most `capacity` in total. Once it's full, the least recently used entries are
+    dropped. `weigh(value)` returns the weight of an entry, 1 by default, so `capacity` is the number of entries.
+    Isn't thread-safe: it's used by the render loop only. `hits` and `misses` count lookups."""
+    def __init__(self, capacity: int, weigh=None):
+        self.capacity = capacity
+        self.weigh = weigh
+        self.entries = OrderedDict()
+        # The total weight of the entries.
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, make):
+        """Returns the value cached for `key`. If there's none, caches and returns `make()`."""
+        value = self.entries.get(key)
+        if value is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return value
+        self.misses += 1
+        value = self.entries[key] = make()
+        self.weight += self.weigh(value) if self.weigh is not None else 1
+        # The new entry is kept even if it alone is heavier than the capacity.
+        while self.weight > self.capacity and len(self.entries) > 1:
+            _, dropped = self.entries.popitem(last=False)
+            self.weight -= self.weigh(dropped) if self.weigh is not None else 1
+        return value
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+def surface_bytes(surface: Surface) -> int:
+    """Returns the size of the pixels of `surface`."""
+    return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+
+class Renderer:
+    """Does what draw_text() & draw_circle() do, but renders each text and circle once and then blits the cached
+    surface."""
+
+    # Surfaces of larger circles take too much memory, and there are few such circles on the screen anyway.
+    MAX_SPRITE_RADIUS = 256
+
+    # The capacities should exceed the texts & circles on the screen, otherwise every frame evicts the entries the next
+    # one needs. The circles are bounded by the bytes of their surfaces: a sprite of the largest radius takes 1 MB, of
+    # a food unit a few KB.
+    def __init__(self, texts: int = 2048, circle_bytes: int = 32 * 1024 * 1024):
+        # (text, color, font) -> Surface
+        self.texts = LRUCache(texts)
+        # (radius, color) -> Surface
+        self.circles = LRUCache(circle_bytes, surface_bytes)
+
+    def text(self, f: font.Font, text: str, color=(0, 0, 0)) -> Surface:
+        """Returns `text` rendered with font `f`."""
+        color = tuple(color)
+        return self.texts.get((text, color, f), lambda: rle(f.render(text, True, color)))
+
+    def draw_text(self, surface: Surface, f: font.Font, text: str, color=(0, 0, 0), **kwargs):
+        image = self.text(f, text, color)
+        surface.blit(image, image.get_rect(**kwargs))
+
+    def circle(self, radius: int, color: Color) -> Surface:
+        """Returns a transparent square surface with a circle of `radius` in its center."""
+        color = tuple(color)
+
+        def make():
+            sprite = Surface((2 * radius + 1, 2 * radius + 1), SRCALPHA)
+            draw_circle(sprite, (radius, radius), radius, color)
+            return rle(sprite)
+        return self.circles.get((radius, color), make)
+
+    def draw_circle(self, window: Surface, xy: (int, int), radius: int, color: Color):
+        if not 0 <= radius <= self.MAX_SPRITE_RADIUS:
+            draw_circle(window, xy, radius, color)
+            return
+        window.blit(self.circle(radius, color), (xy[0] - radius, xy[1] - radius))
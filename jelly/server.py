@@ -1,12 +1,68 @@
+import signal
 import socket
-from threading import Thread
+from collections import deque
+from threading import Thread, Lock, Condition
+from time import monotonic, sleep, perf_counter
 from json import loads, dumps
-from random import randrange
+from random import random
 from datetime import datetime, timedelta
 
 from jelly.utils import Direction, InvalidData, assert_nick, random_color
 from jelly.player import Players, Player, player_was_eaten
-from jelly.food import Food, FoodKind, food_was_eaten
+from jelly.food import Food, FoodUnit, FoodKind, food_was_eaten
+from jelly.protocol import FrameDecoder, recv_frames, send_frame
+from jelly.snapshot import encode_snapshot, encode_records, encode_header, pack_players, pack_food
+from jelly.changes import ChangeLog
+from jelly.cache import SnapshotCache
+from jelly.metrics import Metrics, TimedLock
+from jelly.profiling import Profiler
+from jelly.world import World
+from jelly.compression import Compressor
+from jelly.timers import TimerWheel
+from jelly.spawning import Spawner
+
+
+class Session:
+    """State of a single client connection.
+
+    Each connection has a writer that sends the messages returned by Server.next_message(), so that the threads
+    handling requests & pushing the state never wait for a slow client."""
+    def __init__(self, wake=None, close=None):
+        # Wakes the writer of the connection up to send what's queued. Can be called from any thread.
+        self.wake = wake or (lambda: None)
+        # Closes the connection at once, even if the writer is blocked. Can be called from any thread.
+        self.close = close or (lambda: None)
+        # Responses waiting to be sent, the oldest goes first. See Server.enqueue().
+        self.outbox = deque()
+        # Whether the state has changed since the last push. A push is encoded only once it's sent, so a slow client
+        # gets the latest state rather than a queue of stale ones. See Server.push().
+        self.push_pending = False
+        # Number of ticks the pending push has been waiting for the client.
+        self.behind = 0
+        # Is set once no more messages are to be queued, e.g. the client has disconnected.
+        self.closed = False
+        # Whether the server pushes the state to the client after each tick. See `SUBSCRIBE`.
+        self.subscribed = False
+        # Version of the world the client has been sent last.
+        self.version = None
+        # Format of `GET` responses. See Server.FORMAT.
+        self.format = Server.JSON
+        # Compresses the messages sent to the client if it has sent `COMPRESS`. Is only used by the writer.
+        self.compressor = None
+        # Player index -> color of the nick/color table entries sent to the client. See jelly/snapshot.py
+        self.table = dict()
+        # Nick of the player spawned by the client.
+        self.nick = None
+        # Width and height of the client's screen if the client wants to receive only what it can see. See `VIEW`.
+        self.view = None
+        # Nicks & food IDs the client has received and hasn't been told to remove since. Only used if `view` is set.
+        self.known_players = set()
+        self.known_food = set()
+        # Bytes sent to the client, without the frame headers.
+        self.bytes_sent = 0
+        # Is held while a message is made for the client, since the messages depend on what it has been sent before:
+        # `table`, `known_*` & `version`. See Server.serve_request() and Server.next_message().
+        self.mutex = Lock()
 
 
 class Server:
@@ -18,18 +74,56 @@ class Server:
     SPAWN = 'SPAWN'
     MOVE = 'MOVE'
     DISCONNECT = 'DISCONNECT'
-
-    DELIMITER = ';'
+    FORMAT = 'FORMAT'
+    VIEW = 'VIEW'
+    SUBSCRIBE = 'SUBSCRIBE'
+    STATS = 'STATS'
+    PROFILE = 'PROFILE'
+    COMPRESS = 'COMPRESS'
+    COMMANDS = (GET, GET_MAP_BOUNDS, SPAWN, MOVE, DISCONNECT, FORMAT, VIEW, SUBSCRIBE, STATS, PROFILE, COMPRESS)
+
+    # Share of the requests which latency & response size are recorded. All of them are counted. See `STATS`.
+    TIMING_SAMPLE = 1 / 16
+
+    # Length of a capture started by SIGUSR1, in seconds. See Server.profile().
+    PROFILE_SECONDS = 10
+
+    # A client that has that many responses waiting to be sent doesn't read them, so it's disconnected.
+    SEND_QUEUE_SIZE = 64
+    # A subscribed client that hasn't received a push for that many seconds is disconnected.
+    MAX_PUSH_LAG = 5
+
+    # If a client has sent `VIEW`, it receives entities within this distance off its screen too.
+    VIEW_MARGIN = 100
+    # Number of the top players sent to a client that receives only what it can see.
+    LEADER_BOARD_SIZE = 10
+
+    # Formats of `GET` responses a client can choose using `FORMAT` command.
+    JSON = 'json'
+    BINARY = 'binary'
+
+    # Compression a client can choose using `COMPRESS` command.
+    ZLIB = 'zlib'
+    # Messages shorter than that many bytes are sent uncompressed.
+    COMPRESS_THRESHOLD = 256
 
     def __init__(self, host, port, food_num, width, height, game_time, restart_time, food_min_size, food_max_size,
-                 food_probability, init_player_size):
+                 food_probability, init_player_size, tick_rate, stats_log=None, stats_interval=10, profile_dir=None,
+                 vectorized=False, listen=True, metrics=True):
+        """Creates the world and, if `listen` is set, serves clients until the process is stopped. Otherwise,
+        nothing runs on its own: the game logic is called directly, e.g. by the benchmarks.
+
+        :param stats_log: a file to append the response to `STATS` to every `stats_interval` seconds
+        :param profile_dir: a directory to write the profiles captured on `PROFILE` command or SIGUSR1 to. If it's
+            None, profiling is disabled
+        :param metrics: whether to collect the metrics reported by `STATS`
+        """
         self.HOST = host
         self.PORT = port
         self.FOOD_NUM = food_num
 
         self.MAP_WIDTH = width
         self.MAP_HEIGHT = height
-        self.JSON_MAP_BOUNDS = dumps({"width": self.MAP_WIDTH, "height": self.MAP_HEIGHT}).encode("UTF-8")
 
         self.GAME_TIME = timedelta(seconds=game_time)
         self.RESTART_TIME = timedelta(seconds=restart_time)
@@ -40,55 +134,533 @@ class Server:
 
         self.INIT_PLAYER_SIZE = init_player_size
 
+        # The world is simulated `TICK_RATE` times per second. See Server.tick().
+        assert tick_rate > 0
+        self.TICK_RATE = tick_rate
+
+        # A client needs the tick rate & the initial size to predict the moves of its player. See jelly/prediction.py
+        self.JSON_MAP_BOUNDS = dumps({"width": self.MAP_WIDTH, "height": self.MAP_HEIGHT, "tick_rate": self.TICK_RATE,
+                                      "init_player_size": self.INIT_PLAYER_SIZE}).encode("UTF-8")
+
+        # Size of a cell of the spatial index. A player of the initial size overlaps at most 4 cells.
+        self.GRID_CELL_SIZE = 2 * self.INIT_PLAYER_SIZE
+
+        # Keep the world in NumPy arrays too and check collisions of all the moved players at once.
+        # See jelly/arrays.py
+        self.VECTORIZED = vectorized
+        players_class, food_class = Players, Food
+        if self.VECTORIZED:
+            # NumPy is an optional dependency.
+            from jelly.arrays import ArrayPlayers, ArrayFood
+            players_class, food_class = ArrayPlayers, ArrayFood
+
         # TODO: move params (def pl size & food prob) into the constructor.
-        self.players = Players(self.INIT_PLAYER_SIZE)
-        self.food = Food(self.FOOD_PROBABILITY, food_min_size, food_max_size)
+        # Versions the world, so that clients can ask for changes only. See Server.snapshot().
+        self.changes = ChangeLog()
+        self.players = players_class(self.INIT_PLAYER_SIZE, cell_size=self.GRID_CELL_SIZE, changes=self.changes)
+        self.food = food_class(self.FOOD_PROBABILITY, food_min_size, food_max_size, cell_size=self.GRID_CELL_SIZE,
+                               changes=self.changes)
+        # Draws points away from the players to spawn at. See Server.rand_coords().
+        self.spawner = Spawner(self.MAP_WIDTH, self.MAP_HEIGHT, self.INIT_PLAYER_SIZE, self.players,
+                               self.GRID_CELL_SIZE)
+
+        # Counters & latency histograms reported by `STATS`. See jelly/metrics.py
+        self.metrics = Metrics(enabled=metrics)
+        self.STATS_LOG = stats_log
+        self.STATS_INTERVAL = stats_interval
+        if metrics:
+            # Record how long the threads wait for the world.
+            self.players.mutex = TimedLock(self.metrics, 'lock_wait_us.players')
+            self.food.mutex = TimedLock(self.metrics, 'lock_wait_us.food')
+        # Captures profiles of a running server. See jelly/profiling.py
+        self.profiler = Profiler(profile_dir) if profile_dir is not None else None
+        # Encode players & food in binary snapshots. See jelly/snapshot.py
+        self.pack_players = self.players.pack if self.VECTORIZED else pack_players
+        self.pack_food = self.food.pack if self.VECTORIZED else pack_food
 
         self.start_time = datetime.now()
 
+        # MOVE commands received since the last tick: nick -> direction. Only the latest one per player is kept.
+        self.moves = dict()
+        # nick -> number of the latest MOVE command, if the client numbers them.
+        self.move_seqs = dict()
+        self.moves_mutex = Lock()
+        # Nicks of the players with a speed effect, due at the tick the effect ends at. Counts the ticks.
+        # Is only used by the thread running the ticks. See Server.add_speed_effect().
+        self.effects = TimerWheel()
+
+        # Snapshots shared by the clients that don't use `VIEW`. See Server.get_data().
+        self.snapshot_cache = SnapshotCache()
+
+        # Sessions of the clients that have sent `SUBSCRIBE`.
+        self.subscribers = set()
+        self.subscribers_mutex = Lock()
+        # Sessions of all the connected clients.
+        self.sessions = set()
+        self.sessions_mutex = Lock()
+
         # Spawn `FOOD_NUM` units of food.
-        for _ in range(self.FOOD_NUM):
-            self.food.spawn(self.rand_coords())
+        self.spawn_food(self.FOOD_NUM)
+        # The latest frozen version of the world, which snapshots are made of. See Server.publish().
+        self.world = None
+        self.publish()
 
-        self.listen()
+        if listen:
+            self.listen()
 
     @staticmethod
     def _json_date_handler(obj):
         return obj.isoformat() if isinstance(obj, datetime) else None
 
-    def rand_coords(self) -> (int, int):
-        """Returns a point P(x, y) such that there are no player points in the circle
-            with the centre at P and radius `vicinity`"""
-        return randrange(self.INIT_PLAYER_SIZE, self.MAP_WIDTH - self.INIT_PLAYER_SIZE),\
-               randrange(self.INIT_PLAYER_SIZE, self.MAP_HEIGHT - self.INIT_PLAYER_SIZE)
+    @staticmethod
+    def effects_left(players: dict, tick: int) -> dict:
+        """Returns `players` (nick -> params) with the tick each speed effect ends at replaced by the number of ticks
+        left after `tick`, as snapshots carry them. `players` is returned as it is if no one has an effect."""
+        result = players
+        for nick, params in players.items():
+            if params[4]:
+                if result is players:
+                    result = dict(players)
+                result[nick] = [*params[:4], max(0, params[4] - tick), *params[5:]]
+        return result
+
+    def rand_coords(self, vicinity: int = 0) -> (int, int):
+        """Returns a random point P(x, y) such that the circles of the players are farther than `vicinity` from P,
+        unless the map is too crowded. A food unit or a player of size `vicinity` spawned at P isn't eaten at once."""
+        return self.spawner.point(vicinity)
+
+    def spawn_food(self, n: int) -> None:
+        """Spawns `n` food units at once at points drawn like Server.rand_coords() does."""
+        self.food.spawn_all(self.spawner.points(n))
 
     def is_player_on_map_after_move(self, player: Player, direction: Direction) -> bool:
         x, y = player.coords_after_move(direction, self.INIT_PLAYER_SIZE)
         return (0 <= x < self.MAP_WIDTH) and (0 <= y < self.MAP_HEIGHT)
 
     def new_round(self):
-        """Respawn all players and food. Update start_time (to start a new round)."""
-        for nick in self.players.get_players_raw().keys():
-            self.players.spawn(nick, self.rand_coords(), random_color())
-
-        self.food.clear()
-        for _ in range(self.FOOD_NUM):
-            self.food.spawn(self.rand_coords())
+        """Respawn all players and food. Update start_time (to start a new round).
+        The food is replaced in another thread, see Server.regenerate_food()."""
+        # The points are drawn at once against each other: the players are still where the last round left them.
+        nicks = list(self.players.nicks())
+        for nick, xy in zip(nicks, self.spawner.spread_points(len(nicks), self.INIT_PLAYER_SIZE)):
+            self.players.spawn(nick, xy, random_color())
 
         self.start_time = datetime.now()
+        Thread(target=self.regenerate_food, daemon=True).start()
+
+    def regenerate_food(self) -> None:
+        """Replaces all the food with `FOOD_NUM` new units away from the players and publishes the world.
+        It takes about half a second for 100k units, so it isn't done by the tick thread, which would skip ticks.
+        The old food stays in the world until the new one is swapped in. See Food.replace_all()."""
+        self.food.replace_all(self.spawner.points(self.FOOD_NUM))
+        self.publish()
 
     def round_end(self):
-        """Returns a point in time, when a new round's going to be started."""
-        result = self.start_time + self.GAME_TIME
+        """Returns a point in time, when the current round is over."""
+        return self.start_time + self.GAME_TIME
+
+    def tick(self):
+        """Advances the world by one step: ends the speed effects that are over, applies the MOVE commands received
+        since the last tick, one per player, then checks collisions of the moved players once and starts a new round
+        if it's time to."""
+        start = perf_counter()
+        # The players that don't move lose their effects in time too.
+        for nick in self.effects.advance():
+            self.players.end_speed_effect(nick, self.effects.tick)
+        with self.moves_mutex:
+            moves, self.moves = self.moves, dict()
+            seqs, self.move_seqs = self.move_seqs, dict()
+        self.metrics.count('moves', len(moves))
+
+        self.profiled(self.apply_moves, moves, seqs)
+
         # If RESTART_TIME is out, start a new round.
-        if datetime.now() - result >= self.RESTART_TIME:
+        if datetime.now() - self.round_end() >= self.RESTART_TIME:
             self.new_round()
-        return result
-
-    def json_get_data(self) -> str:
+        self.publish()
+        self.metrics.observe_time('tick_us', start)
+
+    def publish(self) -> None:
+        """Replaces Server.world with the current state of the world. Is called once the world has been changed:
+        after a tick, `SPAWN` and `DISCONNECT`. Readers take Server.world and never lock it. See jelly/world.py"""
+        start = perf_counter()
+        # Both locks are held, so that the version matches what is copied, and until the world is replaced, so that
+        # a world published by another thread at the same time can't be replaced with an older one.
+        with self.players.mutex, self.food.mutex:
+            self.world = World(self.changes.version, self.players.freeze(), self.food.freeze(), self.round_end(),
+                               self.effects.tick, frozenset(self.players.effects))
+        self.metrics.observe_time('publish_us', start)
+
+    def apply_moves(self, moves: dict, seqs: dict):
+        """The collision pass of Server.tick()."""
+        if self.VECTORIZED:
+            self.collide_vectorized(self.move_vectorized(moves, seqs))
+        else:
+            self.move_and_collide(moves, seqs)
+
+    def move_and_collide(self, moves: dict, seqs: dict = None):
+        """Applies `moves` (nick -> direction) and checks collisions of the moved players one by one.
+        `seqs` are the numbers of the moves (nick -> number), see Server.move_seqs."""
+        seqs = seqs or dict()
+        moved = []
+        for nick, direction in moves.items():
+            # The player may have disconnected since the command was received.
+            if nick not in self.players:
+                continue
+            player = self.players[nick]
+            if not player.is_dead and self.is_player_on_map_after_move(player, direction):
+                self.players.move(player, direction, seqs.get(nick))
+                moved.append(nick)
+            elif nick in seqs:
+                self.players.skip_move(player, seqs[nick])
+
+        for nick in moved:
+            if nick in self.players:
+                player = self.players[nick]
+                if not player.is_dead:
+                    self.process_moved(player)
+
+    def move_vectorized(self, moves: dict, seqs: dict = None) -> list[str]:
+        """Does what Server.move_and_collide() does to apply `moves`, but computes the coordinates of all the players
+        at once. Returns nicks of the moved players. Requires `VECTORIZED`."""
+        seqs = seqs or dict()
+        moved = []
+        for nick, (x, y) in self.players.coords_after_moves(moves):
+            # The player may have disconnected since.
+            if nick not in self.players:
+                continue
+            if (0 <= x < self.MAP_WIDTH) and (0 <= y < self.MAP_HEIGHT):
+                self.players.move_to(self.players[nick], (x, y), seqs.get(nick))
+                moved.append(nick)
+            elif nick in seqs:
+                self.players.skip_move(self.players[nick], seqs[nick])
+        return moved
+
+    def collide_vectorized(self, moved: list[str]):
+        """Does what Server.process_moved() does for all the `moved` players: finds what they may have eaten at once,
+        then applies the collisions one by one, checking them against the current state again. Unlike
+        Server.process_moved(), the food units spawned during the tick can only be eaten at the next one.
+        Requires `VECTORIZED`."""
+        movers = self.players.movers(moved)
+        players = self.players.collisions(movers)
+        food = self.food.collisions(movers)
+        for nick in movers.nicks:
+            if nick not in self.players or self.players[nick].is_dead:
+                continue
+            moved = self.players[nick]
+            for other in players.get(nick, ()):
+                if other in self.players and not self.players[other].is_dead:
+                    self.eat_player(moved, self.players[other])
+            for food_id in food.get(nick, ()):
+                if food_id in self.food:
+                    self.eat_food(moved, self.food[food_id])
+
+    def run_ticks(self):
+        """Calls Server.tick() `TICK_RATE` times per second. Never returns.
+        If a tick takes longer than its period, the next one starts immediately, missed ticks are skipped."""
+        period = 1 / self.TICK_RATE
+        next_tick = monotonic()
+        while True:
+            self.tick()
+            self.push()
+            next_tick += period
+            delay = next_tick - monotonic()
+            if delay > 0:
+                sleep(delay)
+            else:
+                next_tick = monotonic()
+
+    def snapshot(self, since: int = None, session: Session = None, world: World = None) -> dict:
+        """Returns players and food data in the format of `GET` response. See docs/protocol.md
+
+        :param since: a version of the world the client has. If given, only the players and food units changed or
+            removed after it are returned (a delta snapshot), unless the changes are too old to be tracked.
+        :param session: the session of the client. If the client has sent `VIEW`, only what it can see is returned.
+        :param world: the version of the world to make the snapshot of, Server.world by default
+        """
+        world = world or self.world
+        if session is not None and session.view is not None and session.nick in world.players:
+            return self.view_snapshot(session, since, world)
+
+        changes = self.changes.since(since) if since is not None else None
+        if changes is None:
+            return {"version": world.version, "full": True, "players": self.effects_left(world.players, world.tick),
+                    "food": world.food,
+                    "removed_players": [], "removed_food": [], "round_end": world.round_end,
+                    "leader_board": None, "rank": None}
+
+        # The keys changed after the world was published are sent too, as they are in the world: the client will get
+        # them again with the next delta. Those added since are sent as removed, which a client ignores.
+        _, keys = changes
+        all_players, all_food = world.players, world.food
+        players, food, removed_players, removed_food = dict(), dict(), [], []
+        for kind, key in keys:
+            if kind == Players.KEY:
+                params = all_players.get(key)
+                if params is None:
+                    removed_players.append(key)
+                else:
+                    players[key] = params
+            elif kind == Food.KEY:
+                params = all_food.get(key)
+                if params is None:
+                    removed_food.append(key)
+                else:
+                    food[key] = params
+        # The ticks left of a speed effect change every tick, so the players with one are always sent.
+        for nick in world.effects:
+            if nick not in players and nick in all_players:
+                players[nick] = all_players[nick]
+        return {"version": world.version, "full": False, "players": self.effects_left(players, world.tick),
+                "food": food, "removed_players": removed_players, "removed_food": removed_food,
+                "round_end": world.round_end, "leader_board": None, "rank": None}
+
+    def view_snapshot(self, session: Session, since: int, world: World) -> dict:
+        """Returns only the players and food units of `world` on the screen of the client of `session`, and the
+        leader board. A delta contains the entities that have changed or come into the view, and `removed_*` lists
+        contain those that have been removed or gone out of the view. See Server.snapshot()."""
+        changes = self.changes.since(since) if since is not None else None
+        if changes is not None:
+            changed = set(changes[1])
+
+        all_players, all_food = world.players, world.food
+        x, y = all_players[session.nick][:2]
+        half_width, half_height = session.view[0] // 2 + self.VIEW_MARGIN, session.view[1] // 2 + self.VIEW_MARGIN
+        rect = (x - half_width, y - half_height, x + half_width, y + half_height)
+        # The spatial indexes are of the current state, which may be ahead of `world`.
+        visible_players = {nick for nick in self.players.in_rect(rect) if nick in all_players}
+        visible_players.add(session.nick)
+        visible_food = {food_id for food_id in self.food.in_rect(rect) if food_id in all_food}
+
+        if changes is None:
+            send_players, send_food = visible_players, visible_food
+            removed_players, removed_food = [], []
+        else:
+            send_players = [nick for nick in visible_players
+                            if nick not in session.known_players or (Players.KEY, nick) in changed
+                            or nick in world.effects]
+            send_food = [food_id for food_id in visible_food
+                         if food_id not in session.known_food or (Food.KEY, food_id) in changed]
+            removed_players = list(session.known_players - visible_players)
+            removed_food = list(session.known_food - visible_food)
+        session.known_players, session.known_food = visible_players, visible_food
+
+        players = self.effects_left({nick: all_players[nick] for nick in send_players}, world.tick)
+        food = {food_id: all_food[food_id] for food_id in send_food}
+
+        leader_board = [[nick, all_players[nick][2]] for nick in self.players.top_k(self.LEADER_BOARD_SIZE)
+                        if nick in all_players]
+        return {"version": world.version, "full": changes is None, "players": players, "food": food,
+                "removed_players": removed_players, "removed_food": removed_food, "round_end": world.round_end,
+                "leader_board": leader_board, "rank": self.players.rank(session.nick)}
+
+    def json_get_data(self, since: int = None, session: Session = None) -> str:
         """Returns a `JSON` string of players and food data. Used to implement `GET` command."""
-        return dumps({"players": self.players.get_players_raw(), "food": self.food.get_food_raw(),
-                      "round_end": self.round_end()}, default=self._json_date_handler)
+        return dumps(self.snapshot(since, session), default=self._json_date_handler)
+
+    def binary_get_data(self, session: Session, since: int = None) -> bytes:
+        """Returns a binary snapshot of players and food data for the client of `session`. Used to implement `GET`
+        command if the client has chosen the binary format."""
+        return encode_snapshot(self.snapshot(since, session), self.players.indices, session.table, self.pack_players,
+                               self.pack_food)
+
+    def get_data(self, session: Session, since: int = None) -> bytes:
+        """Returns a response to `GET` command in the format chosen by the client of `session`.
+        Remembers the version of the world sent to the client in `session`."""
+        world = self.world
+        if session.view is not None and session.nick in world.players:
+            # What a client sees depends on where its player is, so the snapshot can't be shared.
+            snapshot = self.snapshot(since, session, world)
+            session.version = snapshot["version"]
+            if session.format == Server.BINARY:
+                return encode_snapshot(snapshot, self.players.indices, session.table, self.pack_players,
+                                       self.pack_food)
+            return dumps(snapshot, default=self._json_date_handler).encode("UTF-8")
+
+        # The clients that have the same version of the world get the same snapshot, so it's encoded only once.
+        # The table entries of a binary snapshot depend on what the client has received, so only the records are
+        # shared. The ticks left of the speed effects change every tick, so the snapshots are cached per tick.
+        key = (session.format, since, world.round_end)
+        cached = self.snapshot_cache.get((world.version, world.tick), key)
+        if cached is None:
+            snapshot = self.snapshot(since, world=world)
+            if session.format == Server.BINARY:
+                cached = (snapshot, *encode_records(snapshot, self.players.indices, self.pack_players, self.pack_food))
+            else:
+                cached = (snapshot, dumps(snapshot, default=self._json_date_handler).encode("UTF-8"))
+            self.snapshot_cache.put((world.version, world.tick), key, cached)
+
+        snapshot = cached[0]
+        session.version = snapshot["version"]
+        if session.format == Server.BINARY:
+            _, players, counts, records = cached
+            return encode_header(snapshot, players, counts, session.table) + records
+        return cached[1]
+
+    def subscribe(self, session: Session) -> None:
+        """Starts pushing the state to the client of `session`. The first push is a full snapshot."""
+        session.subscribed = True
+        session.version = None
+        with self.subscribers_mutex:
+            self.subscribers.add(session)
+
+    def unsubscribe(self, session: Session) -> None:
+        session.subscribed = False
+        with self.subscribers_mutex:
+            self.subscribers.discard(session)
+
+    def push(self):
+        """Makes the writer of each subscribed client send it the changes since the previous push. Is called after
+        each tick. If the previous push hasn't been sent yet, the client will get both at once. A client that lags
+        behind for more than MAX_PUSH_LAG seconds is disconnected."""
+        start = perf_counter()
+        with self.subscribers_mutex:
+            subscribers = list(self.subscribers)
+        for session in subscribers:
+            # Nothing has changed.
+            if session.version == self.world.version:
+                continue
+            if session.push_pending:
+                session.behind += 1
+                self.metrics.count('pushes_superseded')
+                if session.behind > self.MAX_PUSH_LAG * self.TICK_RATE:
+                    self.metrics.count('disconnects.push_lag')
+                    self.drop(session)
+                continue
+            session.push_pending = True
+            session.wake()
+        self.metrics.observe_time('push_us', start)
+
+    def enqueue(self, session: Session, response: bytes) -> None:
+        """Queues `response` for the writer of the connection of `session`. If SEND_QUEUE_SIZE responses are queued
+        already, drops the connection and raises ConnectionResetError."""
+        if len(session.outbox) >= self.SEND_QUEUE_SIZE:
+            self.metrics.count('disconnects.send_queue')
+            self.drop(session)
+            raise ConnectionResetError("The client doesn't read the responses.")
+        session.outbox.append(response)
+        self.metrics.observe('send_queue', len(session.outbox))
+        session.wake()
+
+    def next_message(self, session: Session) -> bytes:
+        """Returns the next message the writer of the connection of `session` has to send, or `None` if there's
+        nothing to send: the oldest queued response or, once they are sent, the pending push. The push is encoded
+        now, relative to the version of the world the client has."""
+        # A response made while the push is encoded would be queued, and sent, after it. See Server.serve_request().
+        with session.mutex:
+            if session.outbox:
+                payload = session.outbox.popleft()
+            elif session.push_pending and not session.closed:
+                session.push_pending = False
+                session.behind = 0
+                payload = self.get_data(session, session.version)
+                self.metrics.observe('push_bytes', len(payload))
+            else:
+                return None
+        compressor = session.compressor
+        if compressor is None:
+            return payload
+        start = perf_counter()
+        compressed = compressor.compress(payload)
+        if compressed is not payload:
+            self.metrics.observe_time('compress_us', start)
+            self.metrics.count('compression.bytes_in', len(payload))
+            self.metrics.count('compression.bytes_out', len(compressed))
+        return compressed
+
+    def drop(self, session: Session) -> None:
+        """Closes the connection of `session` without sending what's queued."""
+        session.closed = True
+        session.outbox.clear()
+        self.unsubscribe(session)
+        session.close()
+
+    def open_session(self, wake, close) -> Session:
+        """Returns a session of a new client. See Session.wake & Session.close."""
+        session = Session(wake, close)
+        with self.sessions_mutex:
+            self.sessions.add(session)
+        self.metrics.count('connections')
+        return session
+
+    def close_session(self, session: Session) -> None:
+        """Is called once the client of `session` has disconnected. The writer sends what's queued and stops."""
+        session.closed = True
+        self.unsubscribe(session)
+        with self.sessions_mutex:
+            self.sessions.discard(session)
+        session.wake()
+
+    def closed_by_error(self, session: Session) -> None:
+        """Is called if the connection of `session` has failed while reading from it: the client has reset it, or the
+        server has dropped it, e.g. in Server.enqueue(), which counts the reason itself."""
+        if not session.closed:
+            self.metrics.count('disconnects.reset')
+
+    def sent(self, session: Session, payload: bytes) -> None:
+        """Is called once `payload` has been sent to the client of `session`."""
+        session.bytes_sent += len(payload)
+        self.metrics.count('bytes_sent', len(payload))
+
+    def stats(self) -> dict:
+        """Returns the response to `STATS` command: the metrics, the size of the world & what each client has been
+        sent. See docs/protocol.md"""
+        with self.sessions_mutex:
+            sessions = list(self.sessions)
+        world = self.world
+        stats = self.metrics.snapshot()
+        stats.update({
+            "players": len(world.players), "food": len(world.food), "version": world.version,
+            "subscribers": len(self.subscribers),
+            "snapshot_cache": {"hits": self.snapshot_cache.hits, "misses": self.snapshot_cache.misses},
+            "clients": [{"nick": s.nick, "format": s.format, "subscribed": s.subscribed, "bytes_sent": s.bytes_sent,
+                         "compressed": s.compressor is not None, "queued": len(s.outbox), "behind": s.behind}
+                        for s in sessions],
+        })
+        return stats
+
+    def log_stats(self) -> None:
+        """Appends the response to `STATS` to Server.STATS_LOG every `STATS_INTERVAL` seconds, a JSON per line."""
+        while True:
+            sleep(self.STATS_INTERVAL)
+            with open(self.STATS_LOG, 'a') as f:
+                f.write(dumps(self.stats()) + "\n")
+
+    def start_stats_log(self) -> None:
+        if self.STATS_LOG is not None:
+            Thread(target=self.log_stats, daemon=True).start()
+
+    def profiled(self, func, *args):
+        """Returns func(*args), profiled if a `pstats` capture is running. See Server.profile()."""
+        if self.profiler is None:
+            return func(*args)
+        return self.profiler.call(func, *args)
+
+    def profile(self, seconds: float, mode: str) -> str:
+        """Starts capturing a profile of the server for `seconds` in `mode`, one of Profiler.MODES. Returns the path
+        of the file the profile will be written to, tagged with the numbers of players & food units. Raises
+        InvalidData if profiling is disabled, a capture is running already or the arguments are invalid."""
+        if self.profiler is None:
+            raise InvalidData("Profiling is disabled.")
+        tags = {"players": len(self.players.get_players_raw()), "food": len(self.food.get_food_raw())}
+        try:
+            return self.profiler.start(seconds, mode, tags)
+        except ValueError as e:
+            raise InvalidData(str(e))
+
+    def install_profile_signal(self) -> None:
+        """Makes SIGUSR1 start a `sample` capture of PROFILE_SECONDS, so that a server can be profiled without a
+        client. Must be called from the main thread."""
+        if self.profiler is None or not hasattr(signal, 'SIGUSR1'):
+            return
+
+        def handler(signum, frame):
+            try:
+                self.profile(self.PROFILE_SECONDS, 'sample')
+            except InvalidData:
+                # A capture is running already.
+                pass
+        signal.signal(signal.SIGUSR1, handler)
 
     def process_moved(self, moved: Player):
         """Searches through and finds if `moved` ate another player, a food unit or was eaten by someone else. If so,
@@ -97,90 +669,244 @@ class Server:
 
         :param moved: A player whose coordinates were changed.
         """
-        for player in self.players.get_players():
-            result = player_was_eaten(moved, player)
-            if result is not None:
-                eater, victim = result
-                self.players.grow(eater, victim.size)
-                self.players.kill(victim)
-
-        for food in self.food.get_food():
-            if food_was_eaten(moved, food):
-                self.food.pop(food)
-                if food.kind == FoodKind.ORDINARY:
-                    self.players.grow(moved, food.size)
-                elif food.kind == FoodKind.SPEEDING_UP:
-                    self.players.mul_speed_factor(moved, 1.15)
-                    self.players.set_speed_effect_end_time(moved, timedelta(seconds=food.size))
-                elif food.kind == FoodKind.SLOWING_DOWN:
-                    self.players.mul_speed_factor(moved, 0.95)
-                    self.players.set_speed_effect_end_time(moved, timedelta(seconds=food.size))
-                elif food.kind == FoodKind.FREEZING:
-                    self.players.mul_speed_factor(moved, 0)
-                    self.players.set_speed_effect_end_time(moved, timedelta(seconds=food.size))
-
-                self.food.spawn(self.rand_coords())
+        for player in self.players.nearby(moved):
+            self.eat_player(moved, player)
+
+        for food in self.food.nearby(moved.xy, moved.size):
+            self.eat_food(moved, food)
+
+    def eat_player(self, moved: Player, player: Player):
+        """If either of the players ate the other one, grows the eater and kills the victim."""
+        result = player_was_eaten(moved, player)
+        if result is not None:
+            eater, victim = result
+            self.players.grow(eater, victim.size)
+            self.players.kill(victim)
+
+    def eat_food(self, moved: Player, food: FoodUnit):
+        """If `moved` ate `food`, deletes it, spawns a new one and applies the effect of `food` to `moved`."""
+        # Someone else may have eaten the food unit since we've found it.
+        if food_was_eaten(moved, food) and self.food.pop(food):
+            if food.kind == FoodKind.ORDINARY:
+                self.players.grow(moved, food.size)
+            elif food.kind == FoodKind.SPEEDING_UP:
+                self.add_speed_effect(moved, 1.15, food.size)
+            elif food.kind == FoodKind.SLOWING_DOWN:
+                self.add_speed_effect(moved, 0.95, food.size)
+            elif food.kind == FoodKind.FREEZING:
+                self.add_speed_effect(moved, 0, food.size)
+
+            self.food.spawn(self.rand_coords())
+
+    def add_speed_effect(self, player: Player, m: float, seconds: int) -> None:
+        """Multiplies the speed factor of `player` by `m` for `seconds`. The factor is reset by Server.tick()."""
+        end = self.effects.tick + seconds * self.TICK_RATE
+        if self.players.add_speed_effect(player, m, end):
+            self.effects.schedule(player.nick, end)
+
+    @staticmethod
+    def parse_request(frame) -> object:
+        """Decodes a single request received from a client."""
+        return loads(str(frame, "UTF-8"))
+
+    def serve_request(self, session: Session, frame) -> None:
+        """Handles a request received from the client of `session` and queues the response for the writer.
+
+        Both a response and a push change what the client is assumed to have, e.g. the table entries of binary
+        snapshots, so they must be sent in the order they are made in. The response is made & queued under the mutex
+        of the session, and a push is made under it only once the queue is empty (see Server.next_message())."""
+        request = self.parse_request(frame)
+        with session.mutex:
+            response = self.handle_request(request, session)
+            if response is not None:
+                self.enqueue(session, response)
+
+    def handle_request(self, item, session: Session) -> bytes:
+        """Executes a single client request. Returns a response to send back or `None` if there's nothing to send.
+        Is shared by all the server modes, so it mustn't do any I/O itself. Counts the commands & errors in
+        Server.metrics, and records the latency of the command & the size of the response for TIMING_SAMPLE of them:
+        a cached `GET` takes a few microseconds, so recording every one would take longer than handling it."""
+        if not self.metrics.enabled:
+            return self.profiled(self._handle_request, item, session)
+        start = perf_counter() if random() < self.TIMING_SAMPLE else None
+        try:
+            response = self.profiled(self._handle_request, item, session)
+        except Exception as e:
+            self.metrics.count('errors.' + type(e).__name__)
+            raise
+        # Clients can send anything, so unknown commands share a name to keep the number of metrics bounded.
+        name = item if isinstance(item, str) else next(iter(item), None) if isinstance(item, dict) else None
+        name = name if name in Server.COMMANDS else 'unknown'
+        self.metrics.count('commands.' + name)
+        if start is not None:
+            self.metrics.observe_time('command_us.' + name, start)
+            if response is not None:
+                self.metrics.observe('response_bytes.' + name, len(response))
+        return response
+
+    def _handle_request(self, item, session: Session) -> bytes:
+        response = None
+        if isinstance(item, str):
+            # GET
+            if item == Server.GET:
+                response = self.get_data(session)
+            # GET_MAP_BOUNDS
+            if item == Server.GET_MAP_BOUNDS:
+                response = self.JSON_MAP_BOUNDS
+            # SUBSCRIBE
+            if item == Server.SUBSCRIBE:
+                self.subscribe(session)
+            # STATS
+            if item == Server.STATS:
+                response = dumps(self.stats()).encode("UTF-8")
+        elif isinstance(item, dict):
+            for command, args in item.items():
+                # GET with the version the client has
+                if command == Server.GET:
+                    if args is not None and not isinstance(args, int):
+                        raise InvalidData("Version '{}' isn't an integer.".format(args))
+                    response = self.get_data(session, args)
+                # SPAWN
+                elif command == Server.SPAWN:
+                    nick = args
+                    assert_nick(nick)
+                    assert nick not in self.players
+                    self.players.spawn(nick, self.rand_coords(self.INIT_PLAYER_SIZE), random_color())
+                    session.nick = nick
+                    self.publish()
+                # MOVE
+                elif command == Server.MOVE:
+                    nick = args[0]
+                    direction = Direction(args[1])
+                    seq = args[2] if len(args) > 2 else None
+                    if seq is not None and not (isinstance(seq, int) and 0 <= seq < 2 ** 32):
+                        raise InvalidData("Move number '{}' isn't a 32-bit unsigned integer.".format(seq))
+
+                    if nick not in self.players:
+                        raise InvalidData("There's no player with nick '{}'.".format(args[0]))
+
+                    # The move is applied at the next tick.
+                    with self.moves_mutex:
+                        self.moves[nick] = direction
+                        if seq is not None:
+                            self.move_seqs[nick] = seq
+                        else:
+                            self.move_seqs.pop(nick, None)
+
+                # FORMAT
+                elif command == Server.FORMAT:
+                    if args not in (Server.JSON, Server.BINARY):
+                        raise InvalidData("Unknown format '{}'.".format(args))
+                    session.format = args
+                    session.table.clear()
+
+                # COMPRESS
+                elif command == Server.COMPRESS:
+                    if args != Server.ZLIB:
+                        raise InvalidData("Unknown compression '{}'.".format(args))
+                    # The client decompresses all the messages as one stream, so it's never restarted.
+                    if session.compressor is None:
+                        session.compressor = Compressor(self.COMPRESS_THRESHOLD)
+
+                # VIEW
+                elif command == Server.VIEW:
+                    if not (isinstance(args, list) and len(args) == 2 and all(isinstance(i, int) and i > 0
+                                                                              for i in args)):
+                        raise InvalidData("Screen size '{}' isn't a pair of positive integers.".format(args))
+                    session.view = tuple(args)
+
+                # PROFILE
+                elif command == Server.PROFILE:
+                    if not (isinstance(args, list) and len(args) == 2):
+                        raise InvalidData("'{}' isn't a pair of seconds and a mode.".format(args))
+                    response = dumps({"file": self.profile(*args)}).encode("UTF-8")
+
+                # DISCONNECT
+                elif command == Server.DISCONNECT:
+                    nick = args
+                    try:
+                        self.players.pop(nick)
+                    except KeyError:
+                        raise InvalidData("There's no player with nick '{}'.".format(args))
+                    self.publish()
+        return response
 
     def listen_to_client(self, conn: socket.socket):
         """Handle client commands. Server.listen() calls it for each connected client in a separate thread."""
-        with conn:
+        decoder = FrameDecoder()
+        wakeup = Condition()
+
+        def wake():
+            with wakeup:
+                wakeup.notify()
+
+        def close():
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+        session = self.open_session(wake, close)
+        writer = Thread(target=self.write_to_client, args=(conn, session, wakeup), daemon=True)
+        writer.start()
+        try:
+            with conn:
+                while True:
+                    # Receive client data.
+                    try:
+                        frames = recv_frames(conn, decoder)
+                    except socket.timeout:
+                        # A subscribed client doesn't have to send anything.
+                        if session.subscribed:
+                            continue
+                        raise
+                    if frames is None:
+                        break
+
+                    for frame in frames:
+                        self.serve_request(session, frame)
+                # Let the writer send what's queued before the connection is closed.
+                self.close_session(session)
+                writer.join()
+        except socket.timeout:
+            self.metrics.count('disconnects.timeout')
+        except OSError:
+            self.closed_by_error(session)
+        finally:
+            self.close_session(session)
+
+    def write_to_client(self, conn: socket.socket, session: Session, wakeup: Condition):
+        """The writer of a connection: sends the messages of `session` until it's closed. Is run in a separate thread
+        for each connected client, so only it waits if the client is slow. See Server.next_message()."""
+        try:
             while True:
-                # Receive client data.
-                raw_data = conn.recv(4096)
-                if not raw_data:
-                    break
-
-                sequence_raw = raw_data.decode("UTF-8").split(Server.DELIMITER)[:-1]
-                sequence = [loads(item) for item in sequence_raw]
-
-                for item in sequence:
-                    # Handle requests here.
-                    if isinstance(item, str):
-                        # GET
-                        if item == Server.GET:
-                            conn.sendall(self.json_get_data().encode("UTF-8"))
-                        # GET_MAP_BOUNDS
-                        if item == Server.GET_MAP_BOUNDS:
-                            conn.sendall(self.JSON_MAP_BOUNDS)
-                    elif isinstance(item, dict):
-                        for command, args in item.items():
-                            # SPAWN
-                            if command == Server.SPAWN:
-                                nick = args
-                                assert_nick(nick)
-                                assert nick not in self.players
-                                self.players.spawn(nick, self.rand_coords(), random_color())
-                            # MOVE
-                            elif command == Server.MOVE:
-                                nick = args[0]
-                                direction = Direction(args[1])
-
-                                if nick not in self.players:
-                                    raise InvalidData("There's no player with nick '{}'.".format(args[0]))
-
-                                player = self.players[nick]
-
-                                if not player.is_dead and self.is_player_on_map_after_move(player, direction):
-                                    self.players.move(player, direction)
-                                    self.process_moved(player)
-
-                            # DISCONNECT
-                            elif command == Server.DISCONNECT:
-                                nick = args
-                                try:
-                                    self.players.pop(nick)
-                                except KeyError:
-                                    raise InvalidData("There's no player with nick '{}'.".format(args))
+                with wakeup:
+                    wakeup.wait_for(lambda: session.outbox or session.push_pending or session.closed)
+                payload = self.next_message(session)
+                if payload is None:
+                    if session.closed:
+                        break
+                    continue
+                send_frame(conn, payload)
+                self.sent(session, payload)
+        except OSError:
+            # Stop reading from the client as well.
+            session.close()
 
     def listen(self):
         """Accepts connections. After a client has connected, talks to it in a separate thread
-            at Server.listen_to_client()."""
+            at Server.listen_to_client(). The world is updated in another thread at Server.run_ticks()."""
+        tick_thread = Thread(target=self.run_ticks, daemon=True)
+        tick_thread.start()
+        self.start_stats_log()
+        self.install_profile_signal()
 
         # Open a TCP IPv4 socket at HOST=Server.HOST and port=Server.port
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
             sock.bind((self.HOST, self.PORT))
-            # Allow up to 64 connection to queue up.
-            sock.listen(64)
+            # Allow up to 1024 connections to queue up, like AsyncServer does: bots connecting at once overflow a
+            # shorter queue, and the connections the kernel drops are reset.
+            sock.listen(1024)
 
             while True:
                 # Accept a connection
@@ -188,6 +914,8 @@ class Server:
 
                 # Raise an exception if the client has sent no data in a minute.
                 conn.settimeout(60)
+                # Send small frames at once, like asyncio does for the connections of AsyncServer.
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
                 # Start a new thread per client.
                 thread = Thread(target=self.listen_to_client, args=(conn, ))
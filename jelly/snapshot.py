@@ -0,0 +1,175 @@
+"""Binary encoding of `GET` responses. See "Binary snapshots" in docs/protocol.md
+
+A snapshot consists of a header, new entries of the nick/color table and fixed-width records of players and food.
+A client receives the nick and the color of a player once; later snapshots refer to the player by its index."""
+from datetime import datetime
+from struct import Struct
+
+# The first byte of a binary snapshot. A JSON text never starts with it, so a client can tell the formats apart.
+MAGIC = 0
+
+# magic, round end (POSIX timestamp), version, is full (0 or 1), number of table entries, number of players,
+# number of food units, number of removed players, number of removed food units, number of leader board entries,
+# rank of the client's player (-1 if there's no leader board).
+HEADER = Struct('!BdQBIIIIIIi')
+# index, red, green, blue, length of the UTF-8 encoded nick. Followed by the nick.
+TABLE_ENTRY = Struct('!IBBBH')
+# index, x, y, size, speed factor, ticks left of the speed effect, number of the last move.
+PLAYER = Struct('!IiiIfII')
+# id, x, y, size, kind. IDs are never reused, so a long-running server would run out of 32 bits.
+FOOD = Struct('!QiiHB')
+# Length of the UTF-8 encoded nick of a removed player. Followed by the nick.
+NICK_LENGTH = Struct('!H')
+# id of a removed food unit.
+FOOD_ID = Struct('!Q')
+# Size of a player in the leader board. Follows the nick encoded as the nick of a removed player.
+SIZE = Struct('!I')
+
+
+def _encode_nick(nick: str) -> bytes:
+    encoded_nick = nick.encode("UTF-8")
+    return NICK_LENGTH.pack(len(encoded_nick)) + encoded_nick
+
+
+def pack_players(players: dict, indices: dict) -> (list, bytes):
+    """Returns (index, nick, color) of the players that have an index and PLAYER records of them.
+
+    :param players: nick -> params in the format of Players.data
+    """
+    players = [(nick, params, indices[nick]) for nick, params in list(players.items()) if nick in indices]
+    pack = PLAYER.pack
+    records = b''.join([pack(index, x, y, size, factor, effect_ticks, seq)
+                        for _, (x, y, size, factor, effect_ticks, _, seq), index in players])
+    return [(index, nick, params[5]) for nick, params, index in players], records
+
+
+def pack_food(food: dict) -> (int, bytes):
+    """Returns the number of FOOD records and the records of `food` in the format of Food.data."""
+    food = list(food.items())
+    pack = FOOD.pack
+    return len(food), b''.join([pack(food_id, *params) for food_id, params in food])
+
+
+def encode_snapshot(snapshot: dict, indices: dict, table: dict, pack_players=pack_players,
+                    pack_food=pack_food) -> bytes:
+    """Encodes a snapshot for a single client.
+
+    :param snapshot: see Server.snapshot()
+    :param indices: nick -> index, see Players.indices
+    :param table: index -> color of the table entries the client has already received. Is updated in place.
+    :param pack_players: see encode_records()
+    :param pack_food: see encode_records()
+    """
+    players, counts, records = encode_records(snapshot, indices, pack_players, pack_food)
+    return encode_header(snapshot, players, counts, table) + records
+
+
+def encode_records(snapshot: dict, indices: dict, pack_players=pack_players,
+                   pack_food=pack_food) -> (list, tuple, bytes):
+    """Encodes the part of a snapshot that doesn't depend on the client, so that it can be shared by all the clients
+    that receive the same snapshot. The header & the table entries are encoded by encode_header().
+
+    :param pack_players: encodes the players, see pack_players()
+    :param pack_food: encodes the food units, see pack_food()
+    :returns: (index, nick, color) of the encoded players, the numbers of the records in the order of HEADER and the
+        records themselves.
+    """
+    players, player_records = pack_players(snapshot["players"], indices)
+    food_num, food_records = pack_food(snapshot["food"])
+    removed_players, removed_food = snapshot["removed_players"], snapshot["removed_food"]
+    leader_board = snapshot["leader_board"] or []
+    rank = snapshot["rank"] if snapshot["rank"] is not None else -1
+
+    pack_food_id = FOOD_ID.pack
+    records = b''.join((
+        player_records,
+        food_records,
+        *[_encode_nick(nick) for nick in removed_players],
+        *[pack_food_id(food_id) for food_id in removed_food],
+        *[_encode_nick(nick) + SIZE.pack(size) for nick, size in leader_board],
+    ))
+    counts = (len(players), food_num, len(removed_players), len(removed_food), len(leader_board), rank)
+    return players, counts, records
+
+
+def encode_header(snapshot: dict, players: list, counts: tuple, table: dict) -> bytes:
+    """Encodes the header & the table entries the client hasn't received yet. See encode_records().
+
+    :param table: index -> color of the table entries the client has already received. Is updated in place.
+    """
+    entries = []
+    for index, nick, color in players:
+        if table.get(index) != color:
+            table[index] = color
+            encoded_nick = nick.encode("UTF-8")
+            entries.append(TABLE_ENTRY.pack(index, *color, len(encoded_nick)) + encoded_nick)
+
+    return b''.join((
+        HEADER.pack(MAGIC, snapshot["round_end"].timestamp(), snapshot["version"], snapshot["full"], len(entries),
+                    *counts),
+        *entries,
+    ))
+
+
+def is_snapshot(frame) -> bool:
+    """Returns True if `frame` is a binary snapshot rather than a JSON text."""
+    return len(frame) > 0 and frame[0] == MAGIC
+
+
+def decode_snapshot(frame, table: dict) -> dict:
+    """Decodes a snapshot encoded by encode_snapshot().
+
+    :param frame: a bytes-like object
+    :param table: index -> (nick, color) of the entries received so far. Is updated in place.
+    :returns: the snapshot in the same format as Server.snapshot(). Players & food are in the formats of Players.data &
+        Food.data.
+    """
+    frame = memoryview(frame)
+    (_, round_end, version, full, entries_num, players_num, food_num,
+     removed_players_num, removed_food_num, leader_board_num, rank) = HEADER.unpack_from(frame)
+    offset = HEADER.size
+
+    for _ in range(entries_num):
+        index, r, g, b, length = TABLE_ENTRY.unpack_from(frame, offset)
+        offset += TABLE_ENTRY.size
+        table[index] = (str(frame[offset:offset + length], "UTF-8"), [r, g, b])
+        offset += length
+
+    players = dict()
+    end = offset + players_num * PLAYER.size
+    for index, x, y, size, factor, effect_ticks, seq in PLAYER.iter_unpack(frame[offset:end]):
+        nick, color = table[index]
+        players[nick] = [x, y, size, factor, effect_ticks, color, seq]
+    offset = end
+
+    end = offset + food_num * FOOD.size
+    food = {food_id: [x, y, size, kind] for food_id, x, y, size, kind in FOOD.iter_unpack(frame[offset:end])}
+    offset = end
+
+    removed_players = []
+    for _ in range(removed_players_num):
+        nick, offset = _decode_nick(frame, offset)
+        removed_players.append(nick)
+
+    end = offset + removed_food_num * FOOD_ID.size
+    removed_food = [food_id for (food_id,) in FOOD_ID.iter_unpack(frame[offset:end])]
+    offset = end
+
+    leader_board = []
+    for _ in range(leader_board_num):
+        nick, offset = _decode_nick(frame, offset)
+        (size,) = SIZE.unpack_from(frame, offset)
+        offset += SIZE.size
+        leader_board.append([nick, size])
+
+    return {"version": version, "full": bool(full), "players": players, "food": food,
+            "removed_players": removed_players, "removed_food": removed_food,
+            "round_end": datetime.fromtimestamp(round_end),
+            "leader_board": leader_board if rank >= 0 else None, "rank": rank if rank >= 0 else None}
+
+
+def _decode_nick(frame: memoryview, offset: int) -> (str, int):
+    """Decodes a nick encoded by _encode_nick() at `offset`. Returns the nick and the offset of the next byte."""
+    (length,) = NICK_LENGTH.unpack_from(frame, offset)
+    offset += NICK_LENGTH.size
+    return str(frame[offset:offset + length], "UTF-8"), offset + length
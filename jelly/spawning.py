@@ -0,0 +1,83 @@
+"""Random points to spawn players & food units at, away from the players. See Server.rand_coords()"""
+from random import choices, randrange
+
+from jelly.player import Players
+
+
+class Spawner:
+    """Draws points of the map within `border` off its edges that are farther than `vicinity` from the circle of
+    each alive player, so that a spawned player or food unit isn't eaten at once.
+
+    A single point is checked against the players found by their spatial index. Many points are drawn at once
+    instead: the circles of the players are put into the cells of a grid once, so most of the points are checked
+    with a single dict lookup."""
+
+    # A point is drawn at most that many times. If all of them are taken, the last one is used: the map is crowded.
+    ATTEMPTS = 10
+
+    def __init__(self, width: int, height: int, border: int, players: Players, cell_size: int):
+        self.x_range = range(border, width - border)
+        self.y_range = range(border, height - border)
+        self.players = players
+        self.cell_size = cell_size
+
+    def point(self, vicinity: int = 0) -> (int, int):
+        """Returns a random point farther than `vicinity` from the circle of each alive player."""
+        for _ in range(self.ATTEMPTS):
+            xy = randrange(self.x_range.start, self.x_range.stop), randrange(self.y_range.start, self.y_range.stop)
+            if self.players.is_free(xy, vicinity):
+                break
+        return xy
+
+    def points(self, n: int, vicinity: int = 0) -> list[(int, int)]:
+        """Returns `n` points drawn like Spawner.point() does."""
+        cell_size = self.cell_size
+        blocked = self.blocked(vicinity)
+        result = []
+        for attempt in range(self.ATTEMPTS):
+            missing = n - len(result)
+            if not missing:
+                break
+            candidates = zip(choices(self.x_range, k=missing), choices(self.y_range, k=missing))
+            if attempt == self.ATTEMPTS - 1:
+                result.extend(candidates)
+                break
+            for x, y in candidates:
+                circles = blocked.get((x // cell_size, y // cell_size))
+                if circles is None or all((x - cx) ** 2 + (y - cy) ** 2 > r2 for cx, cy, r2 in circles):
+                    result.append((x, y))
+        return result
+
+    def spread_points(self, n: int, size: int) -> list[(int, int)]:
+        """Returns `n` points to respawn all the players at with `size` at once, e.g. for a new round: the players are
+        placed from scratch, so each point is checked against the circles of the points drawn before it rather than
+        against the current ones."""
+        cell_size = self.cell_size
+        x_range, y_range = self.x_range, self.y_range
+        blocked = dict()
+        result = []
+        for _ in range(n):
+            for _ in range(self.ATTEMPTS):
+                x, y = randrange(x_range.start, x_range.stop), randrange(y_range.start, y_range.stop)
+                circles = blocked.get((x // cell_size, y // cell_size))
+                if circles is None or all((x - cx) ** 2 + (y - cy) ** 2 > r2 for cx, cy, r2 in circles):
+                    break
+            result.append((x, y))
+            self.block(blocked, x, y, size + size)
+        return result
+
+    def blocked(self, vicinity: int) -> dict:
+        """Returns the cells overlapped by the circles of the alive players grown by `vicinity`:
+        (i, j) -> [(x, y, squared radius), ...]."""
+        blocked = dict()
+        for x, y, size in self.players.circles():
+            self.block(blocked, x, y, size + vicinity)
+        return blocked
+
+    def block(self, blocked: dict, x: int, y: int, radius: int) -> None:
+        """Adds the circle of `radius` around (x, y) to the cells of `blocked` it overlaps."""
+        cell_size = self.cell_size
+        circle = (x, y, radius * radius)
+        for i in range((x - radius) // cell_size, (x + radius) // cell_size + 1):
+            for j in range((y - radius) // cell_size, (y + radius) // cell_size + 1):
+                blocked.setdefault((i, j), []).append(circle)
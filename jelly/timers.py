@@ -0,0 +1,41 @@
+"""Timers counted in ticks of the server, e.g. when the speed effects of players end. See Server.tick()"""
+
+
+class TimerWheel:
+    """Keys due at given ticks. Scheduling & cancelling a timer take O(1), and advancing to the next tick takes
+    O(number of keys due at it).
+
+    The timers are kept in a ring of `size` slots, a slot per tick. A timer due in `size` ticks or later shares its
+    slot with the nearer ones and is skipped until its turn comes, so `size` should exceed the usual delays."""
+    def __init__(self, size: int = 256):
+        self.slots = [set() for _ in range(size)]
+        # key -> the tick it's due at
+        self.due = dict()
+        # Number of the current tick.
+        self.tick = 0
+
+    def schedule(self, key, tick: int) -> None:
+        """Makes `key` due at `tick`, replacing its timer if there's one. A tick that has passed means the next one."""
+        self.cancel(key)
+        tick = max(tick, self.tick + 1)
+        self.due[key] = tick
+        self.slots[tick % len(self.slots)].add(key)
+
+    def cancel(self, key) -> None:
+        """Removes the timer of `key`. Does nothing if there's none."""
+        tick = self.due.pop(key, None)
+        if tick is not None:
+            self.slots[tick % len(self.slots)].discard(key)
+
+    def advance(self) -> list:
+        """Moves on to the next tick. Returns the keys due at it, which timers are removed."""
+        self.tick += 1
+        slot = self.slots[self.tick % len(self.slots)]
+        expired = [key for key in slot if self.due[key] == self.tick]
+        for key in expired:
+            slot.discard(key)
+            del self.due[key]
+        return expired
+
+    def __len__(self) -> int:
+        return len(self.due)
@@ -2,8 +2,6 @@ from enum import IntFlag
 from math import sqrt
 from random import randrange, random
 from colorsys import hls_to_rgb
-from pygame import Surface, Color, font, gfxdraw
-from threading import Thread
 
 
 class Direction(IntFlag):
@@ -35,20 +33,7 @@ def distance(a: (int, int), b: (int, int)) -> float:
 def random_color() -> (int, int, int):
     """Returns a random color in RGB format"""
     h, s, l = random(), 0.5 + random() / 2.0, 0.4 + random() / 5.0
-    return [int(256 * i) for i in hls_to_rgb(h, l, s)]
-
-
-# https://stackoverflow.com/a/62480486
-def draw_circle(window: Surface, xy: (int, int), radius: int, color: Color):
-    """Draws a circle at `xy` point with radius `radius` and color `color` on `window` using antialiasing."""
-    gfxdraw.aacircle(window, xy[0], xy[1], radius, color)
-    gfxdraw.filled_circle(window, xy[0], xy[1], radius, color)
-
-
-def draw_text(surface: Surface, f: font.Font, text: str, color=(0, 0, 0), **kwargs):
-    image = f.render(text, True, color)
-    rect = image.get_rect(**kwargs)
-    surface.blit(image, rect)
+    return [int(255 * i) for i in hls_to_rgb(h, l, s)]
 
 
 def is_circle_on_screen(xy: (int, int), r: int, width_height: (int, int)):
@@ -81,22 +66,3 @@ def world2screen(xy: (int, int), offset_xy: (int, int)):
     """
     return xy[0] - offset_xy[0], xy[1] - offset_xy[1]
 
-
-# https://stackoverflow.com/a/31614591
-class PropagatingThread(Thread):
-    def run(self):
-        self.exc = None
-        try:
-            if hasattr(self, '_Thread__target'):
-                # Thread uses name mangling prior to Python 3.
-                self.ret = self._Thread__target(*self._Thread__args, **self._Thread__kwargs)
-            else:
-                self.ret = self._target(*self._args, **self._kwargs)
-        except BaseException as e:
-            self.exc = e
-
-    def join(self):
-        super(PropagatingThread, self).join()
-        if self.exc:
-            raise self.exc
-        return self.ret
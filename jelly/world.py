@@ -0,0 +1,32 @@
+"""Frozen versions of the world, which the server encodes snapshots from.
+
+The threads that change the world (the tick thread and the handlers of `SPAWN` & `DISCONNECT`) publish a new World
+once they are done (see Server.publish()), and the threads that read it (`GET`, pushes to the subscribers, `STATS`)
+take a reference to the latest one and read it without any lock, while the next one is being made.
+
+A World shares the params of the entities with Players & Food, which never change the params in place: a changed
+entity gets a new list (copy-on-write). So publishing a World only copies the dicts, and only those that have
+changed since the previous one."""
+from datetime import datetime
+
+
+class World:
+    """A version of the world that is never changed.
+
+    :param version: the version of the world, see ChangeLog
+    :param players: nick -> params, see Players.data
+    :param food: ID -> params, see Food.data
+    :param round_end: when the round of this version is over
+    :param tick: number of the tick it was published at, which the ticks left of the speed effects are counted from
+    :param effects: nicks of the players with a speed effect, see Players.effects
+    """
+    __slots__ = ('version', 'players', 'food', 'round_end', 'tick', 'effects')
+
+    def __init__(self, version: int, players: dict, food: dict, round_end: datetime, tick: int,
+                 effects: frozenset = frozenset()):
+        self.version = version
+        self.players = players
+        self.food = food
+        self.round_end = round_end
+        self.tick = tick
+        self.effects = effects
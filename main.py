@@ -1,5 +1,6 @@
 from jelly.server import Server
-from jelly.client import Client
+from jelly.async_server import AsyncServer
+from jelly.bots import Bot, run_swarm
 from jelly.food import FoodKind
 import config as default
 import argparse
@@ -11,10 +12,11 @@ def main():
     config.read('jelly.cfg')
 
     parser = argparse.ArgumentParser(add_help=False)
-    parser.add_argument('mode', type=str, choices=['server', 'client'],
-                        help="Specify if you'd like to run a server or connect to one.")
+    parser.add_argument('mode', type=str, choices=['server', 'client', 'bots'],
+                        help="Specify if you'd like to run a server, connect to one or load-test one with bots.")
 
-    parser.add_argument('-n', '--nick', type=str, help='Your nick name. Required if mode is `client`.')
+    parser.add_argument('-n', '--nick', type=str,
+                        help='Your nick name. Required if mode is `client`. The prefix of the nicks of the bots.')
     parser.add_argument('-p', '--port', type=int, help='Port of the server.', default=default.PORT)
     parser.add_argument('--host', type=str, help='Host of the server.', default=default.HOST)
     parser.add_argument('-w', '--width', type=int,
@@ -32,6 +34,27 @@ def main():
     parser.add_argument('-fp', '--food-probability', type=int, nargs=len(FoodKind),
                         help='See the comment for `FOOD_PROBABILITY` in config.py')
     parser.add_argument('-ip', '--init-player-size', type=int, help='New players will be spawned with this size.')
+    parser.add_argument('-tr', '--tick-rate', type=int, metavar='TR',
+                        help='The server updates the world `TR` times per second.')
+    parser.add_argument('--binary', action='store_true',
+                        help='Receive the game state in the binary format instead of JSON.')
+    parser.add_argument('--compress', action='store_true', help='Ask the server to compress what it sends.')
+    parser.add_argument('--asyncio', action='store_true',
+                        help='Serve all clients on one asyncio event loop instead of a thread per client.')
+    parser.add_argument('--numpy', action='store_true',
+                        help='Keep the world in NumPy arrays and check collisions of all the moved players at once.')
+    parser.add_argument('--stats-log', type=str, metavar='FILE',
+                        help='Append the metrics of the server to `FILE` every `--stats-interval` seconds.')
+    parser.add_argument('--stats-interval', type=float, help='How often the metrics are logged, in seconds.')
+    parser.add_argument('--profile-dir', type=str, metavar='DIR',
+                        help='Allow profiling the server with `PROFILE` command or SIGUSR1, writing profiles to `DIR`.')
+    parser.add_argument('--bots', type=int, default=10, help='Number of bots if the mode is set to `bots`.')
+    parser.add_argument('--processes', type=int, default=1, help='Number of processes to split the bots across.')
+    parser.add_argument('--behavior', type=str, choices=Bot.BEHAVIORS, default='wander', help='How the bots move.')
+    parser.add_argument('--get-rate', type=float, default=20,
+                        help='`GET` requests per second of a bot. If 0, the bots subscribe to the state instead.')
+    parser.add_argument('--move-rate', type=float, default=30, help='`MOVE` commands per second of a bot.')
+    parser.add_argument('--duration', type=float, default=10, help='How long the bots play, in seconds.')
 
     parser.add_argument('--help', action='help')
     # TODO: add logging & version param
@@ -39,18 +62,25 @@ def main():
     # parser.add_argument('-v', '--version', help='Print version info and exit.')
 
     server_args = ('game_time', 'food_num', 'food_min_size', 'food_max_size', 'restart_time', 'food_probability',
-                   'init_player_size')
+                   'init_player_size', 'tick_rate', 'stats_log', 'stats_interval', 'profile_dir')
+    bot_args = ('bots', 'processes', 'behavior', 'get_rate', 'move_rate', 'duration')
 
     args = parser.parse_args()
     kwargs = dict()
     for k, v in vars(args).copy().items():
-        if v is not None and k not in ('mode', 'gui'):
+        if v is not None and k not in ('mode', 'gui', 'asyncio', 'binary', 'compress', 'numpy') + bot_args:
             kwargs[k] = v
 
     if args.mode == 'server':
         if args.nick is not None:
             print('Argument `--nick` is not required while running in `server` mode.')
             exit(0)
+        if args.binary:
+            print('Argument `--binary` is not required while running in `server` mode.')
+            exit(0)
+        if args.compress:
+            print('Argument `--compress` is not required while running in `server` mode.')
+            exit(0)
 
         if 'width' not in kwargs:
             kwargs['width'] = default.MAP_WIDTH
@@ -61,13 +91,20 @@ def main():
             if param not in kwargs:
                 kwargs[param] = getattr(default, param.upper())
 
-        server = Server(**kwargs)
+        server_class = AsyncServer if args.asyncio else Server
+        server = server_class(**kwargs, vectorized=args.numpy)
     elif args.mode == 'client':
         stop = False
         for param in server_args:
             if param in kwargs:
                 print("Argument `--{}` is not required while running in `client` mode.".format(param))
                 stop = True
+        if args.asyncio:
+            print("Argument `--asyncio` is not required while running in `client` mode.")
+            stop = True
+        if args.numpy:
+            print("Argument `--numpy` is not required while running in `client` mode.")
+            stop = True
         if args.nick is None:
             print("You didn't specify a nick-name or the gui flag. See `--nick` and `--help`.")
             stop = True
@@ -79,7 +116,21 @@ def main():
         if 'height' not in kwargs:
             kwargs['height'] = default.SCREEN_HEIGHT
 
-        client = Client(**kwargs)
+        # Imported here, so that the server & the bots don't need pygame.
+        from jelly.client import Client
+        client = Client(**kwargs, binary=args.binary, compress=args.compress)
+    elif args.mode == 'bots':
+        for param in server_args:
+            if param in kwargs:
+                print("Argument `--{}` is not required while running in `bots` mode.".format(param))
+                exit(0)
+
+        view = (kwargs.get('width', default.SCREEN_WIDTH), kwargs.get('height', default.SCREEN_HEIGHT))
+        stats = run_swarm(args.bots, args.duration, processes=args.processes, prefix=args.nick or 'bot',
+                          host=args.host, port=args.port, behavior=args.behavior, get_rate=args.get_rate,
+                          move_rate=args.move_rate, binary=args.binary, view=view,
+                          compress=args.compress)
+        print(stats.report(args.bots, args.duration))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,67 @@
+"""Allocation budgets of the hot loops of the server & the client, measured with tracemalloc: a change that makes a loop
+allocate more per call, e.g. copy the world for each frame, or keep what it allocates fails here. The loops are the
+ones of benchmarks/allocations.py, which prints the numbers."""
+import tracemalloc
+
+import pytest
+
+from benchmarks.allocations import client_frame, process_moved, RETAINED_LIMIT
+from benchmarks.common import make_server
+
+# Calls measured after warming up.
+CALLS = 500
+# Share of the calls that may exceed the budget, e.g. the moves that eat a food unit, which spawns a new one.
+SLACK = 0.05
+
+
+def measure(function, budget: int, calls: int = CALLS) -> (int, float):
+    """Returns the number of calls of `function` that allocated more than `budget` bytes at once and the bytes retained
+    per call after all of them."""
+    for _ in range(100):
+        function()
+
+    over = 0
+    tracemalloc.start()
+    try:
+        start, _ = tracemalloc.get_traced_memory()
+        for _ in range(calls):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            function()
+            _, peak = tracemalloc.get_traced_memory()
+            if peak - before > budget:
+                over += 1
+        end, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return over, (end - start) / calls
+
+
+def make_world(players: int, food: int):
+    server = make_server(players, food, 5000, 5000)
+    # Tombstones of the eaten food units are bounded by `max_removed`, but it would take too long to reach the bound.
+    server.changes.max_removed = 0
+    return server, list(server.players.nicks())
+
+
+@pytest.mark.parametrize('players, food', [(100, 1000), (400, 4000)])
+def test_client_frame_allocates_the_same_for_any_world(players, food):
+    server, nicks = make_world(players, food)
+    over, retained = measure(lambda: client_frame(server, nicks), 512, calls=50)
+    assert over == 0
+    assert retained <= RETAINED_LIMIT
+
+
+def test_process_moved_stays_within_budget():
+    server, nicks = make_world(100, 1000)
+    # Moves change the world, so what a call retains is only flat on average over many calls.
+    over, retained = measure(lambda: process_moved(server, nicks), 2048, calls=10000)
+    assert over <= 10000 * SLACK
+    assert retained <= RETAINED_LIMIT
+
+
+def test_getting_a_player_allocates_only_the_player():
+    server, nicks = make_world(100, 1000)
+    over, retained = measure(lambda: server.players[nicks[0]], 256)
+    assert over == 0
+    assert retained <= RETAINED_LIMIT
@@ -0,0 +1,96 @@
+"""Checks of the snapshots made of the published worlds, see jelly/world.py: short runs of
+benchmarks/snapshot_stress.py, the races it has found and the bounds of the binary format."""
+import sys
+from itertools import count
+from json import loads
+from random import random
+from threading import Thread, Event
+from time import sleep
+
+import pytest
+
+from benchmarks.common import make_server
+from benchmarks.snapshot_stress import run
+from jelly.metrics import TimedLock
+from jelly.server import Server, Session
+from jelly.snapshot import decode_snapshot
+
+
+class YieldingLock(TimedLock):
+    """Lets the other threads run for a while once Server.publish() has released it, where a race would be."""
+    def __exit__(self, *args):
+        super().__exit__(*args)
+        if sys._getframe(1).f_code.co_name == 'publish':
+            sleep(random() * 0.001)
+
+
+def test_readers_and_replicas_agree_with_the_writer():
+    _, stats, _ = run(readers=4, rate=0, duration=1, live=False)
+    assert stats['errors'] == {}
+    assert stats['ticks'] and stats['updates'] and stats['messages']
+
+
+def test_published_world_never_goes_back():
+    server = make_server(50, 500, 2000, 2000)
+    server.players.mutex = YieldingLock(server.metrics, 'lock_wait_us.players')
+    stop = Event()
+    versions = []
+
+    def publish():
+        session = Session()
+        spawned = 0
+        while not stop.is_set():
+            # Both change the world & publish it from the thread of the handler, like the tick thread does.
+            server.handle_request({Server.SPAWN: 'spawned{}-{}'.format(id(session), spawned)}, session)
+            server.handle_request({Server.DISCONNECT: 'spawned{}-{}'.format(id(session), spawned)}, session)
+            spawned += 1
+
+    def read():
+        while not stop.is_set():
+            versions.append(server.world.version)
+
+    threads = [Thread(target=publish) for _ in range(4)] + [Thread(target=read)]
+    for thread in threads:
+        thread.start()
+    stop.wait(1)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    assert all(a <= b for a, b in zip(versions, versions[1:]))
+    assert server.world.version == server.changes.version
+
+
+def test_view_snapshot_of_a_player_disconnected_since_the_world_was_published():
+    server = make_server(50, 500, 2000, 2000)
+    server.publish()
+    session = Session()
+    session.nick, session.view = 'player0', (800, 600)
+    world = server.world
+    server.players.pop('player0')
+    snapshot = server.snapshot(session=session, world=world)
+    assert 'player0' in snapshot["players"]
+    assert snapshot["rank"] is None
+
+
+def test_replica_catches_up_after_the_food_is_replaced():
+    server = make_server(50, 500, 2000, 2000)
+    session = Session()
+    server.get_data(session)
+    server.regenerate_food()
+    snapshot = loads(server.get_data(session, session.version))
+    assert snapshot["full"]
+    assert {int(food_id): params for food_id, params in snapshot["food"].items()} == server.food.get_food_raw()
+    assert len(server.food.grid) == len(server.food) == 500
+
+
+@pytest.mark.parametrize('vectorized', [False, True])
+def test_binary_snapshot_of_food_ids_past_32_bits(vectorized):
+    server = make_server(10, 0, 2000, 2000, vectorized=vectorized)
+    server.food.ids = count(2 ** 32 - 5)
+    server.spawn_food(10)
+    server.publish()
+    session = Session()
+    session.format = Server.BINARY
+    snapshot = decode_snapshot(server.get_data(session), dict())
+    assert snapshot["food"] == server.food.get_food_raw()
+    assert max(snapshot["food"]) == 2 ** 32 + 4